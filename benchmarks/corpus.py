@@ -0,0 +1,118 @@
+"""
+corpus.py - Synthetic culture-corpus generator for benchmarks.
+
+Produces documents shaped like the Global_Culture_Profiles batch files:
+an overview preamble, then N upper-case culture titles, each followed by M
+section headings (the ones segment_sections recognizes) with K lines of
+"**Field:** value" and free-text content. Output is deterministic per seed.
+
+Usage:
+    python -m benchmarks.corpus --out bench_corpus --cultures 200 --sections 6 --lines 8 --formats txt,docx,xlsx
+"""
+import argparse
+import os
+import random
+
+SECTIONS = [
+    "Orientation", "Economy", "Marriage and Family", "Religion and Expressive Culture",
+    "Kinship", "Political Organization", "Socialization", "Health", "Death and Afterlife",
+]
+FIELDS = ["Region", "Languages", "Religion", "Communication Style", "Touch Norms", "Time Orientation"]
+SYLLABLES = ["KA", "RO", "MI", "TAN", "BU", "LE", "SO", "NGA", "VI", "DO", "ZU", "HAR", "EL", "QUI", "PA"]
+WORDS = (
+    "community elders ritual harvest kinship respect hospitality interpreter ceremony trust "
+    "family village market festival language music tradition household lineage greeting "
+    "collectivist indirect seasonal ancestral migration diaspora clan"
+).split()
+
+
+def culture_names(n, rng):
+    names = set()
+    while len(names) < n:
+        names.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(names)
+
+
+def generate_lines(cultures=50, sections=6, lines=8, seed=0):
+    """Returns the corpus as a list of lines (no trailing newlines)."""
+    rng = random.Random(seed)
+    out = ["Global culture profiles - synthetic benchmark corpus.", "Generated for performance testing only.", ""]
+    for name in culture_names(cultures, rng):
+        out.append(name)
+        for section in (SECTIONS * (sections // len(SECTIONS) + 1))[:sections]:
+            out.append(section)
+            for i in range(lines):
+                if i < len(FIELDS) and i % 2 == 0:
+                    out.append(f"**{FIELDS[i]}:** {rng.choice(WORDS).title()}, {rng.choice(WORDS).title()}")
+                else:
+                    out.append("- " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 14))).capitalize())
+            out.append("")
+    return out
+
+
+def write_txt(lines, path):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+
+
+def write_docx(lines, path):
+    import docx
+    document = docx.Document()
+    for line in lines:
+        document.add_paragraph(line)
+    document.save(path)
+
+
+def write_xlsx(lines, path):
+    import pandas as pd
+    pd.DataFrame({"Content": [line for line in lines if line.strip()]}).to_excel(path, index=False)
+
+
+WRITERS = {"txt": write_txt, "docx": write_docx, "xlsx": write_xlsx}
+
+
+def generate_corpus(out_dir, cultures=50, sections=6, lines=8, formats=("txt",), seed=0):
+    """Writes corpus.<ext> for each requested format into out_dir; returns {ext: path}."""
+    os.makedirs(out_dir, exist_ok=True)
+    corpus = generate_lines(cultures, sections, lines, seed)
+    paths = {}
+    for ext in formats:
+        path = os.path.join(out_dir, f"corpus_{cultures}x{sections}x{lines}.{ext}")
+        WRITERS[ext](corpus, path)
+        paths[ext] = path
+    return paths
+
+
+def generate_entries(n=50, seed=0):
+    """Synthetic .v3.json-style entries for render_cards benchmarks."""
+    rng = random.Random(seed)
+    fields = [
+        "overview", "geographic_context", "historical_background", "family_structure", "gender_roles",
+        "religion_and_spirituality", "dietary_practices", "communication_style", "social_norms_and_etiquette",
+        "interpreter_or_service_notes",
+    ]
+    entries = []
+    for name in culture_names(n, rng):
+        entry = {"culture_name": name.title(), "language_tag": "und", "region": "Oceania"}
+        for field in fields:
+            entry[field] = " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 60)))
+        entries.append(entry)
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic culture corpus for benchmarks.")
+    parser.add_argument("--out", default="bench_corpus", help="Output directory")
+    parser.add_argument("--cultures", type=int, default=50)
+    parser.add_argument("--sections", type=int, default=6)
+    parser.add_argument("--lines", type=int, default=8)
+    parser.add_argument("--formats", default="txt", help="Comma-separated: txt,docx,xlsx")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    paths = generate_corpus(args.out, args.cultures, args.sections, args.lines, args.formats.split(","), args.seed)
+    for ext, path in paths.items():
+        print(f"Wrote {ext}: {path}")
+
+
+if __name__ == "__main__":
+    main()
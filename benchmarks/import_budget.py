@@ -0,0 +1,100 @@
+"""
+import_budget.py - Import-time budget for the pipeline entry points.
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter for
+each entry point, keeps the fastest of --repeat runs, prints the slowest
+imports it pulled in and exits non-zero when a module is over its budget or
+imports one of the heavy modules that must stay lazy (pandas, openai, ...).
+
+Usage:
+    python -m benchmarks.import_budget
+    python -m benchmarks.import_budget --repeat 5 --top 15 --out import_times.json
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Cumulative import time budgets in milliseconds (includes interpreter noise on slow CI boxes).
+BUDGETS_MS = {
+    'cli': 250,
+    'cli_minimal': 250,
+    'run_pipeline': 250,
+}
+# Only imported on first use; an entry point importing any of these at startup is a regression.
+LAZY_MODULES = ('pandas', 'numpy', 'pyarrow', 'openai', 'httpx', 'tiktoken', 'docx', 'openpyxl')
+
+_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def parse_importtime(stderr):
+    """Parses -X importtime output into [(module, self_us, cumulative_us, depth)]."""
+    rows = []
+    for line in stderr.splitlines():
+        m = _LINE.match(line)
+        if m:
+            rows.append((m.group(4), int(m.group(1)), int(m.group(2)), len(m.group(3)) // 2))
+    return rows
+
+
+def measure(module, repeat=3):
+    """Fastest of `repeat` cold imports of module; returns (total_us, rows)."""
+    best = None
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                              cwd=ROOT_DIR, capture_output=True, text=True, check=True)
+        rows = parse_importtime(proc.stderr)
+        total = next(cum for name, _, cum, depth in reversed(rows) if name == module and depth == 0)
+        if best is None or total < best[0]:
+            best = (total, rows)
+    return best
+
+
+def check(budgets=None, repeat=3, top=10):
+    budgets = budgets or BUDGETS_MS
+    results, failures = {}, []
+    for module, budget_ms in budgets.items():
+        total_us, rows = measure(module, repeat)
+        imported = {name for name, _, _, _ in rows}
+        heavy = sorted(m for m in LAZY_MODULES if m in imported)
+        slowest = sorted((r for r in rows if r[0] != module), key=lambda r: r[2], reverse=True)[:top]
+        results[module] = {
+            'total_ms': round(total_us / 1000, 2),
+            'budget_ms': budget_ms,
+            'heavy_imports': heavy,
+            'slowest': [{'module': name, 'self_ms': round(s / 1000, 2), 'cumulative_ms': round(c / 1000, 2)}
+                        for name, s, c, _ in slowest],
+        }
+        if total_us / 1000 > budget_ms or heavy:
+            failures.append(module)
+    return results, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check entry-point import times against a budget")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list per entry point")
+    parser.add_argument("--out", help="Also save the results to this JSON file")
+    args = parser.parse_args()
+
+    results, failures = check(repeat=args.repeat, top=args.top)
+    for module, r in results.items():
+        status = "OVER BUDGET" if module in failures else "ok"
+        print(f"{module:<16}{r['total_ms']:>9.1f} ms  (budget {r['budget_ms']} ms)  {status}")
+        if r['heavy_imports']:
+            print(f"    eagerly imports: {', '.join(r['heavy_imports'])}")
+        for s in r['slowest']:
+            print(f"    {s['module']:<40}{s['cumulative_ms']:>9.2f} ms")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.out}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,313 @@
+"""
+llm_throughput.py - Enrichment throughput against the local mock LLM server.
+
+Starts benchmarks.mock_llm_server in-process, then drives the real GPT code
+paths against it at several concurrency levels:
+
+    enrich_segments   asyncio engine (scripts.segment_by_culture.enrich_segments)
+    parallel_gpt      thread pool over gpt_enrich_culture -> safe_gpt_call, like --parallel_gpt
+    enrich_fields     gpt_enrich_fields_with_openai.enrich_culture_with_ai (needs openai + prompts.json)
+
+For each level it reports successful requests per second, p50/p95/p99
+latency of single HTTP requests and of logical calls (which add queueing
+behind the concurrency limit, retries and backoff), and the number of
+retries, i.e. 429/5xx answers the server injected. enrich_fields goes through
+the openai client, so only its call latency is measured. The LLM response
+cache is switched off so every call reaches the server. safe_gpt_call keeps
+its own backoff base (3 s), so error injection slows parallel_gpt down as it
+would in production.
+
+Usage:
+    python -m benchmarks.llm_throughput --concurrency 1,4,16,64 --latency lognormal:0.2,0.5 --rate-429 0.05
+    python -m benchmarks.llm_throughput --targets enrich_segments --gpt-mode separate --out llm_bench.json
+"""
+import argparse
+import contextlib
+import datetime
+import functools
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from benchmarks.corpus import generate_lines  # noqa: E402
+from benchmarks.mock_llm_server import MockLLMServer  # noqa: E402
+from benchmarks.run_benchmarks import Skip  # noqa: E402
+
+TARGETS = {}
+UNLIMITED = {'GPT_RPM': "1000000", 'GPT_TPM': "1000000000"}
+
+
+def target(name):
+    def register(fn):
+        TARGETS[name] = fn
+        return fn
+    return register
+
+
+class CallLog:
+    """Latency of every logical call and HTTP request, and how many calls raised."""
+
+    def __init__(self):
+        self.latencies = []
+        self.request_latencies = []
+        self.errors = 0
+        self.controller = None  # the engine's ConcurrencyController, when the target has one
+        self._lock = threading.Lock()
+
+    def record(self, seconds, failed):
+        with self._lock:
+            self.latencies.append(seconds)
+            self.errors += failed
+
+    def record_request(self, seconds):
+        with self._lock:
+            self.request_latencies.append(seconds)
+
+    def wrap(self, fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            failed = True
+            try:
+                result = fn(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                self.record(time.perf_counter() - start, failed)
+        return timed
+
+    def wrap_async(self, fn):
+        @functools.wraps(fn)
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            failed = True
+            try:
+                result = await fn(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                self.record(time.perf_counter() - start, failed)
+        return timed
+
+    def transport(self, asynchronous=False):
+        """httpx transport that times each request until its response headers arrive."""
+        import httpx
+        log = self
+
+        class AsyncTimed(httpx.AsyncHTTPTransport):
+            async def handle_async_request(self, request):
+                start = time.perf_counter()
+                try:
+                    return await super().handle_async_request(request)
+                finally:
+                    log.record_request(time.perf_counter() - start)
+
+        class Timed(httpx.HTTPTransport):
+            def handle_request(self, request):
+                start = time.perf_counter()
+                try:
+                    return super().handle_request(request)
+                finally:
+                    log.record_request(time.perf_counter() - start)
+
+        return AsyncTimed() if asynchronous else Timed()
+
+
+@contextlib.contextmanager
+def environment(**values):
+    saved = {k: os.environ.get(k) for k in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+
+def workload(params):
+    from utils import segment_cultures
+    text = "\n".join(generate_lines(params['cultures'], params['sections'], params['lines'], params['seed']))
+    return segment_cultures(text, set())
+
+
+@target("enrich_segments")
+def run_enrich_segments(server, concurrency, segments, params, log):
+    try:
+        from scripts.enrichment_engine import EnrichmentEngine
+        from scripts.segment_by_culture import enrich_segments
+    except ImportError as e:
+        raise Skip(f"enrichment engine unavailable: {e}") from e
+    engine = EnrichmentEngine(concurrency=concurrency, rpm=int(UNLIMITED['GPT_RPM']), tpm=int(UNLIMITED['GPT_TPM']),
+                              api_key="mock", base_url=server.url, backoff_base=params['backoff_base'],
+                              transport=log.transport(asynchronous=True))
+    engine.complete = log.wrap_async(engine.complete)
+    log.controller = engine.controller
+    enrich_segments([dict(s) for s in segments], combined=params['gpt_mode'] == "combined", engine=engine)
+
+
+@target("parallel_gpt")
+def run_parallel_gpt(server, concurrency, segments, params, log):
+    try:
+        from scripts import segment_by_culture as sbc
+    except ImportError as e:
+        raise Skip(f"scripts.segment_by_culture unavailable: {e}") from e
+    with environment(OPENAI_BASE_URL=server.url, OPENAI_API_KEY="mock", GPT_CONCURRENCY=str(concurrency), **UNLIMITED):
+        sbc._engine.cache_clear()
+        engine = sbc.default_engine()
+        engine.transport = log.transport()
+        engine.complete_sync = log.wrap(engine.complete_sync)
+        log.controller = engine.controller
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                futures = [executor.submit(sbc.gpt_enrich_culture, seg['content'], seg['title'],
+                                           sbc.segment_sections(seg['content']),
+                                           combined=params['gpt_mode'] == "combined")
+                           for seg in segments]
+                for f in futures:
+                    f.result()
+        finally:
+            engine.close()
+            sbc._engine.cache_clear()
+
+
+@target("enrich_fields")
+def run_enrich_fields(server, concurrency, segments, params, log):
+    cwd = os.getcwd()
+    os.chdir(ROOT_DIR)  # prompts.json is loaded relative to the repo root
+    try:
+        import openai
+        import gpt_enrich_fields_with_openai as gef
+    except (ImportError, OSError) as e:
+        raise Skip(f"gpt_enrich_fields_with_openai unavailable: {e}") from e
+    finally:
+        os.chdir(cwd)
+    openai.api_base, openai.api_key = server.url, "mock"
+    original = gef.chat_completion
+    gef.chat_completion = log.wrap(original)
+    mode = "structured" if params['gpt_mode'] == "combined" else "per-field"
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(lambda seg: gef.enrich_culture_with_ai(seg['title'], {}, omit_errors=True, mode=mode),
+                              segments))
+    finally:
+        gef.chat_completion = original
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    return statistics.quantiles(sorted_values, n=100, method="inclusive")[q - 1]
+
+
+def run_level(name, server, concurrency, segments, params):
+    log = CallLog()
+    server.reset()
+    start = time.perf_counter()
+    TARGETS[name](server, concurrency, segments, params, log)
+    seconds = time.perf_counter() - start
+    counts = server.stats()
+    calls, requests = sorted(log.latencies), sorted(log.request_latencies)
+    ms = (lambda v: round(v * 1000, 2) if v is not None else None)
+    return {
+        'concurrency': concurrency,
+        'seconds': round(seconds, 4),
+        'calls': len(calls),
+        'failed_calls': log.errors,
+        'requests': counts['requests'],
+        'retries': counts['429'] + counts['5xx'],
+        'rate_limited': counts['429'],
+        'server_errors': counts['5xx'],
+        'requests_per_sec': round(counts['ok'] / seconds, 2) if seconds > 0 else None,
+        'p50_ms': ms(percentile(requests, 50)),
+        'p95_ms': ms(percentile(requests, 95)),
+        'p99_ms': ms(percentile(requests, 99)),
+        'call_p50_ms': ms(percentile(calls, 50)),
+        'call_p95_ms': ms(percentile(calls, 95)),
+        'call_p99_ms': ms(percentile(calls, 99)),
+        'final_limit': log.controller.stats()['limit'] if log.controller else None,
+    }
+
+
+def run_throughput(params, targets=None, levels=(1, 4, 16)):
+    from scripts.llm_cache import configure_default_cache
+    segments = workload(params)
+    configure_default_cache(mode="off")
+    results = {}
+    with MockLLMServer(latency=params['latency'], rate_429=params['rate_429'], rate_5xx=params['rate_5xx'],
+                       retry_after=params['retry_after'], seed=params['seed']) as server:
+        for name in targets or TARGETS:
+            rows = []
+            try:
+                for level in levels:
+                    row = run_level(name, server, level, segments, params)
+                    rows.append(row)
+                    print(f"{name:<16} c={level:<4} {row['requests_per_sec']:>9} req/s  p50 {row['p50_ms']} ms  "
+                          f"p95 {row['p95_ms']} ms  p99 {row['p99_ms']} ms  call p95 {row['call_p95_ms']} ms  "
+                          f"retries {row['retries']}  failed {row['failed_calls']}  limit {row['final_limit']}")
+            except Skip as e:
+                results[name] = {'skipped': str(e)}
+                print(f"{name:<16} skipped ({e})")
+                continue
+            results[name] = rows
+    return {
+        'meta': {
+            'timestamp': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'params': params,
+            'concurrency': list(levels),
+            'segments': len(segments),
+        },
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GPT enrichment throughput against a local mock server")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--targets", help=f"Comma-separated subset of: {', '.join(TARGETS)}")
+    parser.add_argument("--cultures", type=int, default=20)
+    parser.add_argument("--sections", type=int, default=3)
+    parser.add_argument("--lines", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", default="lognormal:0.2,0.5", help="Mock latency distribution")
+    parser.add_argument("--rate-429", type=float, default=0.02)
+    parser.add_argument("--rate-5xx", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, help="Retry-After seconds sent with 429 responses")
+    parser.add_argument("--backoff-base", type=float, default=0.1, help="enrich_segments engine backoff base")
+    parser.add_argument("--gpt-mode", choices=["combined", "separate"], default="combined")
+    parser.add_argument("--out", help="Save the results to this JSON file")
+    args = parser.parse_args()
+
+    params = {'cultures': args.cultures, 'sections': args.sections, 'lines': args.lines, 'seed': args.seed,
+              'latency': args.latency, 'rate_429': args.rate_429, 'rate_5xx': args.rate_5xx,
+              'retry_after': args.retry_after, 'backoff_base': args.backoff_base, 'gpt_mode': args.gpt_mode}
+    targets = args.targets.split(",") if args.targets else None
+    unknown = set(targets or ()) - set(TARGETS)
+    if unknown:
+        parser.error(f"unknown targets: {', '.join(sorted(unknown))}")
+    levels = [int(c) for c in args.concurrency.split(",")]
+    data = run_throughput(params, targets, levels)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        print(f"Results saved to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+"""
+mock_llm_server.py - Local stand-in for the Chat Completions API.
+
+Serves POST /v1/chat/completions (and /chat/completions) from a threaded
+stdlib HTTP server so the GPT paths can be load-tested without an API key or
+quota. Point the pipeline at it with OPENAI_BASE_URL=<url> (or
+openai.api_base for the openai client).
+
+Replies are deterministic: the same request body always gets the same text
+(scripts.batch_requests.fake_reply, valid JSON for combined-mode prompts).
+Latency is drawn from a configurable distribution and a share of requests is
+answered with 429 or 503 instead, or with a 200 whose body has no choices
+(--rate-malformed). Both are decided from a hash of the request
+body and how often that body has been seen, so a run is reproducible no
+matter how concurrent requests interleave, and a retried request can succeed.
+
+Latency specs (seconds):
+    fixed:0.2             always 0.2
+    uniform:0.1,0.5       uniform between 0.1 and 0.5
+    lognormal:0.3,0.5     median 0.3, sigma 0.5 (long right tail, like real APIs)
+    exp:0.3               exponential with mean 0.3
+
+GET /stats returns the request counters as JSON.
+
+Usage:
+    python -m benchmarks.mock_llm_server --port 8089 --latency lognormal:0.3,0.5 --rate-429 0.05 --rate-5xx 0.01
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 python run_pipeline.py input_docs/guide.docx
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from scripts.batch_requests import fake_reply  # noqa: E402
+
+PATHS = ("/v1/chat/completions", "/chat/completions")
+MALFORMED = "malformed"  # decide(): a 200 response without choices
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # benchmarks open many connections at once
+
+
+def parse_latency(spec):
+    """Turns a latency spec ("lognormal:0.3,0.5", ...) into a function rng -> seconds."""
+    kind, _, raw = spec.partition(":")
+    args = [float(x) for x in raw.split(",")] if raw else []
+    if kind == "fixed" and len(args) == 1:
+        return lambda rng: args[0]
+    if kind == "uniform" and len(args) == 2:
+        return lambda rng: rng.uniform(args[0], args[1])
+    if kind == "lognormal" and len(args) == 2:
+        return lambda rng: rng.lognormvariate(math.log(args[0]), args[1])
+    if kind == "exp" and len(args) == 1:
+        return lambda rng: rng.expovariate(1 / args[0]) if args[0] > 0 else 0.0
+    raise ValueError(f"bad latency spec {spec!r}; expected fixed:S, uniform:A,B, lognormal:MEDIAN,SIGMA or exp:MEAN")
+
+
+class MockLLMServer:
+    def __init__(self, host="127.0.0.1", port=0, latency="fixed:0", rate_429=0.0, rate_5xx=0.0,
+                 retry_after=None, seed=0, rate_malformed=0.0):
+        self.sample_latency = parse_latency(latency)
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.rate_malformed = rate_malformed
+        self.retry_after = retry_after
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._seen = {}
+        self.reset()
+        self._httpd = _HTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def reset(self):
+        with self._lock:
+            self._seen.clear()
+            self.counts = {'requests': 0, 'ok': 0, '429': 0, '5xx': 0, 'malformed': 0, 'bad_request': 0}
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+    def decide(self, body):
+        """(status or MALFORMED, latency) for this request body, reproducible for a given seed."""
+        raw = json.dumps(body, sort_keys=True)
+        with self._lock:
+            self.counts['requests'] += 1
+            attempt = self._seen.get(raw, 0)
+            self._seen[raw] = attempt + 1
+        digest = hashlib.sha256(f"{self.seed}|{attempt}|{raw}".encode("utf-8")).digest()
+        rng = random.Random(digest)
+        roll = rng.random()
+        if roll < self.rate_429:
+            status = 429
+        elif roll < self.rate_429 + self.rate_5xx:
+            status = 503
+        elif roll < self.rate_429 + self.rate_5xx + self.rate_malformed:
+            status = MALFORMED
+        else:
+            status = 200
+        return status, max(0.0, self.sample_latency(rng))
+
+    def respond(self, body):
+        """Chat Completions response body for a request body."""
+        prompt = " ".join(m.get('content') or "" for m in body['messages'])
+        text = fake_reply(body)
+        prompt_tokens, completion_tokens = len(prompt) // 4 + 1, len(text) // 4 + 1
+        return {
+            'id': "chatcmpl-" + hashlib.sha256(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest()[:24],
+            'object': "chat.completion",
+            'created': 0,
+            'model': body.get('model', "mock"),
+            'choices': [{'index': 0, 'message': {'role': "assistant", 'content': text}, 'finish_reason': "stop"}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens},
+        }
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, payload, headers=()):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path.rstrip("/") in ("/stats", "/v1/stats"):
+                    self._send(200, server.stats())
+                else:
+                    self._send(404, {'error': {'message': "not found"}})
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path not in PATHS:
+                    self._send(404, {'error': {'message': "not found"}})
+                    return
+                try:
+                    body = json.loads(body)
+                    body['messages'][-1]['content']
+                except (ValueError, KeyError, IndexError, TypeError):
+                    server._count('bad_request')
+                    self._send(400, {'error': {'message': "invalid request body", 'type': "invalid_request_error"}})
+                    return
+                status, latency = server.decide(body)
+                time.sleep(latency)
+                if status == 429:
+                    server._count('429')
+                    headers = [("Retry-After", str(server.retry_after))] if server.retry_after is not None else []
+                    self._send(429, {'error': {'message': "Rate limit reached (mock)", 'type': "rate_limit_error"}},
+                               headers)
+                elif status == MALFORMED:
+                    server._count('malformed')
+                    self._send(200, {'object': "chat.completion", 'choices': []})
+                elif status != 200:
+                    server._count('5xx')
+                    self._send(status, {'error': {'message': "Service unavailable (mock)", 'type': "server_error"}})
+                else:
+                    server._count('ok')
+                    self._send(200, server.respond(body))
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="mock-llm-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Chat Completions stand-in for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", default="lognormal:0.3,0.5", help="Latency distribution (see module docs)")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="Share of requests answered with 503")
+    parser.add_argument("--rate-malformed", type=float, default=0.0, help="Share of 200 responses without choices")
+    parser.add_argument("--retry-after", type=float, help="Retry-After seconds sent with 429 responses")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = MockLLMServer(args.host, args.port, args.latency, args.rate_429, args.rate_5xx, args.retry_after, args.seed,
+                           args.rate_malformed)
+    print(f"Mock LLM server on {server.url}  (export OPENAI_BASE_URL={server.url})")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+        print(f"Served: {server.stats()}")
+
+
+if __name__ == "__main__":
+    main()
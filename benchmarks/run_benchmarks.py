@@ -0,0 +1,310 @@
+"""
+run_benchmarks.py - Local benchmark suite for the culture pipeline.
+
+Generates a synthetic corpus (see benchmarks/corpus.py), times the hot paths
+of the pipeline and saves the results to JSON (throughput is in segments per
+second unless a benchmark records another unit, e.g. bytes for load_content); `compare` diffs two result
+files and exits non-zero when a benchmark regressed past the threshold.
+
+Usage:
+    python -m benchmarks.run_benchmarks run --cultures 200 --sections 6 --lines 8 --out bench.json
+    python -m benchmarks.run_benchmarks run --only segment_cultures,postprocess_segments
+    python -m benchmarks.run_benchmarks compare baseline.json bench.json --threshold 0.10
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from benchmarks.corpus import generate_corpus, generate_entries  # noqa: E402
+
+BENCHMARKS = {}
+
+
+class Skip(Exception):
+    """Raised by a benchmark setup when an optional dependency is missing."""
+
+
+def benchmark(name):
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+def _corpus_segments(ctx):
+    from utils import load_content, segment_cultures
+    from core import enrich_metadata
+    segments = segment_cultures(load_content(ctx['corpus']['txt']), set())
+    for seg in segments:
+        enrich_metadata(seg, ctx['corpus']['txt'], "20250101_000000")
+        seg['summary'] = seg['content'][:150]
+        seg['tags'] = "culture,kinship"
+    return segments
+
+
+@benchmark("segment_cultures")
+def bench_segment_cultures(ctx):
+    from utils import load_content, segment_cultures
+    text = load_content(ctx['corpus']['txt'])
+    return (lambda: segment_cultures(text, set())), len(segment_cultures(text, set()))
+
+
+@benchmark("segment_sections")
+def bench_segment_sections(ctx):
+    try:
+        from scripts.segment_by_culture import segment_sections
+    except ImportError as e:
+        raise Skip(f"scripts.segment_by_culture unavailable: {e}") from e
+    contents = [seg['content'] for seg in _corpus_segments(ctx)]
+    items = len(contents) * ctx['params']['sections']
+    return (lambda: [segment_sections(c) for c in contents]), items
+
+
+@benchmark("tag_extractor")
+def bench_tag_extractor(ctx):
+    try:
+        from scripts.segment_by_culture import confident_tags, fit_tagger
+    except ImportError as e:
+        raise Skip(f"scripts.segment_by_culture unavailable: {e}") from e
+    segments = _corpus_segments(ctx)
+    return (lambda: confident_tags(fit_tagger(segments), segments)), len(segments)
+
+
+def _bench_load(ctx, ext):
+    from utils import load_content
+    if ext not in ctx['corpus']:
+        raise Skip(f"no {ext} corpus (python-docx/openpyxl missing?)")
+    path = ctx['corpus'][ext]
+    return (lambda: load_content(path)), os.path.getsize(path), "bytes"
+
+
+@benchmark("load_content_txt")
+def bench_load_txt(ctx):
+    return _bench_load(ctx, "txt")
+
+
+@benchmark("load_content_docx")
+def bench_load_docx(ctx):
+    return _bench_load(ctx, "docx")
+
+
+@benchmark("load_content_xlsx")
+def bench_load_xlsx(ctx):
+    return _bench_load(ctx, "xlsx")
+
+
+@benchmark("postprocess_segments")
+def bench_postprocess(ctx):
+    from core import postprocess_segments
+    segments = [dict(s) for s in _corpus_segments(ctx)]
+    return (lambda: postprocess_segments([dict(s) for s in segments])), len(segments)
+
+
+@benchmark("postprocess_frame")
+def bench_postprocess_frame(ctx):
+    import pandas as pd
+    from core import postprocess_frame
+    frame = pd.DataFrame([dict(s) for s in _corpus_segments(ctx)])
+    return (lambda: postprocess_frame(frame)), len(frame)
+
+
+@benchmark("update_repo_csv")
+def bench_update_repo(ctx):
+    from core import postprocess_segments, update_repo_csv
+    segments = postprocess_segments(_corpus_segments(ctx))
+    repo = os.path.join(ctx['tmp'], "repo.csv")
+
+    def run():
+        if os.path.exists(repo):
+            os.remove(repo)
+        update_repo_csv(segments, repo)
+        update_repo_csv(segments, repo)
+    return run, 2 * len(segments)
+
+
+def _bench_export(ctx, fmt, suffix):
+    from core import postprocess_segments, export_segments
+    segments = postprocess_segments(_corpus_segments(ctx))
+    if fmt == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError as e:
+            raise Skip("pyarrow not installed") from e
+    path = os.path.join(ctx['tmp'], f"out.{suffix}")
+    return (lambda: export_segments(segments, path, fmt)), len(segments)
+
+
+@benchmark("export_csv")
+def bench_export_csv(ctx):
+    return _bench_export(ctx, "csv", "csv")
+
+
+@benchmark("export_jsonl")
+def bench_export_jsonl(ctx):
+    return _bench_export(ctx, "jsonl", "jsonl")
+
+
+@benchmark("export_parquet")
+def bench_export_parquet(ctx):
+    return _bench_export(ctx, "parquet", "parquet")
+
+
+@benchmark("export_markdown_dir")
+def bench_export_markdown_dir(ctx):
+    from core import postprocess_segments, export_segments_markdown_bulk
+    segments = postprocess_segments(_corpus_segments(ctx))
+    out = os.path.join(ctx['tmp'], "md")
+    return (lambda: export_segments_markdown_bulk(segments, out)), len(segments)
+
+
+@benchmark("export_markdown_zip")
+def bench_export_markdown_zip(ctx):
+    from core import postprocess_segments, export_segments_markdown_bulk
+    segments = postprocess_segments(_corpus_segments(ctx))
+    out = os.path.join(ctx['tmp'], "md.zip")
+    return (lambda: export_segments_markdown_bulk(segments, out)), len(segments)
+
+
+@benchmark("render_cards")
+def bench_render_cards(ctx):
+    try:
+        from render_cards import render_card
+    except ImportError as e:
+        raise Skip(f"render_cards unavailable: {e}") from e
+    entries = generate_entries(ctx['params']['cultures'])
+    out_dir = os.path.join(ctx['tmp'], "cards")
+    os.makedirs(out_dir, exist_ok=True)
+    sections = {"Cultural Background": ["overview", "geographic_context", "historical_background"],
+                "Social Structure": ["family_structure", "gender_roles"]}
+
+    def run():
+        for i, entry in enumerate(entries):
+            render_card(entry, os.path.join(out_dir, f"{i}.html"), sections=sections, labels={})
+    return run, len(entries)
+
+
+def time_call(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def run_suite(params, only=None, repeat=3):
+    tmp = tempfile.mkdtemp(prefix="culture_bench_")
+    formats = ["txt"]
+    for ext, module in (("docx", "docx"), ("xlsx", "openpyxl")):
+        try:
+            __import__(module)
+            formats.append(ext)
+        except ImportError:
+            pass
+    cwd = os.getcwd()
+    os.chdir(ROOT_DIR)  # render_cards loads templates/ relative to the repo root
+    try:
+        corpus = generate_corpus(os.path.join(tmp, "corpus"), params['cultures'], params['sections'],
+                                 params['lines'], formats, params['seed'])
+        ctx = {'corpus': corpus, 'tmp': tmp, 'params': params}
+        results = {}
+        for name, setup in BENCHMARKS.items():
+            if only and name not in only:
+                continue
+            try:
+                fn, items, *unit = setup(ctx)
+            except Skip as e:
+                results[name] = {'skipped': str(e)}
+                print(f"{name:<24} skipped ({e})")
+                continue
+            timings = time_call(fn, repeat)
+            median = statistics.median(timings)
+            results[name] = {
+                'repeat': repeat,
+                'seconds_min': round(min(timings), 6),
+                'seconds_median': round(median, 6),
+                'seconds_mean': round(statistics.mean(timings), 6),
+                'items': items,
+                'unit': unit[0] if unit else "items",
+                'items_per_sec': round(items / median, 2) if median > 0 else None,
+            }
+            print(f"{name:<24} median {median * 1000:9.2f} ms  {results[name]['items_per_sec']} {results[name]['unit']}/s")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp, ignore_errors=True)
+    return {
+        'meta': {
+            'timestamp': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'params': params,
+        },
+        'results': results,
+    }
+
+
+def compare_results(baseline, current, threshold=0.10):
+    """Returns (rows, regressions); a regression is a median slowdown beyond threshold."""
+    rows, regressions = [], []
+    for name, cur in current['results'].items():
+        base = baseline['results'].get(name)
+        if not base or 'skipped' in base or 'skipped' in cur:
+            continue
+        ratio = cur['seconds_median'] / base['seconds_median'] if base['seconds_median'] else float('inf')
+        rows.append((name, base['seconds_median'], cur['seconds_median'], ratio))
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Culture pipeline benchmark suite")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_p = sub.add_parser("run", help="Run benchmarks and save results to JSON")
+    run_p.add_argument("--cultures", type=int, default=200)
+    run_p.add_argument("--sections", type=int, default=6)
+    run_p.add_argument("--lines", type=int, default=8)
+    run_p.add_argument("--seed", type=int, default=0)
+    run_p.add_argument("--repeat", type=int, default=3)
+    run_p.add_argument("--only", help="Comma-separated benchmark names")
+    run_p.add_argument("--out", default="bench_results.json")
+    cmp_p = sub.add_parser("compare", help="Diff two result files")
+    cmp_p.add_argument("baseline")
+    cmp_p.add_argument("current")
+    cmp_p.add_argument("--threshold", type=float, default=0.10, help="Allowed slowdown ratio (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        params = {'cultures': args.cultures, 'sections': args.sections, 'lines': args.lines, 'seed': args.seed}
+        only = set(args.only.split(",")) if args.only else None
+        data = run_suite(params, only=only, repeat=args.repeat)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        print(f"Results saved to {args.out}")
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+    rows, regressions = compare_results(baseline, current, args.threshold)
+    print(f"{'benchmark':<24}{'baseline_ms':>13}{'current_ms':>12}{'change':>9}")
+    for name, base, cur, ratio in rows:
+        flag = "  REGRESSION" if name in regressions else ""
+        print(f"{name:<24}{base * 1000:>13.2f}{cur * 1000:>12.2f}{(ratio - 1) * 100:>+8.1f}%{flag}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
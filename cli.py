@@ -3,8 +3,11 @@ cli.py - Command-line interface for the Global Culture Project pipeline.
 Calls core.py functions for batch processing, enrichment, and export.
 """
 import argparse
+import os
 import sys
 from core import process_file, postprocess_segments, export_segments_csv, export_segments_markdown, export_segments_per_markdown, update_repo_csv
+from core import export_segments, EXPORT_FORMATS
+from telemetry import Telemetry
 
 def main():
     parser = argparse.ArgumentParser(description="Global Culture Project CLI")
@@ -13,11 +16,54 @@ def main():
     parser.add_argument('--section-summaries', action='store_true', help='Add section-level summaries')
     parser.add_argument('--csv', help='Export all segments to this CSV file')
     parser.add_argument('--md', help='Export all segments to this Markdown file')
-    parser.add_argument('--md-dir', help='Export each segment as Markdown to this directory')
+    parser.add_argument('--out', help='Export all segments to this path in --format')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv', help='Format for --out (csv, jsonl, parquet, md)')
+    parser.add_argument('--compression', default='snappy', help='Parquet compression codec (snappy, zstd, gzip, none)')
+    parser.add_argument('--row-group-size', type=int, help='Parquet row group size (rows)')
+    parser.add_argument('--md-dir', help='Export each segment as Markdown to this directory (or .zip/.tar/.tar.gz archive)')
+    parser.add_argument('--md-workers', type=int, help='Thread pool size for per-segment Markdown export')
     parser.add_argument('--repo', help='Update the global repo CSV with new segments')
     parser.add_argument('--known-cultures', help='Path to known_cultures.txt')
+    parser.add_argument('--gpt-concurrency', type=int, help='Max concurrent GPT requests (default: $GPT_CONCURRENCY or 8)')
+    parser.add_argument('--gpt-rpm', type=int, help='GPT requests per minute limit (default: $GPT_RPM or 500)')
+    parser.add_argument('--gpt-mode', choices=('combined', 'separate'), default='combined', help='combined: one JSON request per segment; separate: one request per field')
+    parser.add_argument('--gpt-tpm', type=int, help='GPT tokens per minute limit (default: $GPT_TPM or 90000)')
+    parser.add_argument('--gpt-fixed-concurrency', action='store_true', help='Keep --gpt-concurrency requests in flight instead of adapting (AIMD) to rate limits')
+    parser.add_argument('--gpt-fallback-model', help='Model to use while the circuit breaker of the main model is open (default: $GPT_FALLBACK_MODEL; none defers the work)')
+    parser.add_argument('--gpt-breaker-cooldown', type=float, help='Seconds an open circuit breaker fails fast before probing again (default: $GPT_BREAKER_COOLDOWN or 30)')
+    parser.add_argument('--llm-cache', help='LLM response cache path (default: $LLM_CACHE_PATH or .llm_cache.sqlite)')
+    parser.add_argument('--llm-cache-mode', choices=('rw', 'ro', 'replay', 'off'), help='rw, ro, replay (never call the API) or off')
+    parser.add_argument('--profile', metavar='DIR', help='cProfile each stage; write .pstats, collapsed stacks and a top-20 report to DIR')
+    parser.add_argument('--estimate', action='store_true', help='Dry run: report GPT requests, tokens, cost and wall time, then exit')
     args = parser.parse_args()
 
+    enrich_options = {k: v for k, v in (('concurrency', args.gpt_concurrency), ('rpm', args.gpt_rpm),
+                                        ('tpm', args.gpt_tpm), ('fallback_model', args.gpt_fallback_model),
+                                        ('breaker_cooldown', args.gpt_breaker_cooldown)) if v}
+    enrich_options['combined'] = args.gpt_mode == 'combined'
+    if args.gpt_fixed_concurrency:
+        enrich_options['adaptive'] = False
+    if args.estimate:
+        from core import estimate_enrichment
+        from scripts.cost_estimate import format_estimate
+        from scripts.llm_cache import configure_default_cache
+        configure_default_cache(args.llm_cache, 'off' if args.llm_cache_mode == 'off' else 'ro')
+        print(format_estimate(estimate_enrichment(args.input, section_summaries=args.section_summaries,
+                                                  known_cultures_path=args.known_cultures,
+                                                  enrich_options=enrich_options)))
+        return
+
+    llm_cache = None
+    if args.gpt:
+        from scripts.llm_cache import configure_default_cache
+        llm_cache = configure_default_cache(args.llm_cache, args.llm_cache_mode)
+    telemetry = Telemetry()
+    profiler = None
+    if args.profile:
+        from profiling import StageProfiler
+        profiler = StageProfiler(args.profile)
+        telemetry.observers.append(profiler)
+
     all_segments = []
     for filepath in args.input:
         segments = process_file(
@@ -25,22 +71,46 @@ def main():
             use_gpt=args.gpt,
             section_summaries=args.section_summaries,
             known_cultures_path=args.known_cultures,
+            telemetry=telemetry,
+            enrich_options=enrich_options,
         )
-        segments = postprocess_segments(segments)
+        with telemetry.stage('postprocess', file=filepath, items=len(segments)):
+            segments = postprocess_segments(segments)
         all_segments.extend(segments)
 
     if args.csv:
-        export_segments_csv(all_segments, args.csv)
+        with telemetry.stage('export:csv', items=len(all_segments)):
+            export_segments_csv(all_segments, args.csv)
         print(f"Exported {len(all_segments)} segments to {args.csv}")
+    if args.out:
+        export_options = {}
+        if args.format == 'parquet':
+            export_options = {
+                'compression': None if args.compression == 'none' else args.compression,
+                'row_group_size': args.row_group_size,
+            }
+        with telemetry.stage(f'export:{args.format}', items=len(all_segments)):
+            export_segments(all_segments, args.out, args.format, **export_options)
+        print(f"Exported {len(all_segments)} segments to {args.out} ({args.format})")
     if args.md:
-        export_segments_markdown(all_segments, args.md)
+        with telemetry.stage('export:md', items=len(all_segments)):
+            export_segments_markdown(all_segments, args.md)
         print(f"Exported Markdown to {args.md}")
     if args.md_dir:
-        export_segments_per_markdown(all_segments, args.md_dir)
-        print(f"Exported Markdown files to {args.md_dir}")
+        with telemetry.stage('export:markdown', items=len(all_segments)):
+            md_stats = export_segments_per_markdown(all_segments, args.md_dir, max_workers=args.md_workers)
+        print(f"Exported {md_stats['files']} Markdown files to {args.md_dir} ({md_stats['files_per_sec']} files/sec)")
     if args.repo:
-        update_repo_csv(all_segments, args.repo)
+        with telemetry.stage('export:repo', items=len(all_segments)):
+            update_repo_csv(all_segments, args.repo)
         print(f"Updated repo CSV at {args.repo}")
+    if profiler is not None:
+        profiler.write()
+        print(telemetry.format_summary())
+        print(f"Stage profiles written to {args.profile} (see {os.path.join(args.profile, 'report.txt')})")
+    if llm_cache is not None:
+        from scripts.llm_cache import format_stats
+        print(format_stats(llm_cache.stats()))
 
 if __name__ == "__main__":
     main()
@@ -5,7 +5,7 @@
 # - Applies title-based segmentation (via utils.segment_cultures)
 # - Optionally enriches data with GPT-generated summaries, tags
 # - Adds metadata (run_id, segment_id, language detection, confidence)
-# - Supports full CSV and Markdown export (merged or per-segment)
+# - Supports full CSV, JSONL, Parquet and Markdown export (merged, per-segment, or a single .zip/.tar archive)
 # - Updates a global repo CSV, avoids duplicates
 #
 # 🧪 Expects enrich_segments() and langdetect to be available but degrades gracefully if not.
@@ -15,7 +15,7 @@
 core.py - Core logic for the Global Culture Project pipeline.
 Handles file IO, segmentation, enrichment, validation, and export.
 
-Field Reference (core.py segment dict fields):
+Field Reference (segment fields; segment.Segment records or plain dicts):
 
 | Field              | Purpose                                 |
 |--------------------|-----------------------------------------|
@@ -34,17 +34,25 @@ Field Reference (core.py segment dict fields):
 
 import os
 import re
+import io
+import csv
+import json
+import hashlib
+import time
 import uuid
 import datetime
-import pandas as pd
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from utils import load_content, segment_cultures, load_known_cultures
+from telemetry import stage
 import logging
 import sys
 
 logging.basicConfig(filename='segmenter.log', level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 
 try:
-    from scripts.segment_by_culture import enrich_segments
+    from scripts.segment_by_culture import enrich_segments, gpt_configured
 except ImportError:
     enrich_segments = None
 
@@ -74,48 +82,239 @@ def process_file(
     use_gpt: bool = True,
     section_summaries: bool = True,
     known_cultures_path: str = None,
+    telemetry=None,
+    journal=None,
+    enrich_options=None,
 ) -> list:
+    """
+    Loads, segments and (optionally) enriches one file. enrich_options are
+    passed to enrich_segments (model, concurrency, rpm, tpm, combined); with
+    combined=False, tags come from a tagger fitted on the whole file where it
+    is confident, and from GPT otherwise. With a journal
+    (journal.RunJournal), enriched segments are checkpointed as they finish
+    and segments enriched by an earlier attempt of the run are restored.
+    """
     logging.info(f"Processing {filepath} with GPT={use_gpt}, section_summaries={section_summaries}")
     known_cultures = load_known_cultures(known_cultures_path) if known_cultures_path else set()
-    text = load_content(filepath)
-    segments = segment_cultures(text, known_cultures)
-    ts = timestamp()
-    for seg in segments:
-        enrich_metadata(seg, filepath, ts)
-    if use_gpt and enrich_segments:
-        segments = enrich_segments(segments, section_summaries=section_summaries)
+    with stage(telemetry, "load", file=filepath, items=1) as rec:
+        text = load_content(filepath)
+        rec.nbytes = os.path.getsize(filepath)
+    with stage(telemetry, "segment", file=filepath, nbytes=len(text)) as rec:
+        segments = segment_cultures(text, known_cultures)
+        ts = timestamp()
+        for seg in segments:
+            enrich_metadata(seg, filepath, ts)
+        rec.items = len(segments)
+    if use_gpt and enrich_segments and not gpt_configured():
+        logging.warning("GPT enrichment requested but neither OPENAI_API_KEY nor OPENAI_BASE_URL is set; skipping")
+    elif use_gpt and enrich_segments:
+        options = dict(enrich_options or {})
+        if not options.get('combined', True):
+            from scripts.segment_by_culture import fit_tagger
+            options['tagger'] = fit_tagger(segments)
+        with stage(telemetry, "enrich", file=filepath, items=len(segments)):
+            if journal is not None:
+                segments = journal.enrich(segments, lambda todo, on_done: enrich_segments(
+                    todo, section_summaries=section_summaries, on_done=on_done, **options))
+            else:
+                segments = enrich_segments(segments, section_summaries=section_summaries, **options)
     # Language detection
     if langdetect_available:
-        for seg in segments:
-            try:
-                seg["title_lang"] = detect(seg['title'])
-            except Exception:
-                seg["title_lang"] = "und"
+        with stage(telemetry, "langdetect", file=filepath, items=len(segments)):
+            for seg in segments:
+                try:
+                    seg["title_lang"] = detect(seg['title'])
+                except Exception:
+                    seg["title_lang"] = "und"
     logging.info(f"Segmented {len(segments)} segments from {filepath}")
     return segments
 
-def postprocess_segments(segments: list) -> list:
+def estimate_enrichment(files, section_summaries=True, known_cultures_path=None, enrich_options=None, latency=None):
+    """
+    Dry run of process_file(..., use_gpt=True) over files: segments them and
+    returns the cost/time estimate of the GPT requests (see scripts.cost_estimate)
+    without sending any.
+    """
+    from scripts.cost_estimate import DEFAULT_LATENCY_S, Estimate, estimate_segments
+    from scripts.segment_by_culture import default_engine, fit_tagger
+    options = dict(enrich_options or {})
+    combined = options.pop('combined', True)
+    engine = default_engine(**options)
+    estimate = Estimate.for_engine(engine, latency or DEFAULT_LATENCY_S)
+    for filepath in files:
+        segments = process_file(filepath, use_gpt=False, known_cultures_path=known_cultures_path)
+        estimate_segments(segments, section_summaries=section_summaries, combined=combined, engine=engine,
+                          estimate=estimate, tagger=None if combined else fit_tagger(segments))
+    return estimate.summary()
+
+ATTENTION_CONFIDENCE = ('low', 'medium')
+MIN_SUMMARY_LENGTH = 100
+MIN_CONTENT_LENGTH = 200
+
+def postprocess_segments(segments):
+    """
+    Fills segment_id and derives confidence_score / needs_attention.
+    A DataFrame or Arrow table is handled column-wise by postprocess_frame.
+
+    The pipeline entry points (run_pipeline, cli, the UIs) pass lists of
+    segment dicts and take the per-dict loop: converting a list to a frame
+    and back costs more than the column-wise rules save (about 2.4x slower
+    on 50k segments), so they are deliberately left on lists.
+    """
+    pd = sys.modules.get('pandas')  # a DataFrame implies pandas is already imported
+    if (pd is not None and isinstance(segments, pd.DataFrame)) or hasattr(segments, 'to_pandas'):
+        return postprocess_frame(segments)
     for seg in segments:
         if 'segment_id' not in seg:
             seg['segment_id'] = str(uuid.uuid4())
         # Improved confidence heuristics
         summary = seg.get('summary', '')
         if 'summary_quality_score' in seg:
-            seg['confidence_score'] = seg['summary_quality_score']
-        elif len(summary) < 100 or summary.endswith('...'):
-            seg['confidence_score'] = 'medium'
+            confidence = seg['summary_quality_score']
+        elif len(summary) < MIN_SUMMARY_LENGTH or summary.endswith('...'):
+            confidence = 'medium'
         else:
-            seg['confidence_score'] = 'high'
+            confidence = 'high'
+        seg['confidence_score'] = confidence
         seg['needs_attention'] = (
-            seg.get('confidence_score') in ['low', 'medium']
-            or len(seg.get('content', '')) < 200
+            confidence in ATTENTION_CONFIDENCE
+            or len(seg.get('content', '')) < MIN_CONTENT_LENGTH
             or not seg.get('tags')
         )
     return segments
 
+def _filled(df, column, fill=''):
+    import pandas as pd
+    if column not in df:
+        return pd.Series(fill, index=df.index, dtype=object)
+    col = df[column]
+    if col.dtype != object and pd.api.types.is_string_dtype(col):
+        return col.fillna(fill)
+    return col.where(col.notna(), fill).astype(object)
+
+def _uuid4_strings(n: int) -> list:
+    """n random UUID4 strings, built from one os.urandom call instead of n uuid4() objects."""
+    import numpy as np
+    raw = np.frombuffer(os.urandom(16 * n), dtype=np.uint8).reshape(n, 16).copy()
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+    h = raw.tobytes().hex()
+    return [f"{h[i:i + 8]}-{h[i + 8:i + 12]}-{h[i + 12:i + 16]}-{h[i + 16:i + 20]}-{h[i + 20:i + 32]}"
+            for i in range(0, 32 * n, 32)]
+
+def postprocess_frame(frame):
+    """
+    Vectorized postprocess_segments for a pandas DataFrame or pyarrow Table.
+    Matches the per-dict rules, with null cells treated as missing keys.
+    Returns a new DataFrame. A library API for callers that already hold
+    columnar data (e.g. a loaded parquet export); it only pays off when the
+    data stays columnar afterwards.
+    """
+    import pandas as pd
+    if not isinstance(frame, pd.DataFrame):
+        frame = frame.to_pandas()
+    df = frame.copy()
+    if 'segment_id' not in df:
+        df['segment_id'] = None
+    missing_id = df['segment_id'].isna()
+    if missing_id.any():
+        df['segment_id'] = df['segment_id'].astype(object)
+        df.loc[missing_id, 'segment_id'] = _uuid4_strings(int(missing_id.sum()))
+    summary = _filled(df, 'summary')
+    if summary.dtype == object:
+        summary = summary.astype(str)
+    medium = (summary.str.len() < MIN_SUMMARY_LENGTH) | summary.str.endswith('...')
+    confidence = pd.Series(medium.map({True: 'medium', False: 'high'}), index=df.index, dtype=object)
+    if 'summary_quality_score' in df:
+        scored = df['summary_quality_score'].notna()
+        confidence = confidence.where(~scored, df['summary_quality_score'].astype(object))
+    df['confidence_score'] = confidence
+    tag_lengths = _filled(df, 'tags').str.len()
+    df['needs_attention'] = (
+        confidence.isin(ATTENTION_CONFIDENCE)
+        | (_filled(df, 'content').str.len() < MIN_CONTENT_LENGTH)
+        | (tag_lengths == 0)
+    ).astype(bool)
+    return df
+
+SEGMENT_FIELDS = [
+    'title', 'content', 'tags', 'summary', 'summary_quality_score', 'confidence_score',
+    'segment_id', 'run_id', 'source_file', 'title_lang', 'needs_attention',
+]
+EXPORT_FORMATS = ('csv', 'jsonl', 'parquet', 'md')
+FORMAT_EXTENSIONS = {'csv': 'csv', 'jsonl': 'jsonl', 'parquet': 'parquet', 'md': 'md'}
+
+def split_tags(tags) -> list:
+    if tags is None or (isinstance(tags, float) and tags != tags):
+        return []
+    if isinstance(tags, (list, tuple)):
+        return [str(t).strip() for t in tags if str(t).strip()]
+    return [t.strip() for t in str(tags).split(',') if t.strip()]
+
+def segment_record(seg) -> dict:
+    """Return a typed copy of a segment: tags as a list, needs_attention as a bool."""
+    rec = dict(seg)
+    if 'tags' in rec:
+        rec['tags'] = split_tags(rec['tags'])
+    if 'needs_attention' in rec:
+        rec['needs_attention'] = bool(rec['needs_attention'])
+    return rec
+
+def segment_arrow_schema(extra_fields=()):
+    """Arrow schema for core segments; unknown extra fields are stored as strings."""
+    import pyarrow as pa
+    types = {'tags': pa.list_(pa.string()), 'needs_attention': pa.bool_()}
+    fields = [pa.field(name, types.get(name, pa.string())) for name in SEGMENT_FIELDS]
+    fields += [pa.field(name, pa.string()) for name in extra_fields]
+    return pa.schema(fields)
+
+def extra_fields(records) -> list:
+    extra = []
+    for rec in records:
+        for key in rec:
+            if key not in SEGMENT_FIELDS and key not in extra:
+                extra.append(key)
+    return extra
+
+def segments_to_arrow(segments: list, schema=None):
+    import pyarrow as pa
+    records = [segment_record(seg) for seg in segments]
+    if schema is None:
+        schema = segment_arrow_schema(extra_fields(records))
+    columns = {}
+    for field in schema:
+        values = [rec.get(field.name) for rec in records]
+        if pa.types.is_string(field.type):
+            values = [None if v is None else str(v) for v in values]
+        columns[field.name] = values
+    return pa.table(columns, schema=schema)
+
+def csv_columns(segments) -> list:
+    """CSV header for segments: SEGMENT_FIELDS, then extra keys in first-seen order."""
+    return SEGMENT_FIELDS + extra_fields(segments)
+def csv_rows(segments, columns):
+    return ([_csv_value(seg.get(c)) for c in columns] for seg in segments)
+
 def export_segments_csv(segments: list, path: str):
-    df = pd.DataFrame(segments)
-    df.to_csv(path, index=False)
+    """Same columns and cell formatting as SegmentStreamWriter's csv output."""
+    columns = csv_columns(segments)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        writer.writerows(csv_rows(segments, columns))
+
+def export_segments_jsonl(segments: list, path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        for seg in segments:
+            f.write(json.dumps(segment_record(seg), ensure_ascii=False, default=str) + "\n")
+
+def export_segments_parquet(segments: list, path: str, compression: str = "snappy", row_group_size: int = None):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("pyarrow is required for Parquet export. Install with 'pip install pyarrow'.") from e
+    table = segments_to_arrow(segments)
+    pq.write_table(table, path, compression=compression, row_group_size=row_group_size)
 
 def markdown_with_frontmatter(seg):
     """Return Markdown with YAML frontmatter for a segment."""
@@ -135,14 +334,246 @@ def export_segments_markdown(segments: list, path: str):
         for seg in segments:
             f.write(markdown_with_frontmatter(seg) + "\n")
 
-def export_segments_per_markdown(segments: list, export_dir: str):
-    os.makedirs(export_dir, exist_ok=True)
-    for seg in segments:
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz')
+MARKDOWN_BATCH_SIZE = 256
+
+def is_archive_path(path: str) -> bool:
+    return str(path).lower().endswith(ARCHIVE_SUFFIXES)
+
+class MarkdownArchiveWriter:
+    """Stream per-segment Markdown files into a single .zip or .tar(.gz) archive.
+
+    Members are written straight from memory, so no temp files touch the disk.
+    Usable as a context manager; `add()` may be called any number of times.
+    """
+
+    def __init__(self, path: str, render=markdown_with_frontmatter):
+        self.path = path
+        self.render = render
+        self.count = 0
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        lower = path.lower()
+        if lower.endswith('.zip'):
+            self._zip = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+            self._tar = None
+        else:
+            mode = "w:gz" if lower.endswith(('.tar.gz', '.tgz')) else "w"
+            self._zip = None
+            self._tar = tarfile.open(path, mode)
+
+    def add(self, seg):
+        name = safe_filename(seg['title'], seg['segment_id'])
+        data = self.render(seg).encode("utf-8")
+        if self._zip is not None:
+            self._zip.writestr(name, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            self._tar.addfile(info, io.BytesIO(data))
+        self.count += 1
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+        else:
+            self._tar.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _write_markdown_batch(batch, export_dir, render):
+    for seg in batch:
         name = safe_filename(seg['title'], seg['segment_id'])
         with open(os.path.join(export_dir, name), "w", encoding="utf-8") as f:
-            f.write(markdown_with_frontmatter(seg))
+            f.write(render(seg))
+    return len(batch)
+
+def export_segments_markdown_bulk(
+    segments: list,
+    dest: str,
+    max_workers: int = None,
+    render=markdown_with_frontmatter,
+) -> dict:
+    """
+    Writes one Markdown file per segment, either into a directory through a
+    thread pool or streamed into a single .zip/.tar/.tar.gz archive.
+    Returns {'files', 'seconds', 'files_per_sec'}.
+    """
+    start = time.perf_counter()
+    if is_archive_path(dest):
+        with MarkdownArchiveWriter(dest, render=render) as archive:
+            for seg in segments:
+                archive.add(seg)
+        written = archive.count
+    else:
+        os.makedirs(dest, exist_ok=True)
+        segments = list(segments)
+        batches = [segments[i:i + MARKDOWN_BATCH_SIZE]
+                   for i in range(0, len(segments), MARKDOWN_BATCH_SIZE)]
+        workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            written = sum(pool.map(lambda b: _write_markdown_batch(b, dest, render), batches))
+    seconds = time.perf_counter() - start
+    stats = {
+        'files': written,
+        'seconds': round(seconds, 3),
+        'files_per_sec': round(written / seconds, 1) if seconds > 0 else float(written),
+    }
+    logging.info(f"Exported {written} Markdown files to {dest} ({stats['files_per_sec']} files/sec)")
+    return stats
+
+def export_segments_per_markdown(segments: list, export_dir: str, max_workers: int = None, render=markdown_with_frontmatter) -> dict:
+    return export_segments_markdown_bulk(segments, export_dir, max_workers=max_workers, render=render)
+
+def export_segments(segments: list, path: str, fmt: str = "csv", **options):
+    """
+    Exports segments to `path` in one of EXPORT_FORMATS.
+    Parquet accepts `compression` and `row_group_size` options.
+    """
+    if fmt == "csv":
+        export_segments_csv(segments, path)
+    elif fmt == "jsonl":
+        export_segments_jsonl(segments, path)
+    elif fmt == "parquet":
+        export_segments_parquet(segments, path, **options)
+    elif fmt == "md":
+        export_segments_markdown(segments, path)
+    else:
+        raise ValueError(f"Unsupported export format: {fmt}")
+
+def _csv_value(value) -> str:
+    if value is None or (isinstance(value, float) and value != value):
+        return ""
+    return str(value)
+
+class SegmentStreamWriter:
+    """
+    Incrementally writes segment batches to a single csv/jsonl/parquet/md file,
+    so a run never has to hold every segment in memory.
+
+    The column set is fixed by the first batch (csv_columns: SEGMENT_FIELDS
+    plus any extra keys seen there); later keys outside it are dropped from
+    csv/parquet output.
+    """
+
+    def __init__(self, path: str, fmt: str = "csv", compression: str = "snappy", row_group_size: int = None):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format: {fmt}")
+        self.path = path
+        self.fmt = fmt
+        self.compression = compression
+        self.row_group_size = row_group_size
+        self.count = 0
+        self._columns = None
+        self._writer = None
+        self._parquet = None
+        self._schema = None
+        self._file = None
+        if fmt != "parquet":
+            self._file = open(path, "w", newline="" if fmt == "csv" else None, encoding="utf-8")
+
+    def write(self, segments: list):
+        if not segments:
+            return
+        if self.fmt == "csv":
+            if self._writer is None:
+                self._columns = csv_columns(segments)
+                self._writer = csv.writer(self._file)
+                self._writer.writerow(self._columns)
+            self._writer.writerows(csv_rows(segments, self._columns))
+        elif self.fmt == "jsonl":
+            for seg in segments:
+                self._file.write(json.dumps(segment_record(seg), ensure_ascii=False, default=str) + "\n")
+        elif self.fmt == "md":
+            for seg in segments:
+                self._file.write(markdown_with_frontmatter(seg) + "\n")
+        else:
+            import pyarrow.parquet as pq
+            if self._parquet is None:
+                self._schema = segment_arrow_schema(extra_fields(segment_record(s) for s in segments))
+                self._parquet = pq.ParquetWriter(self.path, self._schema, compression=self.compression)
+            table = segments_to_arrow(segments, schema=self._schema)
+            self._parquet.write_table(table, row_group_size=self.row_group_size)
+        self.count += len(segments)
+
+    def close(self):
+        if self.fmt == "parquet":
+            if self._parquet is None:
+                import pyarrow.parquet as pq
+                pq.write_table(segments_to_arrow([]), self.path, compression=self.compression)
+            else:
+                self._parquet.close()
+        elif self._file is not None:
+            if self.fmt == "csv" and self._writer is None:
+                csv.writer(self._file).writerow(csv_columns([]))
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class RepoCsvAppender:
+    """
+    Streaming counterpart of update_repo_csv: appends segment batches to the
+    repo CSV, skipping rows already present. Only a 16-byte digest per repo
+    row is kept in memory; the existing repo is scanned in chunks.
+    """
+
+    def __init__(self, repo_path: str, chunksize: int = 50000):
+        self.repo_path = repo_path
+        self.appended = 0
+        self._seen = set()
+        self._columns = None
+        self._rows = 0
+        if os.path.exists(repo_path) and os.path.getsize(repo_path) > 0:
+            import pandas as pd
+            for chunk in pd.read_csv(repo_path, dtype=str, keep_default_na=False, chunksize=chunksize):
+                if self._columns is None:
+                    self._columns = list(chunk.columns)
+                for row in chunk.itertuples(index=False, name=None):
+                    self._seen.add(self._digest(row))
+                    self._rows += 1
+
+    @staticmethod
+    def _digest(values) -> bytes:
+        return hashlib.blake2b("\x1f".join(values).encode("utf-8"), digest_size=16).digest()
+
+    def append(self, segments: list) -> int:
+        if not segments:
+            return 0
+        write_header = self._columns is None
+        if write_header:
+            self._columns = csv_columns(segments)
+        new_rows = []
+        for seg in segments:
+            row = [_csv_value(seg.get(c)) for c in self._columns]
+            key = self._digest(row)
+            if key not in self._seen:
+                self._seen.add(key)
+                new_rows.append(row)
+        with open(self.repo_path, "a", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            if write_header:
+                writer.writerow(self._columns)
+            writer.writerows(new_rows)
+        self.appended += len(new_rows)
+        self._rows += len(new_rows)
+        return len(new_rows)
+
+    @property
+    def total_rows(self) -> int:
+        return self._rows
 
 def update_repo_csv(segments: list, repo_path: str):
+    import pandas as pd
     logging.info(f"Updating repo CSV at {repo_path} with {len(segments)} segments")
     new_data = pd.DataFrame(segments)
     if os.path.exists(repo_path):
@@ -9,7 +9,17 @@ import logging
 import time
 import sys
 import csv
+from contextlib import nullcontext
+from functools import lru_cache
 import coloredlogs
+from scripts import culture_fields, field_provenance
+from scripts.culture_fields import enrich_files, save_culture_data
+from scripts.llm_cache import CacheMiss, cache_key, configure_default_cache, default_cache, format_stats
+
+MODEL = "gpt-3.5-turbo"
+TEMPERATURE = 0.7
+MAX_TOKENS = 600
+DEFAULT_SYSTEM_PROMPT = "You are an expert in global cultural anthropology."
 
 # Set your OpenAI API key
 openai.api_key = os.getenv("OPENAI_API_KEY")
@@ -38,52 +48,117 @@ def load_culture_data(filepath):
             return json.load(f)
     return {}  # Return empty dict if file doesn't exist
 
-def save_culture_data(filepath, data):
-    Path(filepath).parent.mkdir(parents=True, exist_ok=True)
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
-def enrich_culture_with_ai(culture_name, existing_data, force_enrich=False, omit_errors=False, system_prompt="You are an expert in global cultural anthropology."):
-    logger.info(f"Enriching {culture_name} with AI...")
-    enriched_data = existing_data.copy()
-
-    # Ensure 'culture_name' field is set
-    if 'culture_name' not in enriched_data or not enriched_data['culture_name']:
-        enriched_data['culture_name'] = culture_name
-
-    # Ensure 'language_tag' field is set, default to 'und' if not present
-    if 'language_tag' not in enriched_data or not enriched_data['language_tag']:
-        enriched_data['language_tag'] = "und"
-
-    for field, prompt_template in tqdm(PROMPTS.items(), desc=f"Enriching fields for {culture_name}"):
-        if force_enrich or (field not in enriched_data or not enriched_data[field]):
-            prompt = prompt_template.format(culture_name=culture_name)
-            retries = 3
-            for attempt in range(retries):
-                try:
-                    response = openai.ChatCompletion.create(
-                        model="gpt-3.5-turbo",
-                        messages=[
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": prompt}
-                        ],
-                        temperature=0.7,
-                        max_tokens=600
-                    )
-                    enriched_data[field] = response.choices[0].message.content.strip()
-                    enriched_data['model_used'] = response.model
-                    logger.debug(f"  - Enriched '{field}'")
-                    break
-                except openai.error.OpenAIError as e:
-                    logger.warning(f"  - Error enriching '{field}' on attempt {attempt + 1}: {e}")
-                    time.sleep(2 ** attempt)  # Exponential backoff
-                    if attempt == retries - 1:
-                        if omit_errors:
-                            logger.warning(f"  - Omitted '{field}' due to persistent errors.")
-                            continue
-                        enriched_data[field] = f"[ERROR: {str(e)}]"
+def rate_limits():
+    """(requests, tokens) per minute: $GPT_RPM (default 500) and $GPT_TPM (default 90000)."""
+    return int(os.getenv("GPT_RPM") or 500), int(os.getenv("GPT_TPM") or 90000)
+
+@lru_cache(maxsize=None)
+def rate_limiter():
+    """The rate_limits() budget, shared by every --workers thread."""
+    from scripts.enrichment_engine import RateLimiter
+    return RateLimiter(*rate_limits())
+
+def chat_completion(prompt, system_prompt, max_tokens=MAX_TOKENS, **extra):
+    """
+    One cached ChatCompletion request with retries; returns (text, model).
+    Raises the last OpenAIError once retries are exhausted, or CacheMiss in replay mode.
+    """
+    key = cache_key(MODEL, prompt, system=system_prompt, temperature=TEMPERATURE, max_tokens=max_tokens, **extra)
+    cached = default_cache().get(key)
+    if cached is not None:
+        return cached, MODEL
+    retries = 3
+    for attempt in range(retries):
+        rate_limiter().acquire(len(system_prompt + prompt) // 4 + max_tokens)
+        try:
+            response = openai.ChatCompletion.create(
+                model=MODEL,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=TEMPERATURE,
+                max_tokens=max_tokens,
+                **extra
+            )
+            text = response.choices[0].message.content.strip()
+            default_cache().put(key, text, model=response.model)
+            return text, response.model
+        except openai.error.OpenAIError as e:
+            logger.warning(f"  - Request failed on attempt {attempt + 1}: {e}")
+            if attempt == retries - 1:
+                raise
+            time.sleep(2 ** attempt)  # Exponential backoff
+
+def enrich_field(enriched_data, field, culture_name, system_prompt, omit_errors):
+    """
+    Per-field mode: one request for one field; records an [ERROR: ...] value
+    unless omit_errors. Returns True when the field was enriched.
+    """
+    prompt = PROMPTS[field].format(culture_name=culture_name)
+    try:
+        enriched_data[field], model = chat_completion(prompt, system_prompt)
+        enriched_data['model_used'] = model
+        logger.debug(f"  - Enriched '{field}'")
+        return True
+    except CacheMiss:
+        logger.warning(f"  - No cached response for '{field}' (replay mode); not calling the API.")
+        if not omit_errors:
+            enriched_data[field] = "[ERROR: not in replay cache]"
+    except openai.error.OpenAIError as e:
+        if omit_errors:
+            logger.warning(f"  - Omitted '{field}' due to persistent errors.")
         else:
+            enriched_data[field] = f"[ERROR: {str(e)}]"
+    return False
+
+def enrich_fields_structured(enriched_data, fields, culture_name, system_prompt):
+    """scripts.culture_fields.enrich_fields_structured with PROMPTS and chat_completion."""
+    return culture_fields.enrich_fields_structured(enriched_data, fields, culture_name, system_prompt, PROMPTS,
+                                                   chat_completion, MAX_TOKENS, errors=(openai.error.OpenAIError,))
+
+def plan_enrichment(culture_name, existing_data, force_enrich=False, stale_only=False, system_prompt=DEFAULT_SYSTEM_PROMPT):
+    """scripts.culture_fields.plan_enrichment with PROMPTS and MODEL: (data with defaults, fields to request)."""
+    return culture_fields.plan_enrichment(existing_data, culture_name, PROMPTS, MODEL, system_prompt, force_enrich,
+                                          stale_only)
+
+def estimate_requests(estimate, culture_name, fields, system_prompt, mode="structured"):
+    """Adds the requests enrich_culture_with_ai makes for `fields` to a scripts.cost_estimate.Estimate."""
+    def add(prompt, max_tokens, **extra):
+        messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": prompt}]
+        estimate.add({"model": MODEL, "messages": messages, "temperature": TEMPERATURE, "max_tokens": max_tokens, **extra})
+    if mode == "structured" and fields:
+        add(culture_fields.structured_prompt(PROMPTS, culture_name, fields),
+            culture_fields.structured_max_tokens(fields, MAX_TOKENS), response_format={"type": "json_object"})
+        return
+    for field in fields:
+        add(PROMPTS[field].format(culture_name=culture_name), MAX_TOKENS)
+
+def enrich_culture_with_ai(culture_name, existing_data, force_enrich=False, omit_errors=False, system_prompt=DEFAULT_SYSTEM_PROMPT, mode="structured", stale_only=False):
+    """
+    Fills missing fields (all of PROMPTS with force_enrich, missing and stale
+    ones with stale_only). "structured" mode asks for every missing field in
+    one JSON request and falls back to per-field requests only for fields that
+    still fail validation; "per-field" makes one request per field. Each
+    enriched field gets a provenance entry (scripts.field_provenance).
+    """
+    logger.info(f"Enriching {culture_name} with AI...")
+    enriched_data, todo = plan_enrichment(culture_name, existing_data, force_enrich, stale_only, system_prompt)
+    requested = todo
+    for field in PROMPTS:
+        if field not in todo:
             logger.debug(f"  - Skipping '{field}' (already has content)")
+    source_hash = field_provenance.input_hash(enriched_data, PROMPTS)
+
+    if mode == "structured" and todo:
+        todo = enrich_fields_structured(enriched_data, todo, culture_name, system_prompt)
+        if todo:
+            logger.info(f"  - Falling back to per-field requests for: {', '.join(todo)}")
+    failed = [field for field in tqdm(todo, desc=f"Enriching fields for {culture_name}", disable=not todo)
+              if not enrich_field(enriched_data, field, culture_name, system_prompt, omit_errors)]
+    for field in requested:
+        if field not in failed:
+            field_provenance.record(enriched_data, field, PROMPTS[field], system_prompt, MODEL, source_hash)
 
     if 'source' not in enriched_data:
         enriched_data['source'] = "AI Enrichment (OpenAI GPT)"
@@ -92,12 +167,6 @@ def enrich_culture_with_ai(culture_name, existing_data, force_enrich=False, omit
 
     return enriched_data
 
-def log_enriched_fields(log_file, filename, enriched_fields):
-    with open(log_file, 'a', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        for field in enriched_fields:
-            writer.writerow([filename, field])
-
 def main():
     parser = argparse.ArgumentParser(description="AI-powered culture data enrichment script.")
     parser.add_argument("--input", type=str, help="Path to the input folder containing .v3.json files.")
@@ -107,33 +176,49 @@ def main():
     parser.add_argument("--preview-only", action="store_true", help="Preview changes without saving output.")
     parser.add_argument("--verbose", action="store_true", help="Enable verbose logging.")
     parser.add_argument("--quiet", action="store_true", help="Suppress all logging except errors.")
-    parser.add_argument("--system-prompt", type=str, default="You are an expert in global cultural anthropology.",
+    parser.add_argument("--stale-only", action="store_true", help="Also re-enrich fields whose prompt, model or source data changed since they were enriched (see _provenance).")
+    parser.add_argument("--system-prompt", type=str, default=DEFAULT_SYSTEM_PROMPT,
                         help="System prompt used to guide GPT behavior.")
     parser.add_argument("--omit-errors", action="store_true", help="Do not include failed enrichment fields in output.")
     parser.add_argument("--max-files", type=int, help="Limit the number of files processed (for testing).")
+    parser.add_argument("--workers", type=int, default=1, help="Culture files enriched concurrently (sharing the $GPT_RPM/$GPT_TPM rate limit).")
     parser.add_argument("--no-backup", action="store_true", help="Skip saving backups of original files.")
+    parser.add_argument("--mode", choices=["structured", "per-field"], default="structured",
+                        help="structured: one JSON request per culture for all missing fields; per-field: one request per field.")
+    parser.add_argument("--cache", type=str, help="LLM response cache path (default: $LLM_CACHE_PATH or .llm_cache.sqlite).")
+    parser.add_argument("--cache-mode", choices=["rw", "ro", "replay", "off"],
+                        help="rw: read/write, ro: read only, replay: read only and never call the API, off: disabled.")
+    parser.add_argument("--cache-ttl", type=float, help="Ignore cached responses older than this many seconds.")
+    parser.add_argument("--estimate", action="store_true",
+                        help="Dry run: report requests, tokens, cost and wall time for the pending fields, then exit.")
     args = parser.parse_args()
+    if args.stale_only and args.overwrite_existing_fields:
+        parser.error("--stale-only and --overwrite-existing-fields are mutually exclusive")
+    if not args.output and not (args.estimate or args.preview_only):
+        parser.error("--output is required unless --estimate or --preview-only is given")
+    cache_mode = args.cache_mode
+    if args.estimate:
+        cache_mode = "off" if cache_mode == "off" else "ro"  # look up, never create or write
+    configure_default_cache(args.cache, cache_mode, ttl=args.cache_ttl)
 
     if args.verbose:
         logger.setLevel(logging.DEBUG)
     elif args.quiet:
         logger.setLevel(logging.ERROR)
+    culture_fields.logger.setLevel(logger.level)
 
     input_folder = args.input
     output_folder = args.output
     single_file = args.file
     force_enrich = args.overwrite_existing_fields
+    stale_only = args.stale_only
     dry_run = args.preview_only
     system_prompt = args.system_prompt
     omit_errors = args.omit_errors
     max_files = args.max_files
     no_backup = args.no_backup
 
-    log_file = Path(output_folder) / "enriched_fields_log.csv"
-    if not log_file.exists():
-        with open(log_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(["Filename", "Enriched Field"])
+    log_file = Path(output_folder) / "enriched_fields_log.csv" if output_folder else None
 
     if single_file:
         culture_files = [Path(single_file).name]
@@ -153,59 +238,75 @@ def main():
         culture_files = culture_files[:max_files]
 
     logger.info(f"Found {len(culture_files)} culture files in input folder: {input_folder}")
-    logger.info(f"Run Parameters: overwrite-existing-fields={force_enrich}, preview-only={dry_run}, omit-errors={omit_errors}, no-backup={no_backup}")
-    logger.info(f"System Prompt: {system_prompt[:60]}{'...' if len(system_prompt) > 60 else ''}")
 
-    processed, skipped, failed = 0, 0, 0
+    if args.estimate:
+        from scripts.cost_estimate import Estimate, format_estimate
+        from scripts.segment_by_culture import count_tokens
+        rpm, tpm = rate_limits()
+        estimate = Estimate(rpm=rpm, tpm=tpm, concurrency=max(1, args.workers), count_tokens=count_tokens,
+                            completion_tokens=MAX_TOKENS, cache=default_cache())
+        for filename in culture_files:
+            existing_data = load_culture_data(Path(input_folder) / filename)
+            if existing_data:
+                culture_name = existing_data.get('culture_name', filename.replace(".v3.json", ""))
+                _, fields = plan_enrichment(culture_name, existing_data, force_enrich, stale_only, system_prompt)
+                estimate_requests(estimate, culture_name, fields, system_prompt, args.mode)
+        print(format_estimate(estimate.summary()))
+        return
+    logger.info(f"Run Parameters: overwrite-existing-fields={force_enrich}, stale-only={stale_only}, preview-only={dry_run}, omit-errors={omit_errors}, no-backup={no_backup}")
+    logger.info(f"System Prompt: {system_prompt[:60]}{'...' if len(system_prompt) > 60 else ''}")
 
-    for i, filename in enumerate(tqdm(culture_files, desc="Processing files"), start=1):
+    def enrich_file(filename):
+        """Enriches and saves one culture file; returns (status, enriched fields, output path)."""
         input_filepath = Path(input_folder) / filename
         existing_data = load_culture_data(input_filepath)
 
         if not existing_data:
             logger.warning(f"{filename} appears empty or malformed, skipping.")
-            skipped += 1
-            continue
+            return "skipped", [], None
 
         culture_name = existing_data.get('culture_name', filename.replace(".v3.json", ""))
         language_tag = existing_data.get('language_tag', 'und')
 
-        try:
-            enriched_data = enrich_culture_with_ai(culture_name, existing_data, force_enrich, omit_errors, system_prompt)
-
-            enriched_fields = [field for field in enriched_data if enriched_data[field] != existing_data.get(field)]
-
-            if dry_run:
-                if enriched_fields:
-                    logger.info(f"[PREVIEW-ONLY] Changes for {filename}:")
-                    for field in enriched_fields:
-                        logger.info(f"  - {field}: {existing_data.get(field)} -> {enriched_data[field]}")
-                else:
-                    logger.info(f"[PREVIEW-ONLY] No changes for {filename}.")
-                skipped += 1
-                continue
-
-            if not no_backup:
-                backup_folder = Path(output_folder) / "backups" / language_tag
-                backup_folder.mkdir(parents=True, exist_ok=True)
-                backup_path = backup_folder / filename
-                if not backup_path.exists():
-                    save_culture_data(backup_path, existing_data)
-
-            lang_output_folder = Path(output_folder) / language_tag
-            output_filepath = lang_output_folder / filename
-
-            save_culture_data(output_filepath, enriched_data)
-            log_enriched_fields(log_file, filename, enriched_fields)
-
-            logger.info(f"[{i}/{len(culture_files)}] Enriched and saved: {output_filepath}")
-            processed += 1
-        except Exception as e:
-            logger.error(f"Failed to process {filename}: {e}")
-            failed += 1
-
-    enriched_field_count = sum(1 for _ in open(log_file)) - 1
+        enriched_data = enrich_culture_with_ai(culture_name, existing_data, force_enrich, omit_errors, system_prompt,
+                                               mode=args.mode, stale_only=stale_only)
+
+        enriched_fields = [field for field in enriched_data
+                           if field != field_provenance.PROVENANCE_KEY and enriched_data[field] != existing_data.get(field)]
+
+        if dry_run:
+            if enriched_fields:
+                logger.info(f"[PREVIEW-ONLY] Changes for {filename}:")
+                for field in enriched_fields:
+                    logger.info(f"  - {field}: {existing_data.get(field)} -> {enriched_data[field]}")
+            else:
+                logger.info(f"[PREVIEW-ONLY] No changes for {filename}.")
+            return "skipped", [], None
+
+        if not no_backup:
+            backup_path = Path(output_folder) / "backups" / language_tag / filename
+            if not backup_path.exists():
+                save_culture_data(backup_path, existing_data)
+
+        output_filepath = Path(output_folder) / language_tag / filename
+        save_culture_data(output_filepath, enriched_data)
+        return "processed", enriched_fields, output_filepath
+
+    if output_folder:
+        Path(output_folder).mkdir(parents=True, exist_ok=True)
+    # Workers share the rate limit in chat_completion; results are logged by enrich_files, on this thread.
+    # Without --output (only allowed with --preview-only) nothing is saved, so there is no log.
+    with open(log_file, 'a', newline='', encoding='utf-8') if log_file else nullcontext() as log:
+        log_writer = csv.writer(log) if log else None
+        if log and log.tell() == 0:
+            log_writer.writerow(["Filename", "Enriched Field"])
+        counts, enriched_field_count = enrich_files(
+            culture_files, enrich_file, log_writer, args.workers,
+            progress=lambda done, total: tqdm(done, total=total, desc="Processing files"))
+    processed, skipped, failed = counts['processed'], counts['skipped'], counts['failed']
+
     logger.info(f"Summary: Processed={processed}, Skipped={skipped}, Failed={failed}, Fields Enriched={enriched_field_count}")
+    logger.info(format_stats(default_cache().stats()))
 
     if failed > 0:
         sys.exit(1)
@@ -0,0 +1,230 @@
+"""
+journal.py - Durable checkpoint/resume journal for long pipeline runs.
+
+A RunJournal lives in runs/<RUN_ID>/ and holds three append-only files:
+
+    meta.json       - run id, start time and the command-line options
+    files.jsonl     - one line per completed input file, with its segments
+    enriched.jsonl  - one line per enriched segment (the fields GPT added)
+
+Only the byte offset of each line is kept in memory (plus the file stamp for
+files.jsonl); segments and enriched fields are read back from disk when a
+resumed run needs them, so journaling does not grow with the corpus.
+
+Every line is flushed and fsynced before the call returns, so a crash or
+quota error loses at most the segment or file in flight. A truncated last
+line (power loss mid-write) is ignored on load. Resuming the run with the
+same RUN_ID skips completed files (unless they changed on disk since) and
+restores enriched fields instead of paying for the API calls again.
+
+close() records the run's status in status.json. prune_runs() deletes all
+but the newest finished runs, so the runs directory does not grow without
+bound; interrupted runs are kept until they are resumed and finish.
+
+drain_on_sigint() turns the first Ctrl-C into a stop request that the
+pipeline checks between files and after each enriched segment, so partial
+results are still exported; a second Ctrl-C aborts immediately.
+"""
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import signal
+import threading
+from contextlib import contextmanager
+
+from segment import Segment
+
+RUNS_DIR = "runs"
+KEEP_RUNS = 20  # finished runs prune_runs() keeps by default
+# Fields that differ between runs of the same input and so are never restored from enriched.jsonl.
+_RUN_FIELDS = ('content', 'segment_id', 'run_id', 'source_file')
+
+
+class RunInterrupted(Exception):
+    """Raised inside a file's enrichment when a stop was requested; the file is left incomplete."""
+
+
+def new_run_id() -> str:
+    return datetime.datetime.now().strftime("%Y%m%d_%H%M%S") + "_" + os.urandom(3).hex()
+
+
+def segment_key(seg) -> str:
+    """Run-independent identity of a segment: source file, title and content."""
+    raw = "\x1f".join(str(seg.get(k, "")) for k in ('source_file', 'title', 'content'))
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _file_stamp(path):
+    st = os.stat(path)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def _read_jsonl(path):
+    """(byte offset, entry) for each complete line of path."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        offset = 0
+        for line in f:
+            try:
+                yield offset, json.loads(line)
+            except json.JSONDecodeError:
+                pass  # torn final write
+            offset += len(line)
+
+
+class RunJournal:
+    def __init__(self, run_id=None, root=RUNS_DIR, meta=None):
+        self.run_id = run_id or new_run_id()
+        self.dir = os.path.join(root, self.run_id)
+        self.resumed = os.path.isdir(self.dir)
+        self.stop_requested = False
+        self._lock = threading.Lock()
+        self._files = {}  # path -> (stamp, offset in files.jsonl)
+        self._enriched = {}  # segment key -> offset in enriched.jsonl
+        os.makedirs(self.dir, exist_ok=True)
+        meta_path = os.path.join(self.dir, "meta.json")
+        if self.resumed and os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                self.meta = json.load(f)
+        else:
+            self.meta = {'run_id': self.run_id, 'started': datetime.datetime.now().isoformat(), **(meta or {})}
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(self.meta, f, indent=2)
+        for offset, entry in _read_jsonl(os.path.join(self.dir, "files.jsonl")):
+            self._files[entry['file']] = (entry.get('stamp'), offset)
+        for offset, entry in _read_jsonl(os.path.join(self.dir, "enriched.jsonl")):
+            self._enriched[entry['key']] = offset
+        self._files_out = self._open_for_append("files.jsonl")
+        self._enriched_out = self._open_for_append("enriched.jsonl")
+
+    def _open_for_append(self, name):
+        f = open(os.path.join(self.dir, name), "ab")
+        f.seek(0, os.SEEK_END)
+        return f
+
+    def _append(self, f, entry):
+        """Appends entry as one line and returns its byte offset."""
+        line = (json.dumps(entry, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        with self._lock:
+            offset = f.tell()
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        return offset
+
+    def _read_at(self, name, offset):
+        with open(os.path.join(self.dir, name), "rb") as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    # -- completed files ----------------------------------------------------
+
+    def completed_segments(self, path):
+        """Segments journaled for path, or None if it still has to be processed."""
+        stamp, offset = self._files.get(path, (None, None))
+        if offset is None or stamp != _file_stamp(path):
+            return None
+        return [Segment(seg) for seg in self._read_at("files.jsonl", offset)['segments']]
+
+    def file_done(self, path, segments):
+        stamp = _file_stamp(path)
+        entry = {'file': path, 'stamp': stamp, 'segments': [dict(s) for s in segments]}
+        self._files[path] = (stamp, self._append(self._files_out, entry))
+
+    @property
+    def completed_files(self):
+        return list(self._files)
+
+    # -- enriched segments --------------------------------------------------
+
+    def enrich(self, segments, enrich_fn):
+        """
+        Runs enrich_fn(todo, on_done) once over the segments not enriched yet;
+        already-journaled segments get their enriched fields restored.
+        enrich_fn must enrich `todo` in place (like enrich_segments) and call
+        on_done(seg) as each segment finishes, which journals it. Segments
+        left without a summary (their GPT requests failed) are not journaled,
+        so a resumed run retries them. On stop, on_done raises RunInterrupted,
+        which is expected to abort enrich_fn.
+        """
+        out = list(segments)
+        todo = []
+        for seg in out:
+            offset = self._enriched.get(segment_key(seg))
+            if offset is None:
+                todo.append(seg)
+            else:
+                seg.update(self._read_at("enriched.jsonl", offset)['fields'])
+        if not todo:
+            return out
+        if self.stop_requested:
+            raise RunInterrupted()
+
+        def on_done(seg):
+            if 'summary' in seg:
+                key = segment_key(seg)
+                fields = {k: v for k, v in seg.items() if k not in _RUN_FIELDS}
+                self._enriched[key] = self._append(self._enriched_out, {'key': key, 'fields': fields})
+            if self.stop_requested:
+                raise RunInterrupted()
+        enrich_fn(todo, on_done)
+        return out
+
+    @property
+    def enriched_count(self):
+        return len(self._enriched)
+
+    def close(self, status="finished"):
+        """Closes the journal files and records the run status in status.json."""
+        self._files_out.close()
+        self._enriched_out.close()
+        with open(os.path.join(self.dir, "status.json"), "w", encoding="utf-8") as f:
+            json.dump({'status': status, 'files': len(self._files), 'enriched': len(self._enriched),
+                       'time': datetime.datetime.now().isoformat()}, f, indent=2)
+
+
+def prune_runs(root=RUNS_DIR, keep=KEEP_RUNS):
+    """
+    Deletes the journals of finished runs in root except the `keep` most
+    recently finished ones; runs that were interrupted or are still going
+    (no status.json) can be resumed and are never deleted. Returns the
+    deleted run ids.
+    """
+    finished = []
+    for run_id in os.listdir(root) if os.path.isdir(root) else ():
+        try:
+            with open(os.path.join(root, run_id, "status.json"), encoding="utf-8") as f:
+                status = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            continue
+        if status.get('status') == "finished":
+            finished.append((status.get('time', ""), run_id))
+    finished.sort(reverse=True)
+    pruned = [run_id for _, run_id in finished[max(0, keep):]]
+    for run_id in pruned:
+        shutil.rmtree(os.path.join(root, run_id), ignore_errors=True)
+    return pruned
+
+
+@contextmanager
+def drain_on_sigint(journal):
+    """First SIGINT sets journal.stop_requested; the second one aborts."""
+    if threading.current_thread() is not threading.main_thread():
+        yield journal
+        return
+
+    def handler(signum, frame):
+        if journal.stop_requested:
+            raise KeyboardInterrupt
+        journal.stop_requested = True
+        print(f"\nInterrupt received: finishing the current step and exporting partial results "
+              f"(resume with --resume {journal.run_id}; Ctrl-C again to abort).")
+
+    previous = signal.signal(signal.SIGINT, handler)
+    try:
+        yield journal
+    finally:
+        signal.signal(signal.SIGINT, previous)
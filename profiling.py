@@ -0,0 +1,253 @@
+"""
+profiling.py - Per-stage cProfile capture for pipeline runs.
+
+StageProfiler is a telemetry observer (see telemetry.py): it enables one
+cProfile.Profile per stage name at stage start and disables it at stage end,
+so repeated stages (e.g. "load" for every file) accumulate into one profile.
+write() then produces, per stage:
+
+    <stage>.pstats     - raw stats, loadable with pstats / snakeviz
+    <stage>.collapsed  - folded stacks ("a;b;c <microseconds>") for flamegraph.pl,
+                         speedscope or inferno
+    <stage>.txt        - top 20 functions by cumulative time
+
+plus report.txt with the top-20 tables of every stage.
+
+MemoryProfiler is the tracemalloc counterpart: at each stage boundary it
+records traced current/peak memory, process RSS and the top allocation
+sites (snapshot diff by line) per stage and per file. The per-stage RSS peak
+comes from a background thread sampling /proc/self/statm every
+RSS_SAMPLE_INTERVAL_S while the stage runs (it is None where /proc is
+unavailable); ru_maxrss is not used, since it is the peak of the whole
+process and stops changing after the first large file.
+"""
+import cProfile
+import datetime
+import io
+import json
+import os
+import pstats
+import re
+import threading
+import tracemalloc
+
+TOP_N = 20
+MAX_STACK_DEPTH = 64
+MIN_WEIGHT_S = 1e-6
+RSS_SAMPLE_INTERVAL_S = 0.01
+
+
+def _stage_filename(stage):
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', stage)
+
+
+def _label(func):
+    filename, line, name = func
+    if filename == '~':
+        return name.replace(';', ',')
+    return f"{name} ({os.path.basename(filename)}:{line})".replace(';', ',')
+
+
+def collapsed_stacks(stats):
+    """
+    Folds a pstats.Stats into {stack: microseconds}. cProfile records only
+    caller->callee edges, so each function's own time is attributed to its
+    callers in proportion to the cumulative time spent along each edge.
+    """
+    raw = stats.stats
+    folded = {}
+
+    def walk(func, weight, suffix, seen):
+        callers = raw[func][4] if func in raw else {}
+        edges = [(c, e[3]) for c, e in callers.items() if c not in seen and e[3] > 0]
+        total = sum(ct for _, ct in edges)
+        if not edges or total <= 0 or len(suffix) >= MAX_STACK_DEPTH:
+            key = ';'.join(reversed(suffix))
+            folded[key] = folded.get(key, 0.0) + weight
+            return
+        for caller, ct in edges:
+            share = weight * ct / total
+            if share >= MIN_WEIGHT_S:
+                walk(caller, share, suffix + [_label(caller)], seen | {caller})
+
+    for func, (_, _, tottime, _, _) in raw.items():
+        if tottime >= MIN_WEIGHT_S:
+            walk(func, tottime, [_label(func)], {func})
+    return {stack: int(round(s * 1e6)) for stack, s in folded.items() if s * 1e6 >= 0.5}
+
+
+class StageProfiler:
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self.profiles = {}
+        self._active = []
+
+    def stage_started(self, name, file=None):
+        if self._active:
+            self._active[-1].disable()
+        profile = self.profiles.setdefault(name, cProfile.Profile())
+        self._active.append(profile)
+        profile.enable()
+
+    def stage_finished(self, name, file=None, record=None):
+        profile = self._active.pop()
+        profile.disable()
+        if self._active:
+            self._active[-1].enable()
+
+    def top_report(self, name, profile, limit=TOP_N):
+        buf = io.StringIO()
+        pstats.Stats(profile, stream=buf).sort_stats('cumulative').print_stats(limit)
+        return f"=== {name}: top {limit} by cumulative time ===\n{buf.getvalue()}"
+
+    def write(self):
+        """Writes per-stage .pstats/.collapsed/.txt files and report.txt; returns the report text."""
+        os.makedirs(self.out_dir, exist_ok=True)
+        reports = []
+        for name, profile in self.profiles.items():
+            base = os.path.join(self.out_dir, _stage_filename(name))
+            profile.dump_stats(base + ".pstats")
+            folded = collapsed_stacks(pstats.Stats(profile))
+            with open(base + ".collapsed", "w", encoding="utf-8") as f:
+                for stack, micros in sorted(folded.items()):
+                    f.write(f"{stack} {micros}\n")
+            report = self.top_report(name, profile)
+            with open(base + ".txt", "w", encoding="utf-8") as f:
+                f.write(report)
+            reports.append(report)
+        text = "\n".join(reports)
+        with open(os.path.join(self.out_dir, "report.txt"), "w", encoding="utf-8") as f:
+            f.write(text)
+        return text
+
+
+def _rss_bytes():
+    """Current resident set size, or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class _RssSampler:
+    """Highest RSS seen between start() and stop(), sampled on a daemon thread."""
+
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL_S):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        rss = _rss_bytes()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._sample()
+        if self.peak is not None:  # no /proc: nothing to sample
+            self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._sample()
+        return self.peak
+
+
+class MemoryProfiler:
+    """
+    Telemetry observer that snapshots tracemalloc at stage boundaries.
+    Stages are assumed not to nest (reset_peak is process-wide).
+    """
+
+    def __init__(self, top=10, frames=1):
+        self.top = top
+        self.records = []
+        self._before = None
+        self._sampler = None
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start(frames)
+
+    def stage_started(self, name, file=None):
+        tracemalloc.reset_peak()
+        self._before = (tracemalloc.take_snapshot(), tracemalloc.get_traced_memory()[0], _rss_bytes())
+        self._sampler = _RssSampler().start()
+
+    def stage_finished(self, name, file=None, record=None):
+        snapshot_before, traced_before, rss_before = self._before
+        rss_after = _rss_bytes()  # before the snapshot below, which is profiler overhead
+        rss_peak = self._sampler.stop()
+        if rss_after is not None:
+            rss_peak = max(rss_peak or 0, rss_after)
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ])
+        sites = []
+        for diff in snapshot.compare_to(snapshot_before, "lineno")[:self.top]:
+            if diff.size_diff <= 0:
+                continue
+            frame = diff.traceback[0]
+            sites.append({
+                'site': f"{frame.filename}:{frame.lineno}",
+                'size_diff': diff.size_diff,
+                'count_diff': diff.count_diff,
+            })
+        self.records.append({
+            'stage': name,
+            'file': file,
+            'traced_start': traced_before,
+            'traced_end': current,
+            'traced_peak': peak,
+            'traced_peak_over_start': peak - traced_before,
+            'rss_start': rss_before,
+            'rss_end': rss_after,
+            'rss_peak': rss_peak,
+            'rss_peak_over_start': None if rss_peak is None or rss_before is None else rss_peak - rss_before,
+            'top_allocations': sites,
+        })
+
+    def summary(self):
+        """Highest traced peak per stage, plus per-file peaks."""
+        stages, files = {}, {}
+        for rec in self.records:
+            s = stages.setdefault(rec['stage'], {'calls': 0, 'traced_peak': 0, 'traced_peak_over_start': 0, 'rss_peak': None})
+            s['calls'] += 1
+            s['traced_peak'] = max(s['traced_peak'], rec['traced_peak'])
+            s['traced_peak_over_start'] = max(s['traced_peak_over_start'], rec['traced_peak_over_start'])
+            if rec['rss_peak'] is not None:
+                s['rss_peak'] = max(s['rss_peak'] or 0, rec['rss_peak'])
+            if rec['file'] is not None:
+                f = files.setdefault(rec['file'], {})
+                f[rec['stage']] = {'traced_peak': rec['traced_peak'], 'rss_end': rec['rss_end']}
+        return {'stages': stages, 'files': files}
+
+    def write(self, path):
+        data = {
+            'run_time': datetime.datetime.now().isoformat(),
+            'summary': self.summary(),
+            'records': self.records,
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        if self._started_tracing:
+            tracemalloc.stop()
+        return data
+
+    def format_summary(self):
+        lines = [f"{'stage':<18}{'calls':>6}{'peak_MB':>10}{'over_start_MB':>15}{'rss_peak_MB':>13}"]
+        for name, s in self.summary()['stages'].items():
+            rss = f"{s['rss_peak'] / 1e6:.1f}" if s['rss_peak'] else "-"
+            lines.append(f"{name:<18}{s['calls']:>6}{s['traced_peak'] / 1e6:>10.2f}{s['traced_peak_over_start'] / 1e6:>15.2f}{rss:>13}")
+        return "\n".join(lines)
@@ -4,9 +4,8 @@ import time
 import pandas as pd
 import glob
 import datetime
-import uuid
-import re
 from utils import load_content, segment_cultures, load_known_cultures
+from core import export_segments_per_markdown, postprocess_segments
 # Assume enrich_segments is your GPT enrichment function
 try:
     from scripts.segment_by_culture import enrich_segments
@@ -143,17 +142,8 @@ if selected_files and confirm:
                 st.error(f"💥 Failed to process {selected_file}: {e}")
                 st.exception(e)
         if all_segments:
-            # Assign unique IDs and needs_attention flag
-            for seg in all_segments:
-                seg["segment_id"] = str(uuid.uuid4())
-                # GPT confidence override
-                if seg.get('summary', '').endswith('...'):
-                    seg['confidence_score'] = 'medium'
-                seg['needs_attention'] = (
-                    seg.get('confidence_score') in ['low', 'medium']
-                    or len(seg.get('content', '')) < 200
-                    or not seg.get('tags')
-                )
+            # Assign unique IDs, confidence and needs_attention flag (shared with the CLIs)
+            all_segments = postprocess_segments(all_segments)
             st.metric("Segments Processed", len(all_segments))
             st.metric("Flagged for Review", sum(s.get('needs_attention', False) for s in all_segments))
             # Show segments needing attention
@@ -258,12 +248,12 @@ if selected_files and confirm:
             st.download_button("Download This Batch CSV", csv_data, file_name="output.csv", mime="text/csv")
             # Markdown export
             st.download_button("Download Markdown", md_data, file_name="output.md", mime="text/markdown")
-            # Output each segment to Markdown (safe filenames)
-            for seg in all_segments:
-                safe_title = re.sub(r'[\\/*?:"<>|]', "_", seg['title'])
-                name = f"{safe_title}_{seg['segment_id'][:6]}.md"
-                with open(os.path.join(export_dir, name), "w", encoding="utf-8") as f:
-                    f.write(f"# {seg['title']}\n\n{seg['content']}")
+            # Output each segment to Markdown (safe filenames, written through a thread pool)
+            md_stats = export_segments_per_markdown(
+                all_segments, export_dir,
+                render=lambda seg: f"# {seg['title']}\n\n{seg['content']}",
+            )
+            st.caption(f"Wrote {md_stats['files']} Markdown files ({md_stats['files_per_sec']} files/sec)")
             # Mini unit log
             with st.expander("⚙️ Segment Diagnostics"):
                 bads = [s for s in all_segments if len(s.get('content', '')) < 100]
@@ -1,36 +1,213 @@
 """
 run_pipeline.py - CLI runner for batch/automation workflows.
 Supports batch file processing, session config/log export, and diagnostics.
+With --stream, segments are written per file so memory stays flat across large batches.
+Per-stage wall/CPU time and throughput are recorded in session_info['telemetry'].
+GPT runs (and runs with --journal) journal completed files and enriched segments
+under runs/<RUN_ID>/; --resume RUN_ID skips finished work, Ctrl-C drains (exports
+what is done), and only the newest --keep-runs finished journals are kept.
 """
 # TODO: Add --validate flag to run schema or field completeness checks
 # TODO: Add --ignore-dupes flag for repo appends to enforce stricter deduplication
-# TODO: Enable --format md|csv|json to control output structure
 # TODO: Support parallel processing via ThreadPool for large file sets
-# TODO: Integrate langdetect + enrich_segments fallback if missing
 # TODO: Allow --tag or --filter flags to limit output by content
 # TODO: Allow --run-id override for session tracking
 
-from core import process_file, postprocess_segments, export_segments_csv
+from core import process_file, postprocess_segments, export_segments, EXPORT_FORMATS, FORMAT_EXTENSIONS
 from core import export_segments_per_markdown, update_repo_csv, get_flagged_segments
-from segment_quality import quality_report
+from core import SegmentStreamWriter, RepoCsvAppender, MarkdownArchiveWriter, is_archive_path
+from segment_quality import quality_report, QualityAggregator
+from telemetry import Telemetry
+from journal import KEEP_RUNS, RunJournal, RunInterrupted, drain_on_sigint, prune_runs
+from contextlib import ExitStack
 import argparse
 import datetime
 import json
 import os
 
+def _output_size(path):
+    return os.path.getsize(path) if path and os.path.isfile(path) else 0
+
+def process_or_resume(file, args, telemetry, journal, session_info):
+    """
+    Segments for one file: from the journal when an earlier attempt finished
+    it, otherwise processed, postprocessed and journaled. Returns None when a
+    stop was requested mid-file (enriched segments so far stay journaled).
+    """
+    if journal is not None:
+        segs = journal.completed_segments(file)
+        if segs is not None:
+            session_info['resumed_files'].append(file)
+            return segs
+    try:
+        segs = process_file(file, use_gpt=args.gpt, telemetry=telemetry, journal=journal,
+                            enrich_options=args.enrich_options)
+    except RunInterrupted:
+        return None
+    with telemetry.stage("postprocess", file=file, items=len(segs)):
+        segs = postprocess_segments(segs)
+    if journal is not None:
+        with telemetry.stage("journal", file=file, items=len(segs)):
+            journal.file_done(file, segs)
+    return segs
+
+def _stopping(journal):
+    return journal is not None and journal.stop_requested
+
+def run_streaming(args, session_info, export_options, telemetry, journal=None):
+    """
+    Constant-memory mode: each file's segments are written to every output as
+    soon as they are produced, and diagnostics are kept as running aggregates.
+    """
+    agg = QualityAggregator()
+    with ExitStack() as stack:
+        writer = stack.enter_context(SegmentStreamWriter(args.out, args.format, **export_options))
+        review = stack.enter_context(SegmentStreamWriter(args.review_only, "csv")) if args.review_only else None
+        repo = RepoCsvAppender(args.repo) if args.repo else None
+        archive = None
+        if args.markdown and is_archive_path(args.markdown):
+            archive = stack.enter_context(MarkdownArchiveWriter(args.markdown))
+        md_files = 0
+        for file in args.files:
+            if _stopping(journal):
+                break
+            segs = process_or_resume(file, args, telemetry, journal, session_info)
+            if segs is None:
+                break
+            with telemetry.stage(f"export:{args.format}", file=file, items=len(segs)):
+                writer.write(segs)
+            if review is not None:
+                with telemetry.stage("export:review", file=file) as rec:
+                    flagged = get_flagged_segments(segs)
+                    review.write(flagged)
+                    rec.items = len(flagged)
+            if repo is not None:
+                with telemetry.stage("export:repo", file=file, items=len(segs)):
+                    repo.append(segs)
+            if args.markdown:
+                with telemetry.stage("export:markdown", file=file, items=len(segs)):
+                    if archive is not None:
+                        for seg in segs:
+                            archive.add(seg)
+                    else:
+                        md_files += export_segments_per_markdown(segs, args.markdown, max_workers=args.md_workers)['files']
+            agg.update(segs)
+            session_info['outputs'].append({'file': file, 'segments': len(segs)})
+    print(f"✅ Done. Streamed {writer.count} segments to {args.out}")
+    if args.markdown:
+        print(f"Exported {archive.count if archive else md_files} Markdown files to {args.markdown}")
+    if repo is not None:
+        print(f"Appended {repo.appended} new segments to {args.repo} (now {repo.total_rows} rows)")
+    if review is not None:
+        print(f"Exported {review.count} flagged segments to {args.review_only}")
+    return agg.report()
+
+def run_batch(args, session_info, export_options, telemetry, journal=None):
+    """Collects every file's segments, then exports them in one pass."""
+    all_segments = []
+    for file in args.files:
+        if _stopping(journal):
+            break
+        segs = process_or_resume(file, args, telemetry, journal, session_info)
+        if segs is None:
+            break
+        all_segments.extend(segs)
+        session_info['outputs'].append({'file': file, 'segments': len(segs)})
+
+    with telemetry.stage(f"export:{args.format}", items=len(all_segments)) as rec:
+        export_segments(all_segments, args.out, args.format, **export_options)
+        rec.nbytes = _output_size(args.out)
+    print(f"✅ Done. Exported {len(all_segments)} segments to {args.out}")
+
+    # Markdown export
+    if args.markdown:
+        with telemetry.stage("export:markdown", items=len(all_segments)) as rec:
+            md_stats = export_segments_per_markdown(all_segments, args.markdown, max_workers=args.md_workers)
+            rec.nbytes = _output_size(args.markdown)
+        session_info['markdown_export'] = md_stats
+        print(f"Exported {md_stats['files']} Markdown files to {args.markdown} ({md_stats['files_per_sec']} files/sec)")
+
+    # Repo append
+    if args.repo:
+        with telemetry.stage("export:repo", items=len(all_segments)) as rec:
+            update_repo_csv(all_segments, args.repo)
+            rec.nbytes = _output_size(args.repo)
+        print(f"Appended {len(all_segments)} segments to {args.repo}")
+
+    # Review-only export
+    if args.review_only:
+        with telemetry.stage("export:review") as rec:
+            flagged = get_flagged_segments(all_segments)
+            import pandas as pd
+            pd.DataFrame(flagged).to_csv(args.review_only, index=False)
+            rec.items = len(flagged)
+            rec.nbytes = _output_size(args.review_only)
+        print(f"Exported {len(flagged)} flagged segments to {args.review_only}")
+    with telemetry.stage("diagnostics", items=len(all_segments)):
+        diag = quality_report(all_segments)
+    return diag
+
+def run(args, session_info, export_options, telemetry, journal=None):
+    runner = run_streaming if args.stream else run_batch
+    return runner(args, session_info, export_options, telemetry, journal)
+
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("files", nargs='+', help="Path(s) to input file(s) (.docx, .txt, .xlsx)")
+    parser.add_argument("files", nargs='*', help="Path(s) to input file(s) (.docx, .txt, .xlsx)")
     parser.add_argument("--gpt", action="store_true", help="Use GPT enrichment")
-    parser.add_argument("--out", default="output.csv", help="CSV output path (merged)")
+    parser.add_argument("--gpt-concurrency", type=int, default=None, help="Max concurrent GPT requests (default: $GPT_CONCURRENCY or 8)")
+    parser.add_argument("--gpt-rpm", type=int, default=None, help="GPT requests per minute limit (default: $GPT_RPM or 500)")
+    parser.add_argument("--gpt-mode", choices=("combined", "separate"), default="combined",
+                        help="combined: one JSON request per segment; separate: one request per field")
+    parser.add_argument("--gpt-tpm", type=int, default=None, help="GPT tokens per minute limit (default: $GPT_TPM or 90000)")
+    parser.add_argument("--gpt-fixed-concurrency", action="store_true", help="Keep --gpt-concurrency requests in flight instead of adapting (AIMD) to rate limits")
+    parser.add_argument("--gpt-fallback-model", default=None, help="Model to use while the circuit breaker of the main model is open (default: $GPT_FALLBACK_MODEL; none defers the work)")
+    parser.add_argument("--gpt-breaker-cooldown", type=float, default=None, help="Seconds an open circuit breaker fails fast before probing again (default: $GPT_BREAKER_COOLDOWN or 30)")
+    parser.add_argument("--llm-cache", default=None, help="LLM response cache path (default: $LLM_CACHE_PATH or .llm_cache.sqlite)")
+    parser.add_argument("--llm-cache-mode", choices=("rw", "ro", "replay", "off"), default=None,
+                        help="rw: read/write, ro: read only, replay: never call the API, off: disabled")
+    parser.add_argument("--out", default=None, help="Merged output path (default: output.<format>)")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv", help="Merged output format")
+    parser.add_argument("--compression", default="snappy", help="Parquet compression codec (snappy, zstd, gzip, none)")
+    parser.add_argument("--row-group-size", type=int, default=None, help="Parquet row group size (rows)")
     parser.add_argument("--session-log", default=None, help="Path to save session config/log as JSON")
     parser.add_argument("--diagnostics", default=None, help="Path to save diagnostics summary as JSON")
-    parser.add_argument("--markdown", default=None, help="Directory to export per-segment Markdown files")
+    parser.add_argument("--markdown", default=None, help="Directory (or .zip/.tar/.tar.gz archive) to export per-segment Markdown files")
+    parser.add_argument("--md-workers", type=int, default=None, help="Thread pool size for per-segment Markdown export")
     parser.add_argument("--repo", default=None, help="Append to Global_Culture_Repository_Output.csv")
     parser.add_argument("--review-only", default=None, help="Export flagged segments to review.csv")
     parser.add_argument("--log", default=None, help="Write a JSON or YAML run summary (auto-detect by extension)")
     parser.add_argument("--batch", default=None, help="Directory to process all files in (overrides positional files)")
+    parser.add_argument("--stream", action="store_true", help="Write each file's segments as they are produced (constant memory)")
+    parser.add_argument("--profile", default=None, metavar="DIR", help="cProfile each stage; write .pstats, collapsed stacks and a top-20 report to DIR")
+    parser.add_argument("--memprofile", action="store_true", help="tracemalloc per-stage peaks and top allocation sites, saved next to --diagnostics")
+    parser.add_argument("--resume", default=None, metavar="RUN_ID", help="Resume a journaled run, skipping completed files and enriched segments")
+    parser.add_argument("--runs-dir", default="runs", help="Directory holding run journals")
+    parser.add_argument("--journal", dest="journal", action="store_true", default=None,
+                        help="Write a checkpoint journal even without --gpt (the default with --gpt)")
+    parser.add_argument("--no-journal", dest="journal", action="store_false", help="Do not write a checkpoint journal for this run")
+    parser.add_argument("--keep-runs", type=int, default=KEEP_RUNS,
+                        help=f"Finished run journals to keep in --runs-dir; older ones are deleted (default: {KEEP_RUNS})")
+    parser.add_argument("--estimate", action="store_true", help="Dry run: report GPT requests, tokens, cost and wall time, then exit")
     args = parser.parse_args()
+    if args.resume and args.journal is False:
+        parser.error("--resume needs the journal; drop --no-journal")
+    if args.journal is None:
+        args.journal = bool(args.gpt or args.resume)  # only enrichment is worth checkpointing
+    if not args.out:
+        args.out = f"output.{FORMAT_EXTENSIONS[args.format]}"
+    args.enrich_options = {k: v for k, v in (('concurrency', args.gpt_concurrency), ('rpm', args.gpt_rpm),
+                                             ('tpm', args.gpt_tpm), ('fallback_model', args.gpt_fallback_model),
+                                             ('breaker_cooldown', args.gpt_breaker_cooldown)) if v}
+    args.enrich_options['combined'] = args.gpt_mode == "combined"
+    if args.gpt_fixed_concurrency:
+        args.enrich_options['adaptive'] = False
+    export_options = {}
+    if args.format == "parquet":
+        export_options = {
+            'compression': None if args.compression == "none" else args.compression,
+            'row_group_size': args.row_group_size,
+        }
 
     # Directory-wide batch mode
     if args.batch:
@@ -40,39 +217,75 @@ def main():
         args.files = files
         print(f"Batch mode: found {len(files)} files in {batch_dir}")
 
-    all_segments = []
+    if args.estimate:
+        if not args.files:
+            parser.error("--estimate needs input files (give files or --batch DIR)")
+        from core import estimate_enrichment
+        from scripts.cost_estimate import format_estimate
+        from scripts.llm_cache import configure_default_cache
+        configure_default_cache(args.llm_cache, "off" if args.llm_cache_mode == "off" else "ro")
+        print(format_estimate(estimate_enrichment(args.files, enrich_options=args.enrich_options)))
+        return
+
+    journal = None
+    if args.journal:
+        journal = RunJournal(args.resume, root=args.runs_dir,
+                             meta={'files': args.files, 'gpt': args.gpt, 'format': args.format, 'out': args.out})
+        if args.resume and not journal.resumed:
+            parser.error(f"no journal for run {args.resume} in {args.runs_dir}")
+        if not args.files:
+            args.files = journal.meta.get('files', [])
+        if journal.resumed:
+            print(f"Resuming run {journal.run_id}: {len(journal.completed_files)} files and "
+                  f"{journal.enriched_count} enriched segments already journaled")
+        else:
+            print(f"Run ID: {journal.run_id} (journal in {journal.dir})")
+    if not args.files:
+        parser.error("no input files (give files, --batch DIR or --resume RUN_ID)")
+
     session_info = {
         'run_time': datetime.datetime.now().isoformat(),
         'files': args.files,
         'gpt': args.gpt,
+        'format': args.format,
         'outputs': [],
         'diagnostics': {},
+        'run_id': journal.run_id if journal else None,
+        'resumed_files': [],
+        'interrupted': False,
     }
-    for file in args.files:
-        segs = process_file(file, use_gpt=args.gpt)
-        segs = postprocess_segments(segs)
-        all_segments.extend(segs)
-        session_info['outputs'].append({'file': file, 'segments': len(segs)})
-
-    export_segments_csv(all_segments, args.out)
-    print(f"✅ Done. Exported {len(all_segments)} segments to {args.out}")
+    llm_cache = None
+    if args.gpt:
+        from scripts.llm_cache import configure_default_cache
+        llm_cache = configure_default_cache(args.llm_cache, args.llm_cache_mode)
+    telemetry = Telemetry()
+    profiler = None
+    if args.profile:
+        from profiling import StageProfiler
+        profiler = StageProfiler(args.profile)
+        telemetry.observers.append(profiler)
+    memprofiler = None
+    if args.memprofile:
+        from profiling import MemoryProfiler
+        memprofiler = MemoryProfiler()
+        telemetry.observers.append(memprofiler)
+    with ExitStack() as stack:
+        if journal is not None:
+            stack.enter_context(drain_on_sigint(journal))
+        diag = run(args, session_info, export_options, telemetry, journal)
+    session_info['interrupted'] = _stopping(journal)
+    if journal is not None:
+        journal.close("interrupted" if session_info['interrupted'] else "finished")
+        if session_info['interrupted']:
+            print(f"Run interrupted; partial results exported. Resume with --resume {journal.run_id}")
+        prune_runs(args.runs_dir, args.keep_runs)
 
-    # Markdown export
-    if args.markdown:
-        export_segments_per_markdown(all_segments, args.markdown)
-        print(f"Exported Markdown files to {args.markdown}")
 
-    # Repo append
-    if args.repo:
-        update_repo_csv(all_segments, args.repo)
-        print(f"Appended {len(all_segments)} segments to {args.repo}")
-
-    # Review-only export
-    if args.review_only:
-        flagged = get_flagged_segments(all_segments)
-        import pandas as pd
-        pd.DataFrame(flagged).to_csv(args.review_only, index=False)
-        print(f"Exported {len(flagged)} flagged segments to {args.review_only}")
+    session_info['telemetry'] = telemetry.summary()
+    if llm_cache is not None:
+        session_info['llm_cache'] = llm_cache.stats()
+    if memprofiler is not None:
+        session_info['memory'] = memprofiler.summary()
 
     # Save session config/log
     if args.session_log:
@@ -81,7 +294,6 @@ def main():
         print(f"Session log saved to {args.session_log}")
 
     # Diagnostics summary
-    diag = quality_report(all_segments)
     session_info['diagnostics'] = diag
     if args.diagnostics:
         with open(args.diagnostics, 'w', encoding='utf-8') as f:
@@ -107,6 +319,21 @@ def main():
                 json.dump(session_info, f, indent=2)
             print(f"Run summary written to {args.log} (JSON)")
 
+    print("Stage timings:")
+    print(telemetry.format_summary())
+    if llm_cache is not None:
+        from scripts.llm_cache import format_stats
+        print(format_stats(session_info['llm_cache']))
+    if profiler is not None:
+        profiler.write()
+        print(f"Stage profiles written to {args.profile} (see {os.path.join(args.profile, 'report.txt')})")
+    if memprofiler is not None:
+        mem_path = (os.path.splitext(args.diagnostics)[0] + ".memprofile.json") if args.diagnostics else "memprofile.json"
+        memprofiler.write(mem_path)
+        print("Stage memory:")
+        print(memprofiler.format_summary())
+        print(f"Memory profile written to {mem_path}")
+
 # TODO: Add --log flag to write a JSON/YAML run summary
 # TODO: Support directory-wide processing with --batch input_docs/
 
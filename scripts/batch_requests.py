@@ -0,0 +1,392 @@
+"""
+batch_requests.py - Two-phase (offline batch) enrichment.
+
+Instead of thousands of synchronous calls, `prepare` writes every pending
+request to a JSONL file in the Batch API format
+({"custom_id", "method", "url", "body"}), the file is submitted as a batch
+job, and `ingest` merges the downloaded results JSONL back into the culture
+files or segments. `simulate` is a local stand-in that answers a requests
+file deterministically, so the whole workflow can be tested offline.
+
+Custom IDs are stable across runs:
+
+    field|<file name>|<field>    one prompts.json field of a .v3.json culture file
+    segment|<segment key>        one combined-mode request for a document segment
+    chunk|<payload key>          one chunk summary of a segment that is being condensed
+
+Ingested replies are also stored in the LLM response cache (scripts/llm_cache)
+under the same keys the synchronous scripts use, so later runs reuse them.
+Segment requests are built exactly like enrich_segments builds them, so
+those keys match. prepare never calls the API: segments over SUMMARY_TOKEN_CAP
+tokens are condensed (map-reduce, see segment_by_culture.condense) from cached
+chunk summaries, and while those are missing prepare emits the chunk requests
+instead of the segment's request. Long segments therefore take one more
+prepare/ingest round per condense round. prepare skips requests whose reply
+is already cached, and fields already present in the ingested copies
+(--output), so re-running it after a failed or partial batch only emits the
+missing items.
+
+Usage:
+    python -m scripts.batch_requests prepare --fields parsed_output --output enriched/ --out batch/requests.jsonl
+    python -m scripts.batch_requests prepare --segments input_docs/guide.docx --out batch/requests.jsonl
+    python -m scripts.batch_requests simulate batch/requests.jsonl --out batch/results.jsonl
+    python -m scripts.batch_requests ingest batch/results.jsonl --fields parsed_output --output enriched/
+    python -m scripts.batch_requests ingest batch/results.jsonl --segments batch/requests.segments.jsonl --out enriched.csv
+"""
+import argparse
+import hashlib
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+from scripts.llm_cache import default_cache, payload_key
+
+DEFAULT_OUT = os.path.join("batch", "requests.jsonl")
+ENDPOINT = "/v1/chat/completions"
+# Same request parameters as gpt_enrich_fields_with_openai, so cache keys line up.
+FIELD_MODEL = "gpt-3.5-turbo"
+FIELD_TEMPERATURE = 0.7
+FIELD_MAX_TOKENS = 600
+DEFAULT_SYSTEM_PROMPT = "You are an expert in global cultural anthropology."
+
+
+def _request(custom_id, body):
+    return {'custom_id': custom_id, 'method': "POST", 'url': ENDPOINT, 'body': body}
+
+
+def _write_jsonl(path, rows):
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def _read_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def sidecar_path(requests_path):
+    """Where prepare --segments keeps the pending segments next to the requests file."""
+    base, _ = os.path.splitext(requests_path)
+    return base + ".segments.jsonl"
+
+
+# -- prepare --------------------------------------------------------------
+
+def _cached(body):
+    return default_cache().contains(payload_key(body))
+
+
+def _ingested(path, output_dir):
+    """Culture data of path, from the copy ingest_fields wrote to output_dir if there is one."""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if output_dir:
+        copy = Path(output_dir) / data.get('language_tag', 'und') / path.name
+        if copy.exists():
+            with open(copy, encoding="utf-8") as f:
+                return json.load(f)
+    return data
+
+
+def field_requests(input_dir, prompts, system_prompt=DEFAULT_SYSTEM_PROMPT, overwrite=False, stale_only=False,
+                   output_dir=None):
+    """
+    One request per prompts.json field of every *.v3.json file in input_dir that
+    is missing or holds an [ERROR: ...] value (every field with `overwrite`);
+    with `stale_only`, also the fields whose provenance is out of date
+    (scripts.field_provenance). Fields are read from the copies ingest wrote
+    to `output_dir`, where present, and requests with a cached reply are skipped.
+    """
+    from scripts.field_provenance import stale_fields
+    for path in sorted(Path(input_dir).glob("*.v3.json")):
+        data = _ingested(path, output_dir)
+        culture_name = data.get('culture_name') or path.name.replace(".v3.json", "")
+        stale = stale_fields(data, prompts, system_prompt, FIELD_MODEL) if stale_only else ()
+        for field, template in prompts.items():
+            value = data.get(field)
+            if not overwrite and value and not str(value).startswith("[ERROR") and field not in stale:
+                continue
+            body = {
+                'model': FIELD_MODEL,
+                'messages': [{'role': "system", 'content': system_prompt},
+                             {'role': "user", 'content': template.format(culture_name=culture_name)}],
+                'temperature': FIELD_TEMPERATURE,
+                'max_tokens': FIELD_MAX_TOKENS,
+            }
+            if not overwrite and _cached(body):
+                continue
+            yield _request(f"field|{path.name}|{field}", body)
+
+
+def _condensed(engine, content, culture):
+    """
+    segment_by_culture.condense() replayed from the LLM cache, without network
+    calls: (condensed content, []) when the chunk summaries of every round are
+    cached, else (None, the chunk request bodies of the first round missing some).
+    """
+    from scripts.segment_by_culture import (MAX_CONDENSE_ROUNDS, SUMMARY_TOKEN_CAP, chunk_summary_prompt,
+                                            chunk_text, count_tokens)
+    for _ in range(MAX_CONDENSE_ROUNDS):
+        if count_tokens(content) <= SUMMARY_TOKEN_CAP:
+            break
+        chunks = chunk_text(content)
+        bodies = [engine.build_payload(chunk_summary_prompt(chunk, culture, i, len(chunks)))
+                  for i, chunk in enumerate(chunks, 1)]
+        missing = [body for body in bodies if not _cached(body)]
+        if missing:
+            return None, missing
+        content = "\n\n".join(default_cache().get(payload_key(body)) for body in bodies)
+    return content, []
+
+
+def segment_requests(files, section_summaries=True, model=None, **engine_options):
+    """
+    (requests, pending) for the segments of the input documents: one
+    combined-mode request per segment whose reply is not cached yet, plus
+    the records of all segments for ingest to merge into (cached replies are
+    filled in there). Bodies come from default_engine(**engine_options) the
+    way enrich_segments builds them. Segments over SUMMARY_TOKEN_CAP tokens
+    whose chunk summaries are not all cached get chunk requests instead and
+    no body; their segment request follows in the next prepare. No requests
+    are sent.
+    """
+    from core import process_file
+    from journal import segment_key
+    from scripts.segment_by_culture import default_engine, segment_combined_prompt, segment_sections
+    engine = default_engine(**engine_options)
+    requests, pending, emitted = [], [], set()
+    for file in files:
+        for seg in process_file(file, use_gpt=False):
+            sections = []
+            if section_summaries:
+                sections = list(dict.fromkeys(s['section'] for s in segment_sections(seg['content'])))
+            custom_id = f"segment|{segment_key(seg)}"
+            entry = {'custom_id': custom_id, 'sections': sections, 'section_summaries': section_summaries,
+                     'body': None, 'segment': dict(seg)}
+            content, missing = _condensed(engine, seg['content'], seg['title'])
+            if missing:
+                entry['chunks'] = [_request(f"chunk|{payload_key(body)}", body) for body in missing]
+                for chunk in entry['chunks']:
+                    if chunk['custom_id'] not in emitted:
+                        emitted.add(chunk['custom_id'])
+                        requests.append(chunk)
+            else:
+                entry['body'] = engine.build_payload(segment_combined_prompt(content, seg['title'], sections), model)
+                if not _cached(entry['body']):
+                    requests.append(_request(custom_id, entry['body']))
+            pending.append(entry)
+    return requests, pending
+
+
+# -- local stand-in -------------------------------------------------------
+
+def _digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def fake_reply(body):
+    """
+    Deterministic reply for a chat-completions body: a valid combined-mode JSON
+    object when the prompt asks for one, otherwise a short text derived from
+    the prompt. Same body, same reply.
+    """
+    prompt = body['messages'][-1]['content']
+    tag = _digest(json.dumps(body, sort_keys=True))[:8]
+    if "Return only a JSON object" not in prompt:
+        return f"Simulated response {tag}: {prompt.strip().splitlines()[0][:80]}"
+    marker = "section names to a one-sentence summary:"
+    section_line = next((line for line in prompt.splitlines() if marker in line), None)
+    if section_line:
+        names = json.loads("[" + section_line.split(marker, 1)[1].strip().rstrip(".") + "]")
+        section_summary = {name: f"Simulated summary of {name} ({tag})." for name in names}
+    else:  # no sections: '"section_summary": an empty string'
+        section_summary = ""
+    return json.dumps({'summary': f"Simulated summary ({tag}).", 'tags': ["simulated", "culture", tag],
+                       'section_summary': section_summary})
+
+
+def simulate(requests_path, out_path, model_suffix="-simulated"):
+    """Answers every request in requests_path like a completed batch job would."""
+    def results():
+        for i, req in enumerate(_read_jsonl(requests_path)):
+            body = req['body']
+            yield {
+                'id': f"batch_req_{i}",
+                'custom_id': req['custom_id'],
+                'response': {'status_code': 200, 'body': {
+                    'object': "chat.completion",
+                    'model': body['model'] + model_suffix,
+                    'choices': [{'index': 0, 'message': {'role': "assistant", 'content': fake_reply(body)},
+                                 'finish_reason': "stop"}],
+                }},
+                'error': None,
+            }
+    return _write_jsonl(out_path, results())
+
+
+# -- ingest ---------------------------------------------------------------
+
+def read_results(results_path):
+    """{custom_id: (reply text, model)} for successful results, plus the failed custom IDs."""
+    replies, failed = {}, []
+    for row in _read_jsonl(results_path):
+        response = row.get('response') or {}
+        if row.get('error') or response.get('status_code') != 200:
+            failed.append(row.get('custom_id'))
+            continue
+        body = response['body']
+        replies[row['custom_id']] = (body['choices'][0]['message']['content'].strip(), body.get('model'))
+    return replies, failed
+
+
+def _cache_reply(body, text, model):
+    default_cache().put(payload_key(body), text, model=model)
+
+
+def ingest_fields(results_path, requests_path, input_dir, output_dir):
+    """
+    Writes enriched copies of the culture files to output_dir/<language_tag>/,
+    on top of the copies earlier ingests wrote there. Returns stats.
+    """
+    replies, failed = read_results(results_path)
+    bodies = {req['custom_id']: req['body'] for req in _read_jsonl(requests_path)} if requests_path else {}
+    by_file = {}
+    for custom_id, reply in replies.items():
+        kind, filename, field = custom_id.split("|", 2)
+        if kind == "field":
+            by_file.setdefault(filename, {})[field] = reply
+    for filename, fields in by_file.items():
+        data = _ingested(Path(input_dir) / filename, output_dir)  # keeps fields merged by earlier batches
+        for field, (text, model) in fields.items():
+            data[field] = text
+            data['model_used'] = model
+            body = bodies.get(f"field|{filename}|{field}")
+            if body is not None:
+                _cache_reply(body, text, model)
+        data.setdefault('source', "AI Enrichment (OpenAI GPT)")
+        data['enriched_timestamp'] = datetime.utcnow().isoformat() + "Z"
+        out = Path(output_dir) / data.get('language_tag', 'und') / filename
+        out.parent.mkdir(parents=True, exist_ok=True)
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+    return {'files': len(by_file), 'fields': sum(len(v) for v in by_file.values()), 'failed': len(failed)}
+
+
+def ingest_segments(results_path, sidecar, requests_path=None):
+    """
+    Merges combined-mode replies into the pending segments, from the results
+    or, for requests prepare skipped, from the LLM cache; returns (segments, stats).
+    Chunk summaries of segments still being condensed only go to the cache;
+    those segments stay pending ('condensing') until the next prepare.
+    """
+    from scripts.segment_by_culture import parse_combined
+    from segment import Segment
+    replies, failed = read_results(results_path)
+    bodies = {req['custom_id']: req['body'] for req in _read_jsonl(requests_path)} if requests_path else {}
+    segments, merged, cached, rejected, condensing = [], 0, 0, 0, 0
+    for entry in _read_jsonl(sidecar):
+        seg = Segment(entry['segment'])
+        for chunk in entry.get('chunks', ()):
+            if chunk['custom_id'] in replies:
+                _cache_reply(chunk['body'], *replies[chunk['custom_id']])
+        if entry.get('chunks'):
+            condensing += 1
+            segments.append(seg)
+            continue
+        body = entry.get('body') or bodies.get(entry['custom_id'])
+        reply = replies.get(entry['custom_id'])
+        if reply is None and body is not None and _cached(body):
+            reply = (default_cache().get(payload_key(body)), None)
+            cached += 1
+        elif reply is not None and body is not None:
+            _cache_reply(body, reply[0], reply[1])
+        if reply is not None:
+            try:
+                fields = parse_combined(reply[0], sections=entry['sections'])
+            except ValueError:
+                rejected += 1
+            else:
+                seg.update(fields)
+                if entry['section_summaries']:
+                    seg.setdefault('section_summary', "")
+                merged += 1
+        segments.append(seg)
+    stats = {'segments': len(segments), 'merged': merged, 'cached': cached, 'rejected': rejected,
+             'condensing': condensing, 'failed': len(failed)}
+    return segments, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline batch enrichment: prepare, simulate, ingest")
+    sub = parser.add_subparsers(dest="command", required=True)
+    prep = sub.add_parser("prepare", help="Write pending requests as Batch API JSONL")
+    src = prep.add_mutually_exclusive_group(required=True)
+    src.add_argument("--fields", metavar="DIR", help="Folder of .v3.json culture files")
+    src.add_argument("--segments", nargs="+", metavar="FILE", help="Input documents (.docx, .txt, .xlsx)")
+    prep.add_argument("--out", default=DEFAULT_OUT, help=f"Requests JSONL path (default: {DEFAULT_OUT})")
+    prep.add_argument("--prompts", default="prompts.json", help="Field prompts for --fields")
+    prep.add_argument("--system-prompt", default=DEFAULT_SYSTEM_PROMPT)
+    prep.add_argument("--overwrite-existing-fields", action="store_true")
+    prep.add_argument("--stale-only", action="store_true", help="--fields: also re-request fields with outdated provenance")
+    prep.add_argument("--output", help="--fields: folder ingest wrote enriched files to; fields present there are skipped")
+    prep.add_argument("--no-section-summaries", action="store_true")
+    sim = sub.add_parser("simulate", help="Answer a requests file locally (deterministic stand-in)")
+    sim.add_argument("requests")
+    sim.add_argument("--out", required=True, help="Results JSONL path")
+    ing = sub.add_parser("ingest", help="Merge a results JSONL back into culture files or segments")
+    ing.add_argument("results")
+    dst = ing.add_mutually_exclusive_group(required=True)
+    dst.add_argument("--fields", metavar="DIR", help="Folder of the original .v3.json files")
+    dst.add_argument("--segments", metavar="SIDECAR", help="Pending segments written by prepare --segments")
+    ing.add_argument("--requests", help="Requests JSONL, to also seed the LLM response cache")
+    ing.add_argument("--output", help="--fields: output folder for enriched files")
+    ing.add_argument("--out", help="--segments: export path for the enriched segments")
+    ing.add_argument("--format", default="csv", help="--segments: export format (csv, jsonl, parquet, md)")
+    args = parser.parse_args()
+
+    if args.command == "prepare":
+        if args.fields:
+            with open(args.prompts, encoding="utf-8") as f:
+                prompts = json.load(f)
+            n = _write_jsonl(args.out, field_requests(args.fields, prompts, args.system_prompt,
+                                                      args.overwrite_existing_fields, args.stale_only,
+                                                      args.output))
+        else:
+            requests, pending = segment_requests(args.segments, section_summaries=not args.no_section_summaries)
+            n = _write_jsonl(args.out, requests)
+            _write_jsonl(sidecar_path(args.out), pending)
+            print(f"Pending segments saved to {sidecar_path(args.out)}")
+            condensing = sum(1 for entry in pending if entry.get('chunks'))
+            if condensing:
+                print(f"{condensing} long segments need their chunk summaries first: ingest this batch, "
+                      f"then run prepare again")
+        print(f"Wrote {n} requests to {args.out}")
+    elif args.command == "simulate":
+        print(f"Wrote {simulate(args.requests, args.out)} results to {args.out}")
+    elif args.fields:
+        if not args.output:
+            parser.error("ingest --fields needs --output")
+        stats = ingest_fields(args.results, args.requests, args.fields, args.output)
+        print(f"Merged {stats['fields']} fields into {stats['files']} files ({stats['failed']} failed requests)")
+    else:
+        if not args.out:
+            parser.error("ingest --segments needs --out")
+        from core import export_segments, postprocess_segments
+        segments, stats = ingest_segments(args.results, args.segments, args.requests)
+        export_segments(postprocess_segments(segments), args.out, args.format)
+        print(f"Merged {stats['merged']} of {stats['segments']} segments into {args.out} ({stats['cached']} from "
+              f"the cache, {stats['rejected']} unparseable replies, {stats['failed']} failed requests)")
+        if stats['condensing']:
+            print(f"{stats['condensing']} long segments were condensed; run prepare again for their requests")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+cost_estimate.py - Dry-run estimates of GPT enrichment runs.
+
+Builds the same prompts a run would send, without sending them, and reports
+request counts, input and output tokens, dollar cost and the projected wall
+time under the configured limits. Requests already in the LLM response cache
+are counted separately and cost nothing.
+
+Output tokens are not known in advance; each request is counted at its
+max_tokens, or at the engine's completion_tokens reservation (the figure the
+TPM limiter budgets) when it has none. Wall time is the largest of three bounds:
+requests per minute, tokens per minute (both after the initial full bucket)
+and concurrency x assumed latency per request.
+
+Used by the --estimate flags of run_pipeline.py, cli.py,
+scripts/segment_by_culture.py and gpt_enrich_fields_with_openai.py.
+"""
+import math
+
+from scripts.llm_cache import payload_key
+
+# USD per 1M tokens (input, output), list prices.
+PRICES_PER_1M = {
+    'gpt-4': (30.00, 60.00),
+    'gpt-4-turbo': (10.00, 30.00),
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-3.5-turbo': (0.50, 1.50),
+}
+DEFAULT_LATENCY_S = 2.0  # assumed seconds per request for the concurrency bound
+
+
+def model_price(model):
+    """(input, output) USD per 1M tokens; dated names ("gpt-4o-2024-08-06") use their base model."""
+    if model in PRICES_PER_1M:
+        return PRICES_PER_1M[model]
+    base = max((m for m in PRICES_PER_1M if model.startswith(m + "-")), key=len, default=None)
+    return PRICES_PER_1M.get(base)
+
+
+class Estimate:
+    def __init__(self, rpm=None, tpm=None, concurrency=1, latency=DEFAULT_LATENCY_S,
+                 count_tokens=None, completion_tokens=256, cache=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.concurrency = concurrency
+        self.latency = latency
+        self.count_tokens = count_tokens or (lambda text: len(text) // 4 + 1)
+        self.completion_tokens = completion_tokens
+        self.cache = cache
+        self.requests = self.cached = 0
+        self.input_tokens = self.output_tokens = 0
+        self.cost = 0.0
+        self.unpriced = set()
+
+    @classmethod
+    def for_engine(cls, engine, latency=DEFAULT_LATENCY_S):
+        """Limits, token counter and cache of an EnrichmentEngine."""
+        requests, tokens = engine.limiter.requests, engine.limiter.tokens
+        return cls(rpm=int(requests.capacity) if requests else None, tpm=int(tokens.capacity) if tokens else None,
+                   concurrency=engine.concurrency, latency=latency, count_tokens=engine.count_tokens,
+                   completion_tokens=engine.completion_tokens, cache=engine.cache)
+
+    def add(self, payload):
+        """Counts one Chat Completions request body ({'model', 'messages', ...})."""
+        if self.cache is not None and self.cache.contains(payload_key(payload)):
+            self.cached += 1
+            return
+        tokens_in = sum(self.count_tokens(m['content']) for m in payload['messages'])
+        tokens_out = payload.get('max_tokens') or self.completion_tokens
+        self.requests += 1
+        self.input_tokens += tokens_in
+        self.output_tokens += tokens_out
+        price = model_price(payload['model'])
+        if price is None:
+            self.unpriced.add(payload['model'])
+        else:
+            self.cost += (tokens_in * price[0] + tokens_out * price[1]) / 1e6
+
+    def wall_time(self):
+        """(seconds, binding limit) for the uncached requests."""
+        bounds = {'concurrency': math.ceil(self.requests / max(1, self.concurrency)) * self.latency}
+        if self.rpm:
+            bounds['rpm'] = max(0, self.requests - self.rpm) / self.rpm * 60
+        if self.tpm:
+            total = self.input_tokens + self.output_tokens
+            bounds['tpm'] = max(0, total - self.tpm) / self.tpm * 60
+        limit = max(bounds, key=bounds.get)
+        return bounds[limit], limit
+
+    def summary(self):
+        seconds, limit = self.wall_time()
+        return {
+            'requests': self.requests,
+            'cached_requests': self.cached,
+            'input_tokens': self.input_tokens,
+            'output_tokens': self.output_tokens,
+            'cost_usd': round(self.cost, 4),
+            'unpriced_models': sorted(self.unpriced),
+            'wall_seconds': round(seconds, 1),
+            'limited_by': limit,
+            'rpm': self.rpm,
+            'tpm': self.tpm,
+            'concurrency': self.concurrency,
+            'assumed_latency_s': self.latency,
+        }
+
+
+def format_estimate(summary):
+    minutes = summary['wall_seconds'] / 60
+    lines = [
+        f"Requests:      {summary['requests']} to send, {summary['cached_requests']} served from the LLM cache",
+        f"Tokens:        {summary['input_tokens']:,} input, {summary['output_tokens']:,} output (assumed)",
+        f"Cost:          ${summary['cost_usd']:.{2 if summary['cost_usd'] >= 1 else 4}f}",
+        f"Wall time:     {minutes:.1f} min (limited by {summary['limited_by']}; rpm={summary['rpm']}, "
+        f"tpm={summary['tpm']}, concurrency={summary['concurrency']}, {summary['assumed_latency_s']}s/request)",
+    ]
+    if summary['unpriced_models']:
+        lines.append(f"No price for: {', '.join(summary['unpriced_models'])} (not included in cost)")
+    return "\n".join(lines)
+
+
+def estimate_segments(segments, section_summaries=True, combined=True, engine=None, estimate=None,
+                      latency=DEFAULT_LATENCY_S, tagger=None, **engine_options):
+    """
+    Estimate for enrich_segments(segments, ...) with the same engine options:
+    one combined request per segment, or summary + tags + one per section
+    (no tags request where `tagger` tags the segment locally).
+    Long segments add one map request per chunk (the reduce prompts are
+    approximated with the truncated text). Combined-mode fallbacks are not
+    counted. Pass `estimate` to add to a running total (several files).
+    """
+    from scripts.segment_by_culture import (SUMMARY_TOKEN_CAP, chunk_summary_prompt, chunk_text, confident_tags,
+                                            default_engine, section_summary_prompt, segment_combined_prompt,
+                                            segment_sections, summarize_prompt, tags_prompt)
+    engine = engine or default_engine(**engine_options)
+    estimate = estimate or Estimate.for_engine(engine, latency)
+    segments = list(segments)
+    for seg, tags in zip(segments, confident_tags(None if combined else tagger, segments)):
+        content, title = seg['content'], seg['title']
+        sections = segment_sections(content) if section_summaries else []
+        if engine.count_tokens(content) > SUMMARY_TOKEN_CAP:
+            chunks = chunk_text(content)
+            for i, chunk in enumerate(chunks, 1):
+                estimate.add(engine.build_payload(chunk_summary_prompt(chunk, title, i, len(chunks)), None))
+        if combined:
+            names = list(dict.fromkeys(sec['section'] for sec in sections))
+            prompts = [segment_combined_prompt(content, title, names)]
+        else:
+            prompts = [summarize_prompt(content, title)] + ([] if tags else [tags_prompt(content)])
+            prompts += [section_summary_prompt(sec['content'], sec['section'], title) for sec in sections]
+        for prompt in prompts:
+            estimate.add(engine.build_payload(prompt, None))
+    return estimate
@@ -0,0 +1,189 @@
+"""
+culture_fields.py - Helpers of gpt_enrich_fields_with_openai.py that need neither openai nor prompts.json.
+
+Structured mode asks for all of a culture's missing fields in one JSON-object
+reply instead of one request per field:
+
+    reply = complete(structured_prompt(prompts, culture_name, fields), ...)
+    valid, failed = validate_structured(reply, fields)
+
+validate_structured() checks the reply against fields_schema(): a JSON object
+with every requested field as a non-empty string. Only the failed fields are
+requested again. The helpers take the prompts and the request function as
+arguments.
+
+plan_enrichment() picks the fields a culture needs, after applying the
+culture_name and language_tag defaults. The run and --estimate both call it,
+so they judge staleness on the same data.
+
+enrich_files() runs the per-file work on a thread pool and handles the
+results on the calling thread: the run's CSV log has a single writer, and the
+summary counts are kept in memory instead of being re-read from the log.
+save_culture_data() writes atomically, so an interrupted run never leaves a
+half-written culture file.
+"""
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from scripts import field_provenance
+from scripts.llm_cache import CacheMiss
+
+logger = logging.getLogger(__name__)
+
+STRUCTURED_MAX_TOKENS = 4096
+STRUCTURED_ROUNDS = 2  # structured requests per culture before falling back to per-field calls
+
+
+def with_defaults(data, culture_name):
+    """Copy of a culture file's data with the culture_name and language_tag ("und") every enriched file has."""
+    data = dict(data)
+    if not data.get('culture_name'):
+        data['culture_name'] = culture_name
+    if not data.get('language_tag'):
+        data['language_tag'] = "und"
+    return data
+
+
+def plan_enrichment(existing_data, culture_name, prompts, model, system_prompt, force_enrich=False,
+                    stale_only=False):
+    """
+    (data, fields): with_defaults(existing_data) and the prompts fields to
+    request for it: the empty ones, plus with stale_only those whose
+    provenance no longer matches (scripts.field_provenance), or all of them
+    with force_enrich. Provenance hashes the defaults too, so staleness is
+    only meaningful on the defaulted data.
+    """
+    data = with_defaults(existing_data, culture_name)
+    stale = field_provenance.stale_fields(data, prompts, system_prompt, model) if stale_only else ()
+    return data, [field for field in prompts if force_enrich or not data.get(field) or field in stale]
+
+
+def fields_schema(fields):
+    """JSON schema for a structured reply: every requested field as a required string."""
+    return {
+        "type": "object",
+        "properties": {field: {"type": "string"} for field in fields},
+        "required": list(fields),
+        "additionalProperties": False,
+    }
+
+
+def structured_prompt(prompts, culture_name, fields):
+    lines = [f'- "{field}": {prompts[field].format(culture_name=culture_name)}' for field in fields]
+    return (
+        f"Provide the following information about the {culture_name} culture.\n"
+        f"Return only a JSON object that matches this JSON schema:\n{json.dumps(fields_schema(fields))}\n\n"
+        "Field instructions:\n" + "\n".join(lines)
+    )
+
+
+def structured_max_tokens(fields, max_tokens):
+    """Completion budget of a structured request: max_tokens per field, capped at STRUCTURED_MAX_TOKENS."""
+    return min(max_tokens * len(fields), STRUCTURED_MAX_TOKENS)
+
+
+def validate_structured(reply, fields):
+    """
+    Checks a structured reply against fields_schema(fields). Returns
+    (valid, failed): the usable field values and the fields to request again.
+    """
+    text = reply.strip()
+    if text.startswith("```"):
+        text = text.strip("`").removeprefix("json").strip()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return {}, list(fields)
+    if not isinstance(data, dict):
+        return {}, list(fields)
+    valid, failed = {}, []
+    for field in fields:
+        value = data.get(field)
+        if isinstance(value, str) and value.strip():
+            valid[field] = value.strip()
+        else:
+            failed.append(field)
+    return valid, failed
+
+
+def enrich_fields_structured(enriched_data, fields, culture_name, system_prompt, prompts, complete, max_tokens,
+                             errors=()):
+    """
+    Requests all `fields` in one JSON-object reply, re-requesting only the
+    fields that were missing or invalid. `complete(prompt, system_prompt,
+    max_tokens=..., response_format=...)` returns (text, model) and raises
+    CacheMiss or one of `errors` on failure. Returns the fields still unresolved.
+    """
+    todo = list(fields)
+    for _ in range(STRUCTURED_ROUNDS):
+        if not todo:
+            break
+        try:
+            reply, model = complete(
+                structured_prompt(prompts, culture_name, todo), system_prompt,
+                max_tokens=structured_max_tokens(todo, max_tokens),
+                response_format={"type": "json_object"},
+            )
+        except (CacheMiss, *errors) as e:
+            logger.warning(f"  - Structured request for {culture_name} failed: {e!r}")
+            break
+        valid, todo = validate_structured(reply, todo)
+        if valid:
+            enriched_data.update(valid)
+            enriched_data['model_used'] = model
+        logger.debug(f"  - Structured reply: {len(valid)} valid, {len(todo)} to re-request")
+    return todo
+
+
+def save_culture_data(filepath, data):
+    """Writes atomically: a temp file in the same folder, renamed over the target once complete."""
+    filepath = Path(filepath)
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=filepath.parent, prefix=f".{filepath.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def log_enriched_fields(writer, filename, enriched_fields):
+    """Appends one row per enriched field to the run's open CSV log writer; returns the row count."""
+    writer.writerows([filename, field] for field in enriched_fields)
+    return len(enriched_fields)
+
+
+def enrich_files(filenames, enrich_file, log_writer=None, workers=1, progress=None):
+    """
+    Calls enrich_file(filename) -> (status, enriched fields, output path) for
+    every file on `workers` threads. Results are handled on the calling thread
+    in completion order, so `log_writer` is only ever written from here; a
+    file that raised counts as failed. `progress` wraps the completion
+    iterator (e.g. tqdm). Returns (counts by status, enriched field count).
+    """
+    counts = {'processed': 0, 'skipped': 0, 'failed': 0}
+    enriched_field_count = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(enrich_file, filename): filename for filename in filenames}
+        done = as_completed(futures)
+        if progress:
+            done = progress(done, total=len(futures))
+        for i, future in enumerate(done, start=1):
+            filename = futures[future]
+            try:
+                status, enriched_fields, output_filepath = future.result()
+            except Exception as e:
+                logger.error(f"Failed to process {filename}: {e}")
+                counts['failed'] += 1
+                continue
+            counts[status] += 1
+            if status == "processed":
+                enriched_field_count += log_enriched_fields(log_writer, filename, enriched_fields)
+                logger.info(f"[{i}/{len(futures)}] Enriched and saved: {output_filepath}")
+    return counts, enriched_field_count
@@ -0,0 +1,622 @@
+"""
+enrichment_engine.py - Rate-limited, concurrent client for GPT enrichment.
+
+All requests go through one shared httpx client to the Chat Completions
+endpoint (OPENAI_BASE_URL, default https://api.openai.com/v1) and are
+throttled by two token buckets, one for requests per minute and one for
+tokens per minute. The number of requests in flight is set by an AIMD
+controller (ConcurrencyController): it grows by one slot per window of
+successful calls up to `concurrency`, halves on 429s and timeouts, and stops
+new requests for the duration of a Retry-After header, so a long run settles
+near the highest rate the API sustains (adaptive=False, or GPT_ADAPTIVE=0,
+keeps it fixed at `concurrency`). Timeouts, connection errors, 429 and 5xx
+responses are retried with full-jitter exponential backoff; a Retry-After
+header, when present, sets the minimum wait.
+
+Each model has a CircuitBreaker. When most recent attempts fail with 5xx
+answers, timeouts or connection errors, it opens: requests for that model go
+to `fallback_model` (GPT_FALLBACK_MODEL), if one is set and its own breaker is
+closed, or fail at once with CircuitOpen instead of sleeping through their
+retries. After a cool-down one probe request is let through; its outcome
+closes or reopens the breaker. Callers defer what failed and retry it later
+(see segment_by_culture.enrich_segments).
+
+With a cache (scripts.llm_cache.LLMCache), a response already stored for the
+same model, prompts and parameters is returned without touching the network
+or the rate limits, and new responses are stored as they arrive. Identical
+requests made while one is in flight wait for its reply instead of being sent
+again (single-flight), with or without a cache.
+
+EnrichmentEngine.complete() is the asyncio path used by
+segment_by_culture.enrich_segments; complete_sync() serves the blocking
+callers (safe_gpt_call) and shares the same limiter, so both respect one budget.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+import httpx
+
+DEFAULT_MODEL = "gpt-4"
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+RETRYABLE_STATUS = frozenset({408, 409, 429, 500, 502, 503, 504})
+
+# AsyncClient of the run() in progress; per task context, so one engine can
+# serve several threads' event loops at once.
+_session = contextvars.ContextVar("enrichment_session")
+
+
+class GPTError(Exception):
+    """A request that failed permanently or ran out of retries."""
+
+
+class CircuitOpen(GPTError):
+    """Refused without a request: the model's circuit breaker is open and no fallback is available."""
+
+
+class TokenBucket:
+    """Refills rate_per_minute units per minute up to capacity; safe to share between threads."""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(capacity or rate_per_minute)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount=1):
+        """
+        Takes `amount` immediately, letting the balance go negative, and
+        returns how long the caller must wait before using it. Callers queue
+        in reservation order without holding the lock while they sleep.
+        """
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute buckets; a limit of None disables that bucket."""
+
+    def __init__(self, rpm=None, tpm=None):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+
+    def _wait(self, tokens):
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.reserve(tokens))
+        return wait
+
+    def acquire(self, tokens=0):
+        wait = self._wait(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=0):
+        wait = self._wait(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class ConcurrencyController:
+    """
+    Additive-increase/multiplicative-decrease limit on requests in flight,
+    shared by the asyncio and blocking paths (waiters poll, so it works across
+    threads and event loops). Each success adds increase/limit, i.e. about one
+    slot per window of `limit` successes; a throttled call (429 or timeout)
+    multiplies the limit by `decrease`, at most once per window: only calls
+    started after the previous cut can cut again. pause() holds back new
+    requests until a Retry-After has passed. The limit and the observed
+    throughput are logged every `log_interval` seconds.
+    """
+
+    POLL = 0.01
+
+    def __init__(self, max_limit, initial=None, min_limit=1, increase=1.0, decrease=0.5, adaptive=True,
+                 log_interval=30.0):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = min(min_limit, self.max_limit)
+        self.adaptive = adaptive
+        self.limit = float(self.max_limit if not adaptive else (initial or max(self.min_limit, self.max_limit // 2)))
+        self.increase = increase
+        self.decrease = decrease
+        self.log_interval = log_interval
+        self.in_flight = self.peak = 0
+        self.completed = self.throttled = 0
+        self.paused_until = 0.0
+        self._last_cut = 0.0
+        self._started = self._window_start = time.monotonic()
+        self._window_done = self._window_throttled = 0
+        self._lock = threading.Lock()
+
+    def _try_acquire(self):
+        """(start time, 0) when a slot was taken, else (None, seconds worth waiting)."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return None, self.paused_until - now
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                self.peak = max(self.peak, self.in_flight)
+                return now, 0.0
+        return None, self.POLL
+
+    def acquire(self):
+        """Blocks until a slot is free; returns the token to pass to release()."""
+        while True:
+            started, wait = self._try_acquire()
+            if started is not None:
+                return started
+            time.sleep(min(wait, 1.0))
+
+    async def acquire_async(self):
+        while True:
+            started, wait = self._try_acquire()
+            if started is not None:
+                return started
+            await asyncio.sleep(min(wait, 1.0))
+
+    def release(self, started, outcome):
+        """outcome: "ok", "throttled" (429 or timeout) or "error" (no change to the limit)."""
+        with self._lock:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if outcome == "ok":
+                self.completed += 1
+                self._window_done += 1
+                if self.adaptive:
+                    self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+            elif outcome == "throttled":
+                self.throttled += 1
+                self._window_throttled += 1
+                if self.adaptive and started >= self._last_cut:
+                    self.limit = max(self.min_limit, self.limit * self.decrease)
+                    self._last_cut = now
+            report = self.log_interval and now - self._window_start >= self.log_interval
+            if report:
+                rate = self._window_done / (now - self._window_start)
+                message = (f"GPT concurrency limit {self.limit:.1f}/{self.max_limit} ({self.in_flight} in flight): "
+                           f"{rate:.2f} req/s, {self._window_throttled} throttled in the last "
+                           f"{now - self._window_start:.0f}s")
+                self._window_start, self._window_done, self._window_throttled = now, 0, 0
+        if report:
+            logging.info(message)
+
+    def pause(self, seconds):
+        """No new requests for `seconds` (Retry-After)."""
+        if seconds > 0:
+            with self._lock:
+                self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def stats(self):
+        with self._lock:
+            elapsed = time.monotonic() - self._started
+            return {
+                'limit': round(self.limit, 2),
+                'max_limit': self.max_limit,
+                'peak_in_flight': self.peak,
+                'completed': self.completed,
+                'throttled': self.throttled,
+                'requests_per_sec': round(self.completed / elapsed, 2) if elapsed > 0 else None,
+            }
+
+
+class CircuitBreaker:
+    """
+    Fails fast while an endpoint is down. Opens when at least `failure_rate`
+    of the last `window` attempts (and no fewer than `min_calls`) failed;
+    while open, allow() refuses for `cooldown` seconds, then admits a single
+    probe (half-open). A successful probe closes the breaker with a fresh
+    window, a failed one reopens it. Every allow() that returns True must be
+    followed by record(), or by abandon() when the attempt never got an
+    answer (cancelled). failure_rate=0 disables the breaker.
+    """
+
+    def __init__(self, failure_rate=0.5, window=20, min_calls=10, cooldown=30.0, name=""):
+        self.failure_rate = failure_rate
+        self.min_calls = min(min_calls, window)
+        self.cooldown = cooldown
+        self.name = name
+        self.state = "closed"
+        self.opened = 0
+        self._results = deque(maxlen=window)
+        self._open_until = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed" or not self.failure_rate:
+                return True
+            if self.state == "open" and time.monotonic() >= self._open_until:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record(self, ok):
+        with self._lock:
+            if self.state == "half_open" and self._probing:
+                self._probing = False
+                if ok:
+                    self.state = "closed"
+                    self._results.clear()
+                    message = f"GPT circuit for {self.name} closed again"
+                else:
+                    message = self._open()
+            elif self.state == "closed":
+                self._results.append(ok)
+                failures = self._results.count(False)
+                tripped = (self.failure_rate and len(self._results) >= self.min_calls
+                           and failures >= self.failure_rate * len(self._results))
+                message = self._open() if tripped else None
+            else:
+                return  # an attempt that started before the breaker opened
+        if message:
+            logging.warning(message)
+
+    def abandon(self):
+        """Ends an admitted attempt without an outcome: frees the half-open probe slot, counts nothing."""
+        with self._lock:
+            self._probing = False
+
+    def _open(self):
+        self.state = "open"
+        self.opened += 1
+        self._open_until = time.monotonic() + self.cooldown
+        failures = self._results.count(False)
+        return (f"GPT circuit for {self.name} open for {self.cooldown:.0f}s "
+                f"({failures}/{len(self._results)} recent attempts failed)")
+
+    def retry_in(self):
+        """Seconds until allow() can admit a request again (0 when closed)."""
+        with self._lock:
+            if self.state == "closed":
+                return 0.0
+            return max(0.0, self._open_until - time.monotonic())
+
+    def stats(self):
+        with self._lock:
+            return {'state': self.state, 'opened': self.opened, 'recent_failures': self._results.count(False),
+                    'recent_calls': len(self._results)}
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """Full-jitter exponential backoff: uniform(0, min(cap, base * 2**attempt))."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get("retry-after", 0))
+    except ValueError:
+        return 0.0
+
+
+def _env_number(name, default, cast=int):
+    value = os.getenv(name)
+    return cast(value) if value else default
+
+
+class EnrichmentEngine:
+    def __init__(
+        self,
+        model=DEFAULT_MODEL,
+        concurrency=None,
+        rpm=None,
+        tpm=None,
+        max_retries=5,
+        timeout=60.0,
+        temperature=None,
+        api_key=None,
+        base_url=None,
+        count_tokens=None,
+        completion_tokens=256,
+        backoff_base=1.0,
+        backoff_cap=60.0,
+        transport=None,
+        cache=None,
+        adaptive=None,
+        fallback_model=None,
+        breaker_failure_rate=None,
+        breaker_cooldown=None,
+    ):
+        self.model = model
+        self.concurrency = concurrency or _env_number("GPT_CONCURRENCY", 8)
+        self.limiter = RateLimiter(rpm or _env_number("GPT_RPM", 500), tpm or _env_number("GPT_TPM", 90000))
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.temperature = temperature
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY", "")
+        self.base_url = (base_url or os.getenv("OPENAI_BASE_URL") or DEFAULT_BASE_URL).rstrip("/")
+        self.count_tokens = count_tokens or (lambda text: len(text) // 4 + 1)
+        self.completion_tokens = completion_tokens
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.transport = transport  # httpx transport override (tests, mock servers)
+        self.cache = cache
+        if adaptive is None:
+            adaptive = os.getenv("GPT_ADAPTIVE", "1") not in ("0", "false", "no")
+        self.controller = ConcurrencyController(self.concurrency, adaptive=adaptive)
+        self.fallback_model = fallback_model or os.getenv("GPT_FALLBACK_MODEL") or None
+        self.breaker_failure_rate = (breaker_failure_rate if breaker_failure_rate is not None
+                                     else _env_number("GPT_BREAKER_FAILURE_RATE", 0.5, float))
+        self.breaker_cooldown = breaker_cooldown or _env_number("GPT_BREAKER_COOLDOWN", 30.0, float)
+        self.breakers = {}
+        self._breakers_lock = threading.Lock()
+        self._flights = {}  # payload key -> Future of the request in flight
+        self._flights_lock = threading.Lock()
+        self._sync_client = None
+        self._sync_lock = threading.Lock()
+
+    # -- request plumbing ---------------------------------------------------
+
+    def build_payload(self, prompt, model=None, system=None, **params):
+        """
+        The chat-completions request body complete() and complete_sync() send
+        for `prompt`. Cost estimates and batch files build their requests here
+        too, so their bodies and cache keys match the real requests.
+        """
+        messages = [{'role': 'system', 'content': system}] if system else []
+        messages.append({'role': 'user', 'content': prompt})
+        payload = {'model': model or self.model, 'messages': messages}
+        if self.temperature is not None:
+            payload['temperature'] = self.temperature
+        payload.update((k, v) for k, v in params.items() if v is not None)
+        return payload
+
+    def _cache_lookup(self, payload):
+        """(key, cached text or None); key is None without a cache."""
+        if self.cache is None:
+            return None, None
+        from scripts.llm_cache import CacheMiss, payload_key
+        key = payload_key(payload)
+        try:
+            return key, self.cache.get(key)
+        except CacheMiss:
+            raise GPTError("cache miss in replay mode") from None
+
+    def _cache_key(self, payload):
+        if self.cache is None:
+            return None
+        from scripts.llm_cache import payload_key
+        return payload_key(payload)
+
+    def _cache_store(self, key, payload, text):
+        if key is not None:
+            self.cache.put(key, text, model=payload['model'])
+
+    def breaker(self, model):
+        with self._breakers_lock:
+            if model not in self.breakers:
+                self.breakers[model] = CircuitBreaker(self.breaker_failure_rate, cooldown=self.breaker_cooldown,
+                                                      name=model)
+            return self.breakers[model]
+
+    def _route(self, payload):
+        """
+        (payload to send, its breaker): the request as built while its model's
+        breaker admits it, else the same request for fallback_model. Raises
+        CircuitOpen when neither is available.
+        """
+        breaker = self.breaker(payload['model'])
+        if breaker.allow():
+            return payload, breaker
+        fallback = self.fallback_model
+        if fallback and fallback != payload['model']:
+            backup = self.breaker(fallback)
+            if backup.allow():
+                return dict(payload, model=fallback), backup
+        raise CircuitOpen(f"circuit open for {payload['model']}; next try in {breaker.retry_in():.0f}s")
+
+    def retry_in(self, model=None):
+        """Seconds until the breaker of `model` (default: the engine's) admits a request again."""
+        return self.breaker(model or self.model).retry_in()
+
+    def _flight_key(self, payload):
+        from scripts.llm_cache import payload_key
+        return payload_key(payload)
+
+    def _join_flight(self, key):
+        """
+        Single-flight: (future, True) for the first caller of an identical
+        request, which must resolve the future inside _landing(); later callers
+        get (same future, False) and wait for its result instead of sending a
+        duplicate request. Shared by threads and event loops.
+        """
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[key] = Future()
+            flight.key = key
+            return flight, True
+
+    @contextmanager
+    def _landing(self, flight):
+        """Ends the flight: waiters get the leader's result, or the exception it raised."""
+        try:
+            yield
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            with self._flights_lock:
+                self._flights.pop(flight.key, None)
+
+    def _headers(self):
+        """No Authorization header without a key (OPENAI_BASE_URL-only setups, e.g. a local server)."""
+        return {'Authorization': f"Bearer {self.api_key}"} if self.api_key else {}
+
+    def _cost(self, prompt):
+        return self.count_tokens(prompt) + self.completion_tokens
+
+    def _handle(self, response, attempt, backoff_base=None):
+        """Returns (text, None) on success or (None, delay) for a retryable failure."""
+        if response.status_code in RETRYABLE_STATUS:
+            base = self.backoff_base if backoff_base is None else backoff_base
+            retry_after = _retry_after(response)
+            if response.status_code == 429:
+                self.controller.pause(retry_after)
+            return None, max(retry_after, backoff_delay(attempt, base, self.backoff_cap))
+        if response.status_code >= 400:
+            raise GPTError(f"HTTP {response.status_code}: {response.text[:200]}")
+        try:
+            return response.json()['choices'][0]['message']['content'].strip(), None
+        except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+            raise GPTError(f"malformed response ({e!r}): {response.text[:200]}") from None
+
+    def _settle(self, breaker, started, outcome, healthy):
+        """
+        Ends an attempt on every exit path: frees its concurrency slot (if it
+        got one) and reports it to the breaker; an attempt cancelled before
+        any answer (healthy is None) only gives back the half-open probe.
+        """
+        if started is not None:
+            self.controller.release(started, outcome)
+        if healthy is None:
+            breaker.abandon()
+        else:
+            breaker.record(healthy)
+
+    def _give_up(self, retries, last):
+        return GPTError(f"gave up after {retries + 1} tries: {last}")
+
+    # -- asyncio path -------------------------------------------------------
+
+    async def complete(self, prompt, model=None, system=None, **params):
+        """
+        Sends one chat prompt and returns the reply text; raises GPTError when
+        retries run out. params (max_tokens, ...) are added to the request body.
+        """
+        payload = self.build_payload(prompt, model, system, **params)
+        key, cached = self._cache_lookup(payload)
+        if cached is not None:
+            return cached
+        flight, leader = self._join_flight(key or self._flight_key(payload))
+        if not leader:
+            return await asyncio.wrap_future(flight)
+        with self._landing(flight):
+            flight.set_result(await self._complete(prompt, payload, key))
+        return flight.result()
+
+    async def _complete(self, prompt, payload, key):
+        last = None
+        client = _session.get()
+        for attempt in range(self.max_retries + 1):
+            request, breaker = self._route(payload)
+            started, outcome, healthy = None, "error", None
+            try:
+                await self.limiter.acquire_async(self._cost(prompt))
+                started = await self.controller.acquire_async()
+                response = await client.post("/chat/completions", json=request)
+                healthy = response.status_code < 500
+                text, delay = self._handle(response, attempt)
+                if delay is None:
+                    outcome = "ok"
+                    self._cache_store(key if request is payload else self._cache_key(request), request, text)
+                    return text
+                outcome = "throttled" if response.status_code == 429 else "error"
+                last = f"HTTP {response.status_code}"
+            except httpx.TransportError as e:
+                outcome, healthy = "throttled" if isinstance(e, httpx.TimeoutException) else "error", False
+                last = repr(e)
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_cap)
+            finally:
+                self._settle(breaker, started, outcome, healthy)
+            if attempt < self.max_retries:
+                logging.warning(f"GPT attempt {attempt + 1} failed ({last}); retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+        raise self._give_up(self.max_retries, last)
+
+    def run(self, coro_fn):
+        """
+        Runs coro_fn() on an event loop with the shared AsyncClient open. Works
+        from plain scripts and from threads that already run a loop.
+        """
+        async def main():
+            limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+            async with httpx.AsyncClient(base_url=self.base_url, headers=self._headers(), timeout=self.timeout,
+                                         limits=limits, transport=self.transport) as client:
+                _session.set(client)
+                return await coro_fn()
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(main())
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            return pool.submit(asyncio.run, main()).result()
+
+    # -- blocking path ------------------------------------------------------
+
+    def _client_sync(self):
+        with self._sync_lock:
+            if self._sync_client is None:
+                self._sync_client = httpx.Client(base_url=self.base_url, headers=self._headers(),
+                                                 timeout=self.timeout, transport=self.transport)
+            return self._sync_client
+
+    def complete_sync(self, prompt, model=None, system=None, max_retries=None, backoff_base=None, **params):
+        """Blocking complete(); safe to call from many threads at once."""
+        retries = self.max_retries if max_retries is None else max_retries
+        base = self.backoff_base if backoff_base is None else backoff_base
+        payload = self.build_payload(prompt, model, system, **params)
+        key, cached = self._cache_lookup(payload)
+        if cached is not None:
+            return cached
+        flight, leader = self._join_flight(key or self._flight_key(payload))
+        if not leader:
+            return flight.result()
+        with self._landing(flight):
+            flight.set_result(self._complete_sync(prompt, payload, key, retries, base))
+        return flight.result()
+
+    def _complete_sync(self, prompt, payload, key, retries, base):
+        client = self._client_sync()
+        last = None
+        for attempt in range(retries + 1):
+            request, breaker = self._route(payload)
+            started, outcome, healthy = None, "error", None
+            try:
+                self.limiter.acquire(self._cost(prompt))
+                started = self.controller.acquire()
+                response = client.post("/chat/completions", json=request)
+                healthy = response.status_code < 500
+                text, delay = self._handle(response, attempt, base)
+                if delay is None:
+                    outcome = "ok"
+                    self._cache_store(key if request is payload else self._cache_key(request), request, text)
+                    return text
+                outcome = "throttled" if response.status_code == 429 else "error"
+                last = f"HTTP {response.status_code}"
+            except httpx.TransportError as e:
+                outcome, healthy = "throttled" if isinstance(e, httpx.TimeoutException) else "error", False
+                last = repr(e)
+                delay = backoff_delay(attempt, base, self.backoff_cap)
+            finally:
+                self._settle(breaker, started, outcome, healthy)
+            if attempt < retries:
+                logging.warning(f"GPT attempt {attempt + 1} failed ({last}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+        raise self._give_up(retries, last)
+
+    def close(self):
+        if self._sync_client is not None:
+            self._sync_client.close()
+            self._sync_client = None
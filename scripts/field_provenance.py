@@ -0,0 +1,65 @@
+"""
+field_provenance.py - Per-field provenance for enriched .v3.json culture files.
+
+Every field gpt_enrich_fields_with_openai.py fills in gets an entry in the
+file's "_provenance" object:
+
+    "_provenance": {"kinship": {"prompt_hash": "...", "model": "gpt-3.5-turbo",
+                                "input_hash": "...", "timestamp": "2025-01-01T00:00:00Z"}}
+
+prompt_hash covers the prompts.json template and the system prompt, model is
+the model that was requested, and input_hash covers the culture's source data:
+every key except the enriched fields themselves and the bookkeeping keys.
+
+A field is stale when its entry no longer matches the current prompt, model or
+source data. --stale-only re-enriches stale fields (and empty ones), so editing
+one prompt re-runs one field per culture. Fields without an entry (written by
+hand, or enriched before provenance was recorded) are never stale.
+"""
+import hashlib
+import json
+from datetime import datetime
+
+PROVENANCE_KEY = "_provenance"
+BOOKKEEPING_KEYS = frozenset({PROVENANCE_KEY, 'model_used', 'enriched_timestamp', 'source'})
+
+
+def _hash(value):
+    raw = json.dumps(value, sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def prompt_hash(template, system_prompt):
+    return _hash([system_prompt, template])
+
+
+def input_hash(data, fields):
+    """Hash of the culture's source data: everything but `fields` and the bookkeeping keys."""
+    return _hash({k: v for k, v in data.items() if k not in fields and k not in BOOKKEEPING_KEYS})
+
+
+def record(data, field, template, system_prompt, model, source_hash, timestamp=None):
+    """Stores the provenance of data[field]; source_hash is input_hash() of the data the prompt was built from."""
+    entry = {
+        'prompt_hash': prompt_hash(template, system_prompt),
+        'model': model,
+        'input_hash': source_hash,
+        'timestamp': timestamp or datetime.utcnow().isoformat() + "Z",
+    }
+    # A new dict, so shallow copies of the culture data (the backup of the original) keep their entries.
+    data[PROVENANCE_KEY] = {**(data.get(PROVENANCE_KEY) or {}), field: entry}
+
+
+def stale_fields(data, prompts, system_prompt, model):
+    """Fields of `prompts` whose recorded provenance no longer matches the prompt, model or source data."""
+    entries = data.get(PROVENANCE_KEY) or {}
+    source_hash = input_hash(data, prompts)
+    stale = []
+    for field, template in prompts.items():
+        entry = entries.get(field)
+        if entry is None:
+            continue
+        if (entry.get('prompt_hash') != prompt_hash(template, system_prompt) or entry.get('model') != model
+                or entry.get('input_hash') != source_hash):
+            stale.append(field)
+    return stale
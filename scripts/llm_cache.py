@@ -0,0 +1,256 @@
+"""
+llm_cache.py - Persistent SQLite cache for LLM responses.
+
+Responses are keyed by a SHA-256 of the request parameters (model, system
+prompt, user prompt, temperature and any other generation options), so
+re-running the pipeline on unchanged inputs is served entirely from disk.
+
+Modes:
+    rw      - read and write (default)
+    ro      - read only; misses go to the network but are not stored
+    replay  - read only; a miss is an error, so a replay never hits the network
+    off     - cache disabled
+
+Entries older than `ttl` seconds are ignored and purged. When the stored
+responses exceed `max_bytes`, the least recently used ones are evicted.
+Hit/miss counters are kept per process; stats() adds the on-disk totals.
+default_cache() is configured from LLM_CACHE_PATH, LLM_CACHE_MODE,
+LLM_CACHE_TTL (seconds) and LLM_CACHE_MAX_MB (default 512), or explicitly via
+configure_default_cache().
+
+Usage:
+    python -m scripts.llm_cache stats [--path .llm_cache.sqlite]
+    python -m scripts.llm_cache purge --ttl 2592000
+    python -m scripts.llm_cache clear
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_PATH = ".llm_cache.sqlite"
+MODES = ('rw', 'ro', 'replay', 'off')
+EVICT_EVERY = 64  # puts between TTL/size sweeps
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at);
+"""
+
+
+class CacheMiss(LookupError):
+    """A lookup that missed while the cache is in replay mode."""
+
+
+def cache_key(model, prompt, system=None, temperature=None, **params):
+    """Stable hash of everything that determines a completion."""
+    raw = json.dumps({'model': model, 'system': system, 'prompt': prompt, 'temperature': temperature, **params},
+                     sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def payload_key(payload):
+    """cache_key for a Chat Completions request body ({'model', 'messages', ...})."""
+    messages = {m['role']: m['content'] for m in payload['messages']}
+    options = {k: v for k, v in payload.items() if k not in ('model', 'messages', 'temperature')}
+    return cache_key(payload['model'], messages['user'], system=messages.get('system'),
+                     temperature=payload.get('temperature'), **options)
+
+
+class LLMCache:
+    def __init__(self, path=DEFAULT_PATH, mode="rw", ttl=None, max_bytes=None):
+        if mode not in MODES:
+            raise ValueError(f"cache mode must be one of {MODES}, got {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.writes = self.evictions = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        if mode == "off" or (mode != "rw" and not os.path.exists(path)):
+            return
+        if mode == "rw":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+        else:
+            uri = "file:" + os.path.abspath(path) + "?mode=ro"
+            self._conn = sqlite3.connect(uri, uri=True, check_same_thread=False, isolation_level=None)
+
+    @property
+    def writable(self):
+        return self.mode == "rw" and self._conn is not None
+
+    def _expired(self, created_at, now):
+        return self.ttl is not None and created_at < now - self.ttl
+
+    def get(self, key):
+        """Cached value for key, or None. Raises CacheMiss on a miss in replay mode."""
+        row = None
+        now = time.time()
+        if self._conn is not None:
+            with self._lock:
+                row = self._conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and self._expired(row[1], now):
+                    row = None
+                if row is not None and self.writable:
+                    self._conn.execute("UPDATE responses SET accessed_at = ?, hits = hits + 1 WHERE key = ?", (now, key))
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if row is None:
+            if self.mode == "replay":
+                raise CacheMiss(key)
+            return None
+        return json.loads(row[0])
+
+    def contains(self, key):
+        """True when get(key) would hit; does not touch counters or recency (for dry runs)."""
+        if self._conn is None:
+            return False
+        with self._lock:
+            row = self._conn.execute("SELECT created_at FROM responses WHERE key = ?", (key,)).fetchone()
+        return row is not None and not self._expired(row[0], time.time())
+
+    def put(self, key, value, model=None):
+        if not self.writable:
+            return
+        data = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, data, len(data.encode("utf-8")), now, now))
+            self.writes += 1
+            self._puts += 1
+            sweep = self._puts % EVICT_EVERY == 0
+        if sweep:
+            self.evict()
+
+    def evict(self):
+        """Drops expired entries, then least recently used ones until under max_bytes. Returns the count removed."""
+        if not self.writable:
+            return 0
+        removed = 0
+        with self._lock:
+            if self.ttl is not None:
+                removed += self._conn.execute("DELETE FROM responses WHERE created_at < ?",
+                                              (time.time() - self.ttl,)).rowcount
+            if self.max_bytes:
+                total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                if total > self.max_bytes:
+                    excess, cutoff = total - int(self.max_bytes * 0.9), None
+                    for size, accessed_at in self._conn.execute(
+                            "SELECT size, accessed_at FROM responses ORDER BY accessed_at"):
+                        excess -= size
+                        cutoff = accessed_at
+                        if excess <= 0:
+                            break
+                    removed += self._conn.execute("DELETE FROM responses WHERE accessed_at <= ?", (cutoff,)).rowcount
+            self.evictions += removed
+        return removed
+
+    def clear(self):
+        if self.writable:
+            with self._lock:
+                self._conn.execute("DELETE FROM responses")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        stats = {
+            'path': self.path,
+            'mode': self.mode,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            'writes': self.writes,
+            'evictions': self.evictions,
+            'entries': 0,
+            'bytes': 0,
+        }
+        if self._conn is not None:
+            with self._lock:
+                stats['entries'], stats['bytes'] = self._conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return stats
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def _cache_from_env(path=None, mode=None, ttl=None, max_mb=None):
+    ttl = ttl if ttl is not None else os.getenv("LLM_CACHE_TTL")
+    max_mb = max_mb if max_mb is not None else os.getenv("LLM_CACHE_MAX_MB", "512")
+    return LLMCache(path or os.getenv("LLM_CACHE_PATH", DEFAULT_PATH), mode or os.getenv("LLM_CACHE_MODE", "rw"),
+                    ttl=float(ttl) if ttl else None, max_bytes=int(float(max_mb) * 1e6) if max_mb else None)
+
+
+def configure_default_cache(path=None, mode=None, ttl=None, max_mb=None):
+    """Replaces the process-wide cache; unset options fall back to the environment."""
+    global _default
+    cache = _cache_from_env(path, mode, ttl, max_mb)
+    with _default_lock:
+        previous, _default = _default, cache
+    if previous is not None:
+        previous.close()
+    return cache
+
+
+def default_cache():
+    """The process-wide cache, built from LLM_CACHE_* environment variables on first use."""
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = _cache_from_env()
+    return _default
+
+
+def format_stats(stats):
+    rate = f"{stats['hit_rate'] * 100:.1f}%" if stats['hit_rate'] is not None else "-"
+    return (f"LLM cache ({stats['mode']}, {stats['path']}): {stats['hits']} hits, {stats['misses']} misses "
+            f"({rate} hit rate), {stats['entries']} entries, {stats['bytes'] / 1e6:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or maintain the LLM response cache")
+    parser.add_argument("command", choices=("stats", "purge", "clear"))
+    parser.add_argument("--path", default=os.getenv("LLM_CACHE_PATH", DEFAULT_PATH))
+    parser.add_argument("--ttl", type=float, help="purge: drop entries older than this many seconds")
+    parser.add_argument("--max-mb", type=float, help="purge: evict least recently used entries above this size")
+    args = parser.parse_args()
+
+    cache = LLMCache(args.path, "rw", ttl=args.ttl, max_bytes=int(args.max_mb * 1e6) if args.max_mb else None)
+    if args.command == "purge":
+        print(f"Removed {cache.evict()} entries")
+    elif args.command == "clear":
+        cache.clear()
+        print(f"Cleared {args.path}")
+    print(format_stats(cache.stats()))
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,43 @@
-import pandas as pd
+"""
+segment_by_culture.py - Segment, enrich and validate culture profiles.
+
+Importing this module is cheap: httpx (via enrichment_engine), pandas and
+tiktoken are imported on first use, the rule/culture/language-service files are read on first access
+(KNOWN_CULTURES, ENRICHMENT_RULES, LANGUAGE_SERVICES and enc resolve lazily
+through the module __getattr__), and logging handlers are only attached by main().
+
+enrich_segments() is the batch enrichment entry point used by core.process_file:
+it runs every summary/tags/section-summary request for a batch of segments
+concurrently through scripts.enrichment_engine and returns them in input order.
+In separate mode, tags come from scripts.tag_extractor where it is confident
+(see fit_tagger), so most segments take no GPT tags request.
+"""
 import re
 import logging
 import csv
 import json
 import os
 import argparse
-import openai
+import hashlib
+import math
+import threading
 import time
 import concurrent.futures
-from collections import defaultdict
-
-# Logging: file + console
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-file_handler = logging.FileHandler('segmenter.log')
-file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s:%(message)s'))
-logger.addHandler(file_handler)
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s:%(message)s'))
-logger.addHandler(console_handler)
-
-openai.api_key = os.getenv("OPENAI_API_KEY")  # Set your OpenAI API key in the environment
+from collections import OrderedDict, defaultdict
+from functools import lru_cache
+
+LOG_FORMAT = '%(asctime)s %(levelname)s:%(message)s'
+
+def configure_logging(log_path='segmenter.log'):
+    """Logging: file + console. Called by main(), not at import."""
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    file_handler = logging.FileHandler(log_path)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    logger.addHandler(file_handler)
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    logger.addHandler(console_handler)
 
 def load_known_cultures(filepath):
     try:
@@ -30,12 +47,14 @@ def load_known_cultures(filepath):
         logging.warning("Known cultures file not found, using empty set.")
         return set()
 
-KNOWN_CULTURES = load_known_cultures('known_cultures.txt')
+@lru_cache(maxsize=None)
+def known_cultures():
+    return load_known_cultures('known_cultures.txt')
 
 def is_culture_title(line):
     clean = line.strip().upper()
     regex_match = bool(re.match(r'^[A-Z][A-Z\s\-]{2,}$', clean)) and len(clean) > 3
-    known_match = clean in KNOWN_CULTURES
+    known_match = clean in known_cultures()
     return regex_match or known_match
 
 def segment_cultures(text):
@@ -95,52 +114,178 @@ def load_enrichment_rules(filepath='enrichment_rules.json'):
     except Exception:
         return []
 
-ENRICHMENT_RULES = load_enrichment_rules()
+@lru_cache(maxsize=None)
+def enrichment_rules():
+    return load_enrichment_rules()
 
-try:
-    from tiktoken import get_encoding
-    enc = get_encoding("cl100k_base")
-except ImportError:
-    enc = None
-    logging.warning("tiktoken not installed; GPT input will be truncated by characters, not tokens.")
+@lru_cache(maxsize=None)
+def token_encoder():
+    """The cl100k_base tiktoken encoder, or None if tiktoken is not installed."""
+    try:
+        from tiktoken import get_encoding
+    except ImportError:
+        logging.warning("tiktoken not installed; GPT input will be truncated by characters, not tokens.")
+        return None
+    return get_encoding("cl100k_base")
+
+CHARS_PER_TOKEN = 3.75  # without tiktoken: the one ratio count_tokens, truncate_for_gpt and chunk_text use
+SUMMARY_TOKEN_CAP = 1600  # longer content is condensed by map-reduce instead of cut off
+CHUNK_TOKENS = 1200
+CHUNK_OVERLAP = 150
+MAX_CONDENSE_ROUNDS = 3
+DEFER_RETRY_ROUNDS = 1  # retries of segments whose GPT requests failed, after the breaker cool-down
+TOKEN_COUNT_CACHE_SIZE = 8192
+
+_token_counts = OrderedDict()  # content digest -> token count, least recently used first
+_token_counts_lock = threading.Lock()
+
+def count_tokens(text):
+    """Token count of text, cached per content hash (CHARS_PER_TOKEN characters per token without tiktoken)."""
+    enc = token_encoder()
+    if not enc:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+    with _token_counts_lock:
+        count = _token_counts.get(key)
+        if count is not None:
+            _token_counts.move_to_end(key)
+            return count
+    count = len(enc.encode(text))
+    with _token_counts_lock:
+        _token_counts[key] = count
+        if len(_token_counts) > TOKEN_COUNT_CACHE_SIZE:
+            _token_counts.popitem(last=False)
+    return count
 
 def truncate_for_gpt(text, max_tokens=1600):
-    if enc:
-        tokens = enc.encode(text)
-        return enc.decode(tokens[:max_tokens])
-    return text[:6000]  # fallback
+    """
+    text cut to at most max_tokens tokens. Every token covers at least one
+    UTF-8 byte, so text within max_tokens bytes is returned without encoding;
+    otherwise the cached count decides whether an encode/decode is needed.
+    """
+    enc = token_encoder()
+    if not enc:
+        return text[:int(max_tokens * CHARS_PER_TOKEN)]
+    if len(text) <= max_tokens and len(text.encode("utf-8")) <= max_tokens:
+        return text
+    if count_tokens(text) <= max_tokens:
+        return text
+    return enc.decode(enc.encode(text)[:max_tokens])
+
+def chunk_text(text, max_tokens=None, overlap=None):
+    """
+    Splits text into windows of at most max_tokens (default CHUNK_TOKENS)
+    tokens, each overlapping the previous one by `overlap` (CHUNK_OVERLAP).
+    """
+    max_tokens = max_tokens or CHUNK_TOKENS
+    overlap = CHUNK_OVERLAP if overlap is None else overlap
+    step = max(1, max_tokens - overlap)
+    enc = token_encoder()
+    if not enc:
+        size, step = int(max_tokens * CHARS_PER_TOKEN), int(step * CHARS_PER_TOKEN)
+        return [text[i:i + size] for i in range(0, max(1, len(text) - size + step), step)]
+    tokens = enc.encode(text)
+    return [enc.decode(tokens[i:i + max_tokens]) for i in range(0, max(1, len(tokens) - max_tokens + step), step)]
+
+@lru_cache(maxsize=None)
+def _engine(options):
+    from scripts.enrichment_engine import EnrichmentEngine
+    from scripts.llm_cache import default_cache
+    options = dict(options)
+    options.setdefault('cache', default_cache())
+    return EnrichmentEngine(count_tokens=count_tokens, **options)
+
+def default_engine(**options):
+    """
+    One shared engine per option set, so every call in the process draws on
+    the same rate limits; responses go through scripts.llm_cache.default_cache().
+    """
+    return _engine(tuple(sorted(options.items())))
+
+def gpt_configured():
+    """True when an API key or an alternative endpoint (OPENAI_BASE_URL) is set."""
+    return bool(os.getenv("OPENAI_API_KEY") or os.getenv("OPENAI_BASE_URL"))
 
 def safe_gpt_call(prompt, model="gpt-4", retries=2, delay=3):
-    for attempt in range(retries + 1):
-        try:
-            response = openai.ChatCompletion.create(
-                model=model,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            return response.choices[0].message.content.strip()
-        except Exception as e:
-            logging.warning(f"GPT attempt {attempt + 1} failed: {e}")
-            time.sleep(delay)
-    return f"[GPT error after {retries+1} tries]"
+    """
+    Blocking GPT call through default_engine(); `delay` is the base of the
+    jittered backoff. Returns "" when the call fails (logged), so a failure
+    never reaches the exports as text.
+    """
+    from scripts.enrichment_engine import GPTError
+    try:
+        return default_engine().complete_sync(prompt, model=model, max_retries=retries, backoff_base=delay)
+    except GPTError as e:
+        logging.warning(f"GPT call failed: {e}")
+        return ""
 
-def gpt_summarize(content, title):
-    prompt = f"""
+def summarize_prompt(content, title):
+    return f"""
 Summarize the cultural information below in 1–2 sentences. 
 Focus on the worldview, social structure, traditions, and values of the {title} group.
 
 {truncate_for_gpt(content)}
 """
-    return safe_gpt_call(prompt)
 
-def gpt_tags(content):
-    prompt = f"""Extract 3–6 keywords or tags that reflect the core aspects of this culture: values, family structure, religion, traditions.
+def tags_prompt(content):
+    return f"""Extract 3–6 keywords or tags that reflect the core aspects of this culture: values, family structure, religion, traditions.
 
 Return as a comma-separated list.
 
 Text:
 {truncate_for_gpt(content)}
 """
-    return safe_gpt_call(prompt)
+
+def chunk_summary_prompt(chunk, culture, part, parts):
+    return f"""
+This is part {part} of {parts} of the cultural profile of the {culture} group.
+Summarize it in 3–5 sentences, keeping concrete facts about worldview, social structure,
+traditions and values, and the names of any sections it covers (e.g. "Economy: ...").
+
+{chunk}
+"""
+
+def section_summary_prompt(content, section, culture):
+    return f"""
+Summarize the section '{section}' for the culture '{culture}'.
+Focus on key facts, values, or practices described in this section.
+
+{truncate_for_gpt(content)}
+"""
+
+def gpt_summarize(content, title):
+    return safe_gpt_call(summarize_prompt(content, title))
+
+def gpt_tags(content):
+    return safe_gpt_call(tags_prompt(content))
+
+def fit_tagger(segments):
+    """
+    scripts.tag_extractor.TagExtractor fitted on the segments' content, with
+    SECTION_HEADINGS and the headings segment_sections finds as the boosted
+    controlled vocabulary. Fit it on the whole file, not one batch, so the
+    document frequencies are corpus-wide.
+    """
+    from scripts.tag_extractor import TagExtractor
+    headings = list(SECTION_HEADINGS)
+    headings += [sec['section'] for seg in segments for sec in segment_sections(seg['content'])]
+    return TagExtractor().fit([seg['content'] for seg in segments], headings)
+
+def local_tags(tagger, segments):
+    """(tag string, confidence) of each segment from one tagger.extract() pass."""
+    from scripts.tag_extractor import format_tags
+    return [(format_tags(tags), confidence) for tags, confidence in tagger.extract(seg['content'] for seg in segments)]
+
+def confident_tags(tagger, segments, tagged=None):
+    """
+    Local tags of each segment, or None where the tagger is less confident
+    than TAG_CONFIDENCE; `tagged` reuses a local_tags() result.
+    """
+    from scripts.tag_extractor import TAG_CONFIDENCE
+    if tagger is None and tagged is None:
+        return [None] * len(segments)
+    tagged = tagged if tagged is not None else local_tags(tagger, segments)
+    return [tags if confidence >= TAG_CONFIDENCE else None for tags, confidence in tagged]
 
 def confidence_score(enrichment, content):
     if "unknown" in [v.lower() for v in enrichment.values()]:
@@ -160,10 +305,30 @@ def load_language_services(filepath='language_services.json'):
     except Exception:
         return {}
 
-LANGUAGE_SERVICES = load_language_services()
+@lru_cache(maxsize=None)
+def language_services():
+    return load_language_services()
+
+_LAZY_GLOBALS = {
+    'KNOWN_CULTURES': known_cultures,
+    'ENRICHMENT_RULES': enrichment_rules,
+    'LANGUAGE_SERVICES': language_services,
+    'enc': token_encoder,
+}
+
+def __getattr__(name):
+    # Module-level names that used to be loaded at import time.
+    if name in _LAZY_GLOBALS:
+        return _LAZY_GLOBALS[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def enrich_language_services(culture):
-    return LANGUAGE_SERVICES.get(culture.lower(), {})
+    return language_services().get(culture.lower(), {})
+
+SECTION_HEADINGS = (
+    "Orientation", "Economy", "Marriage and Family", "Religion and Expressive Culture",
+    "Kinship", "Political Organization", "Socialization", "Health", "Death and Afterlife"
+)
 
 def segment_sections(content):
     lines = content.splitlines()
@@ -171,10 +336,7 @@ def segment_sections(content):
     current_section = "Uncategorized"
     current_content = []
     for line in lines:
-        if (line.istitle() and 5 <= len(line.split()) <= 8) or (line.strip() in [
-            "Orientation", "Economy", "Marriage and Family", "Religion and Expressive Culture",
-            "Kinship", "Political Organization", "Socialization", "Health", "Death and Afterlife"
-        ]):
+        if (line.istitle() and 5 <= len(line.split()) <= 8) or (line.strip() in SECTION_HEADINGS):
             if current_content:
                 sections.append({"section": current_section, "content": "\n".join(current_content)})
             current_section = line.strip()
@@ -191,6 +353,7 @@ def load_content(input_path):
         with open(input_path, encoding='utf-8') as f:
             return f.read()
     elif ext in [".xlsx", ".xls"]:
+        import pandas as pd
         df = pd.read_excel(input_path)
         return "\n".join(str(row['Content']).strip() for _, row in df.iterrows() if pd.notnull(row['Content']))
     elif ext == ".docx":
@@ -250,6 +413,7 @@ def export_review_csv(segments, out_path):
             writer.writerow({k: seg.get(k, "") for k in fieldnames})
 
 def validate_profiles(csv_path):
+    import pandas as pd
     df = pd.read_csv(csv_path)
     required_sections = ["Orientation", "Economy", "Kinship"]
     for culture in df['culture'].unique():
@@ -270,7 +434,7 @@ def enrich_culture(title, content):
         "Ethnicity/Group": "Unknown",
         "Tags": "culture"
     }
-    for rule in ENRICHMENT_RULES:
+    for rule in enrichment_rules():
         if rule["match"].upper() in title.upper():
             enrichment.update({
                 "Region": rule.get("region", enrichment["Region"]),
@@ -281,13 +445,280 @@ def enrich_culture(title, content):
     return enrichment
 
 def gpt_section_summary(content, section, culture):
-    prompt = f"""
-Summarize the section '{section}' for the culture '{culture}'.
-Focus on key facts, values, or practices described in this section.
+    return safe_gpt_call(section_summary_prompt(content, section, culture))
 
+# Combined mode: one request per segment returns summary, tags and the section
+# summaries as JSON, instead of sending the same content three times.
+_JSON_FENCE = re.compile(r'^```(?:json)?\s*(.*?)\s*```$', re.DOTALL)
+
+def segment_combined_prompt(content, culture, sections):
+    """Segment-level combined prompt; with sections, section_summary is an object keyed by section name."""
+    if sections:
+        names = ", ".join(json.dumps(name, ensure_ascii=False) for name in sections)
+        section_spec = f'an object mapping each of these section names to a one-sentence summary: {names}'
+    else:
+        section_spec = 'an empty string'
+    return f"""
+Analyze the cultural information below about the {culture} group.
+Return only a JSON object with exactly these keys:
+  "summary": 1–2 sentences on the worldview, social structure, traditions, and values of the {culture} group,
+  "tags": a list of 3–6 keywords reflecting values, family structure, religion, traditions,
+  "section_summary": {section_spec}.
+
+Text:
 {truncate_for_gpt(content)}
 """
-    return safe_gpt_call(prompt)
+
+def _required_text(data, key):
+    value = data.get(key)
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f"'{key}' must be a non-empty string")
+    return value.strip()
+
+def parse_combined(reply, sections=None, split_sections=False):
+    """
+    Strictly parses a combined-mode reply into {'summary', 'tags', 'section_summary'}
+    (tags as a comma-separated string). With `sections`, section_summary must be an
+    object with exactly those keys and is rendered as "Section: summary" lines
+    (kept as a {section: summary} dict with split_sections).
+    Raises ValueError on anything else.
+    """
+    text = reply.strip()
+    fenced = _JSON_FENCE.match(text)
+    if fenced:
+        text = fenced.group(1)
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"not JSON: {e}") from None
+    if not isinstance(data, dict) or set(data) != {"summary", "tags", "section_summary"}:
+        raise ValueError("expected an object with keys summary, tags, section_summary")
+    tags = data["tags"]
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    if not isinstance(tags, list) or not all(isinstance(t, str) for t in tags):
+        raise ValueError("'tags' must be a list of strings")
+    tags = [t.strip() for t in tags if t.strip()]
+    if not tags:
+        raise ValueError("'tags' is empty")
+    result = {"summary": _required_text(data, "summary"), "tags": ", ".join(tags)}
+    if sections is None:
+        result["section_summary"] = _required_text(data, "section_summary")
+    elif sections:
+        per_section = data["section_summary"]
+        if not isinstance(per_section, dict) or set(per_section) != set(sections):
+            raise ValueError("'section_summary' must map exactly the requested sections")
+        per_section = {name: _required_text(per_section, name) for name in sections}
+        if split_sections:
+            result["section_summary"] = per_section
+        else:
+            result["section_summary"] = "\n".join(f"{name}: {text}" for name, text in per_section.items())
+    elif split_sections:
+        result["section_summary"] = {}
+    return result
+
+def gpt_enrich_culture(content, culture, sections, combined=True, tags=None):
+    """
+    Culture-level GPT fields for main(), computed once per culture instead of
+    once per section: summary and tags of the whole (condensed) culture text,
+    and 'section_summary', a list with one summary per entry of `sections`.
+    Combined mode gets all of them from one segment-level request and falls
+    back to per-field calls if the reply does not parse. Per-field calls skip
+    gpt_tags when local `tags` are given (see confident_tags). Fields whose
+    request failed are empty.
+    """
+    names = list(dict.fromkeys(sec['section'] for sec in sections))
+    condensed = condense_for_gpt(content, culture)
+    if combined:
+        reply = safe_gpt_call(segment_combined_prompt(condensed, culture, names))
+        if not reply:
+            return {"summary": "", "tags": "", "section_summary": [""] * len(sections)}
+        try:
+            fields = parse_combined(reply, sections=names, split_sections=True)
+        except ValueError as e:
+            logging.warning(f"Combined reply for {culture} rejected ({e}); using per-field calls")
+        else:
+            fields["section_summary"] = [fields["section_summary"][sec['section']] for sec in sections]
+            return fields
+    return {
+        "summary": gpt_summarize(condensed, culture),
+        "tags": tags or gpt_tags(condensed),
+        "section_summary": [gpt_section_summary(condense_for_gpt(sec['content'], culture), sec['section'], culture)
+                            for sec in sections],
+    }
+
+async def _complete_or_none(engine, prompt):
+    from scripts.enrichment_engine import GPTError
+    try:
+        return await engine.complete(prompt)
+    except GPTError as e:
+        logging.warning(f"GPT call failed: {e}")
+        return None
+
+async def condense(engine, content, culture, fanout=None):
+    """
+    Map-reduce for content over SUMMARY_TOKEN_CAP tokens: summarizes
+    overlapping CHUNK_TOKENS chunks concurrently and returns the joined partial
+    summaries, repeating on the result while it is still too long. Chunk
+    requests share the engine's concurrency and rate limits; at most `fanout`
+    (default: half the engine's concurrency) are in flight per document, so
+    one long document cannot crowd out the others. Short content, or content
+    whose chunks all fail, is returned unchanged (and truncated as before).
+    """
+    import asyncio
+    slots = asyncio.Semaphore(fanout or max(1, engine.concurrency // 2))
+
+    async def summarize(prompt):
+        async with slots:
+            return await _complete_or_none(engine, prompt)
+
+    for _ in range(MAX_CONDENSE_ROUNDS):
+        if count_tokens(content) <= SUMMARY_TOKEN_CAP:
+            break
+        chunks = chunk_text(content)
+        replies = await asyncio.gather(*(summarize(chunk_summary_prompt(chunk, culture, i, len(chunks)))
+                                         for i, chunk in enumerate(chunks, 1)))
+        parts = [reply for reply in replies if reply is not None]
+        if not parts:
+            logging.warning(f"Could not condense {culture}; summarizing the truncated text")
+            break
+        content = "\n\n".join(parts)
+    return content
+
+def condense_for_gpt(content, culture):
+    """Blocking condense() through default_engine(), for the per-section path of main()."""
+    if count_tokens(content) <= SUMMARY_TOKEN_CAP:
+        return content
+    engine = default_engine()
+    return engine.run(lambda: condense(engine, content, culture))
+
+async def _enrich_segment(engine, seg, section_summaries, combined, tags=None):
+    """
+    Enriches seg in place; returns False, leaving seg untouched, when a request
+    failed. Per-field requests skip the tags request when local `tags` are given.
+    """
+    import asyncio
+    title = seg['title']
+    sections = segment_sections(seg['content']) if section_summaries else []
+    content = await condense(engine, seg['content'], title)
+    if combined:
+        names = list(dict.fromkeys(sec['section'] for sec in sections))
+        reply = await _complete_or_none(engine, segment_combined_prompt(content, title, names))
+        if reply is None:
+            return False
+        try:
+            fields = parse_combined(reply, sections=names)
+        except ValueError as e:
+            logging.warning(f"Combined reply for {title} rejected ({e}); using per-field calls")
+        else:
+            seg.update(fields)
+            if section_summaries:
+                seg.setdefault('section_summary', "")
+            return True
+    prompts = [summarize_prompt(content, title)] + ([] if tags else [tags_prompt(content)])
+    prompts += [section_summary_prompt(sec['content'], sec['section'], title) for sec in sections]
+    replies = await asyncio.gather(*(_complete_or_none(engine, p) for p in prompts))
+    if None in replies:
+        return False
+    if tags:
+        replies.insert(1, tags)
+    seg['summary'], seg['tags'] = replies[0], replies[1]
+    if section_summaries:
+        seg['section_summary'] = "\n".join(f"{sec['section']}: {reply}" for sec, reply in zip(sections, replies[2:]))
+    return True
+
+def enrich_segments(segments, section_summaries=True, combined=True, engine=None, tagger=None, on_done=None,
+                    **engine_options):
+    """
+    Adds GPT summary, tags and (optionally) per-section summaries to each
+    segment. With `combined`, each segment takes one JSON request (falling back
+    to one request per field if the reply does not parse); otherwise 2 + one per
+    section. Segments over SUMMARY_TOKEN_CAP tokens are first condensed by
+    map-reduce (see condense), so no content is cut off. All requests run
+    concurrently under the engine's concurrency and RPM/TPM limits; without an explicit engine, default_engine(**engine_options)
+    (model, concurrency, rpm, tpm, ...) is used. Returns segments in input order.
+
+    Without `combined`, a fitted `tagger` (see fit_tagger) supplies the tags of
+    every segment it is confident about, and only the rest get a tags request.
+
+    on_done(seg) is called as each segment is enriched (journal.RunJournal
+    checkpoints through it); an exception it raises aborts the whole call.
+
+    Segments with a failed request are deferred: once the batch is done they
+    are retried, up to DEFER_RETRY_ROUNDS times, after the engine's circuit
+    breaker cool-down. Segments that still fail are returned without summary,
+    tags or section_summary (core.postprocess_segments flags them).
+    """
+    engine = engine or default_engine(**engine_options)
+    segments = list(segments)
+    local = confident_tags(None if combined else tagger, segments)
+    if tagger is not None and not combined:
+        logging.info(f"Local tags for {len(local) - local.count(None)}/{len(segments)} segments")
+
+    async def enrich_one(seg, tags):
+        ok = await _enrich_segment(engine, seg, section_summaries, combined, tags)
+        if ok and on_done is not None:
+            on_done(seg)
+        return ok
+
+    async def enrich_all(batch):
+        import asyncio
+        return await asyncio.gather(*(enrich_one(seg, tags) for seg, tags in batch))
+    batch = list(zip(segments, local))
+    done = engine.run(lambda: enrich_all(batch))
+    deferred = [item for item, ok in zip(batch, done) if not ok]
+    for _ in range(DEFER_RETRY_ROUNDS):
+        if not deferred:
+            break
+        wait = engine.retry_in()
+        logging.warning(f"{len(deferred)} segments deferred after failed GPT requests; retrying in {wait:.0f}s")
+        time.sleep(wait)
+        done = engine.run(lambda: enrich_all(deferred))
+        deferred = [item for item, ok in zip(deferred, done) if not ok]
+    if deferred:
+        titles = [seg['title'] for seg, _ in deferred]
+        logging.error(f"{len(deferred)} segments left without GPT enrichment: "
+                      f"{', '.join(titles[:10])}{' ...' if len(deferred) > 10 else ''}")
+    stats = engine.controller.stats()
+    logging.info(f"GPT concurrency limit {stats['limit']}/{stats['max_limit']} (peak {stats['peak_in_flight']} in flight), "
+                 f"{stats['completed']} requests, {stats['throttled']} throttled, {stats['requests_per_sec']} req/s")
+    return segments
+
+def estimate_sections(raw_segments, combined=True, parallel=False, tagger=None):
+    """
+    Dry-run estimate (scripts.cost_estimate) of main()'s --use_gpt requests:
+    gpt_enrich_culture for every culture, through safe_gpt_call's model and
+    default_engine(). Without --parallel_gpt requests go out one at a time.
+    Cultures `tagger` tags locally take no tags request.
+    """
+    from scripts.cost_estimate import Estimate
+    from scripts.llm_cache import configure_default_cache
+    configure_default_cache(mode="off" if os.getenv("LLM_CACHE_MODE") == "off" else "ro")
+    engine = default_engine()
+    estimate = Estimate.for_engine(engine)
+    estimate.concurrency = min(engine.concurrency, min(32, (os.cpu_count() or 1) + 4)) if parallel else 1
+
+    def add_condense(content, culture):  # condense_for_gpt's map requests
+        if engine.count_tokens(content) > SUMMARY_TOKEN_CAP:
+            chunks = chunk_text(content)
+            for i, chunk in enumerate(chunks, 1):
+                estimate.add(engine.build_payload(chunk_summary_prompt(chunk, culture, i, len(chunks)), None))
+
+    for seg, tags in zip(raw_segments, confident_tags(None if combined else tagger, raw_segments)):
+        content, culture = seg['content'], seg['title']
+        sections = segment_sections(content)
+        add_condense(content, culture)
+        if combined:
+            names = list(dict.fromkeys(sec['section'] for sec in sections))
+            prompts = [segment_combined_prompt(content, culture, names)]
+        else:
+            prompts = [summarize_prompt(content, culture)] + ([] if tags else [tags_prompt(content)])
+            for section in sections:
+                add_condense(section['content'], culture)
+                prompts.append(section_summary_prompt(section['content'], section['section'], culture))
+        for prompt in prompts:
+            estimate.add(engine.build_payload(prompt, "gpt-4"))
+    return estimate.summary()
 
 def main():
     parser = argparse.ArgumentParser(
@@ -301,32 +732,55 @@ def main():
     parser.add_argument("--validate", action="store_true")
     parser.add_argument("--use_gpt", action="store_true", help="Enable GPT enrichment")
     parser.add_argument("--parallel_gpt", action="store_true", help="Enable concurrent GPT enrichment")
+    parser.add_argument("--gpt_mode", choices=["combined", "separate"], default="combined",
+                        help="combined: one JSON request per section; separate: summary, tags and section summary requests")
     parser.add_argument("--review_csv", help="Export a simplified review sheet")
     parser.add_argument("--limit", type=int, help="Limit number of cultures for testing")
     parser.add_argument("--summary_only_md", help="Output summaries only per culture in Markdown")
     parser.add_argument("--out_dir", help="Base output directory for all exports")
+    parser.add_argument("--estimate", action="store_true", help="Dry run: report GPT requests, tokens, cost and wall time, then exit")
     args = parser.parse_args()
+    configure_logging()
 
     text = load_content(args.input)
     raw_segments = segment_cultures(text)
+    combined = args.gpt_mode == "combined"
+    # Local tags stand in for GPT tags in separate mode and for the placeholder without --use_gpt;
+    # the tagger is fitted before --limit, so document frequencies cover the whole file.
+    tagger = fit_tagger(raw_segments) if not combined or not (args.use_gpt or args.estimate) else None
     if args.limit:
         raw_segments = raw_segments[:args.limit]
-    segments = []
-    gpt_jobs = []
-    def enrich_row(seg, section):
-        enrich = enrich_culture(seg['title'], section['content'])
+    if args.estimate:
+        from scripts.cost_estimate import format_estimate
+        print(format_estimate(estimate_sections(raw_segments, combined, args.parallel_gpt, tagger)))
+        return
+    tagged = local_tags(tagger, raw_segments) if tagger else [("", 0.0)] * len(raw_segments)
+    tags_only = [tags for tags, _ in tagged]
+    confident = confident_tags(tagger, raw_segments, tagged)
+    def culture_fields(seg, tags, confident_local):
+        # Everything that depends on the culture rather than the section, computed once per culture.
+        sections = segment_sections(seg['content'])
+        fields = {
+            "sections": sections,
+            "enrich": enrich_culture(seg['title'], seg['content']),
+            "language_services": json.dumps(enrich_language_services(seg['title']), ensure_ascii=False),
+            "gpt_review_prompt": gpt_review_prompt(seg['title']),
+            "local_tags": tags,
+        }
         if args.use_gpt:
-            gpt_summary = gpt_summarize(section['content'], seg['title'])
-            gpt_taglist = gpt_tags(section['content'])
-            section_summary = gpt_section_summary(section['content'], section['section'], seg['title'])
+            fields.update(gpt_enrich_culture(seg['content'], seg['title'], sections, combined=combined,
+                                             tags=confident_local))
+        return fields
+    def section_row(seg, culture, section, section_summary):
+        enrich = culture["enrich"]
+        if args.use_gpt:
+            gpt_summary, gpt_taglist = culture["summary"], culture["tags"]
         else:
             gpt_summary = section['content'][:150].replace('\n', ' ') + "..."
-            gpt_taglist = "culture"
-            section_summary = ""
-        lang_services = enrich_language_services(seg['title'])
+            gpt_taglist = culture["local_tags"] or "culture"
         score = confidence_score(enrich, section['content'])
         notes = ""
-        if enrich["Region"] == "Unknown" or "[GPT error" in gpt_summary:
+        if enrich["Region"] == "Unknown" or not gpt_summary:
             notes = "Review required – missing metadata or summary failure."
         unknown_fields = sum(1 for k in ["Region", "Language(s)", "Ethnicity/Group"] if enrich[k] == "Unknown")
         needs_attention = (len(section['content']) < 100) or (unknown_fields >= 3)
@@ -340,24 +794,31 @@ def main():
             "tags": gpt_taglist,
             "confidence_score": score,
             "enrichment_notes": notes,
-            "language_services": json.dumps(lang_services, ensure_ascii=False),
-            "gpt_review_prompt": gpt_review_prompt(seg['title']),
+            "language_services": culture["language_services"],
+            "gpt_review_prompt": culture["gpt_review_prompt"],
             "content": section['content'],
             "needs_attention": needs_attention,
             "section_summary": section_summary
         }
     if args.use_gpt and args.parallel_gpt:
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = []
-            for seg in raw_segments:
-                for section in segment_sections(seg['content']):
-                    futures.append(executor.submit(enrich_row, seg, section))
-            for f in concurrent.futures.as_completed(futures):
-                segments.append(f.result())
+        # One thread per slot the engine's concurrency controller can open; it decides how many run at once.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=default_engine().concurrency) as executor:
+            cultures = list(executor.map(culture_fields, raw_segments, tags_only, confident))  # keeps document order
     else:
-        for seg in raw_segments:
-            for section in segment_sections(seg['content']):
-                segments.append(enrich_row(seg, section))
+        cultures = [culture_fields(*item) for item in zip(raw_segments, tags_only, confident)]
+    deferred = [i for i, culture in enumerate(cultures) if args.use_gpt and not culture["summary"]]
+    if deferred:
+        # Retry queue: cultures whose requests failed get one more try once the circuit breaker cools down.
+        wait = default_engine().retry_in("gpt-4")
+        logging.warning(f"{len(deferred)} cultures deferred after failed GPT requests; retrying in {wait:.0f}s")
+        time.sleep(wait)
+        for i in deferred:
+            cultures[i] = culture_fields(raw_segments[i], tags_only[i], confident[i])
+    segments = []
+    for seg, culture in zip(raw_segments, cultures):
+        summaries = culture.get("section_summary") or [""] * len(culture["sections"])
+        segments.extend(section_row(seg, culture, section, summary)
+                        for section, summary in zip(culture["sections"], summaries))
 
     # Output directory logic
     out_dir = args.out_dir or ""
@@ -388,4 +849,8 @@ if __name__ == "__main__" and os.getenv("DEBUG"):
     print(json.dumps(segs, indent=2))
 
 if __name__ == "__main__":
+    import sys
+    ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    if ROOT_DIR not in sys.path:  # run as a script: the scripts package (tag_extractor, ...) must be importable
+        sys.path.insert(0, ROOT_DIR)
     main()
@@ -0,0 +1,128 @@
+"""
+tag_extractor.py - Offline keyword tags from corpus-wide TF-IDF statistics.
+
+TagExtractor.fit() learns document frequencies over a whole corpus of
+segments (or sections) in one vectorized pass: all documents are tokenized,
+the tokens are mapped to term ids with np.unique, and (document, term) counts
+come from a single np.unique over combined keys, so the term matrix is kept
+in sparse coordinate form without building a dense array or a Python dict per
+document. Terms from the corpus' section headings ("Marriage and Family",
+"Religion and Expressive Culture", ...) form a controlled vocabulary whose
+weights are multiplied by `heading_boost`.
+
+extract() returns up to `max_tags` tags per document and a confidence in
+[0, 1]: the share of the document's TF-IDF vector (squared L2 mass) that the
+chosen tags carry, scaled down when fewer than `min_tags` tags were found.
+Documents under `TAG_CONFIDENCE` are the ones worth sending to the GPT tagger
+(segment_by_culture.gpt_tags); the rest keep the local tags.
+
+Needs only NumPy. Usage:
+
+    extractor = TagExtractor().fit(texts, headings)
+    for tags, confidence in extractor.extract(texts): ...
+"""
+import re
+
+TOKEN_RE = re.compile(r"[^\W\d_]{3,}")
+TAG_CONFIDENCE = 0.3  # below this, the GPT tagger is asked instead
+STOPWORDS = frozenset("""
+about above after again against all also although among and another any are around because been before
+being below between both but can cannot could did does doing down during each either even ever every few for
+from further had has have having her here hers herself him himself his how however into its itself just less
+many may might more most much must near neither nor not now off often once one only other others our ours
+ourselves out over own per rather same several she should since some such than that the their theirs them
+themselves then there these they this those though through thus too under until upon very was way were what
+when where whether which while who whom whose why will with within without would yet you your yours
+culture cultural cultures people group groups include includes including typically generally usually
+especially particular various like used use uses well new known notes note yes none see
+https http www com png jpg example image
+""".split())
+
+
+def tokenize(text):
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+class TagExtractor:
+    def __init__(self, max_tags=6, min_tags=3, heading_boost=2.0, min_df=1):
+        self.max_tags = max_tags
+        self.min_tags = min_tags
+        self.heading_boost = heading_boost
+        self.min_df = min_df
+        self.vocabulary = None  # sorted term array; term id = position
+        self.idf = None
+        self.boost = None
+        self.n_docs = 0
+
+    def _term_ids(self, texts):
+        """(doc ids, term ids, doc count) of every known token; unknown tokens are dropped."""
+        import numpy as np
+        tokens = [tokenize(text) for text in texts]
+        lengths = np.fromiter((len(t) for t in tokens), dtype=np.int64, count=len(tokens))
+        flat = np.array([tok for toks in tokens for tok in toks], dtype=str)
+        docs = np.repeat(np.arange(len(tokens), dtype=np.int64), lengths)
+        if self.vocabulary is None or not len(flat):
+            return docs, flat, len(tokens)
+        pos = np.searchsorted(self.vocabulary, flat)
+        pos[pos == len(self.vocabulary)] = 0
+        known = self.vocabulary[pos] == flat if len(self.vocabulary) else np.zeros(len(flat), dtype=bool)
+        return docs[known], pos[known], len(tokens)
+
+    def fit(self, texts, headings=()):
+        """Learns the vocabulary, smoothed IDF weights and heading boosts from the corpus `texts`."""
+        import numpy as np
+        self.vocabulary = None
+        docs, flat, n_docs = self._term_ids(texts)
+        vocabulary, terms = np.unique(flat, return_inverse=True)
+        pairs = np.unique(docs * max(1, len(vocabulary)) + terms)
+        df = np.bincount(pairs % max(1, len(vocabulary)), minlength=len(vocabulary))
+        keep = df >= self.min_df
+        self.vocabulary = vocabulary[keep]
+        df = df[keep]
+        self.n_docs = n_docs
+        self.idf = np.log((1 + n_docs) / (1 + df)) + 1.0
+        self.boost = np.ones(len(self.vocabulary))
+        heading_terms = np.array(sorted({t for h in headings for t in tokenize(h)}), dtype=str)
+        if len(heading_terms) and len(self.vocabulary):
+            self.boost[np.isin(self.vocabulary, heading_terms)] = self.heading_boost
+        return self
+
+    def extract(self, texts):
+        """[(tags, confidence)] for each text, tags best first; call fit() first."""
+        import numpy as np
+        if self.vocabulary is None:
+            raise RuntimeError("TagExtractor.extract() called before fit()")
+        texts = list(texts)
+        docs, terms, n_docs = self._term_ids(texts)
+        results = [([], 0.0) for _ in range(n_docs)]
+        if not len(terms):
+            return results
+        width = len(self.vocabulary)
+        pairs, counts = np.unique(docs * width + terms, return_counts=True)
+        docs, terms = pairs // width, pairs % width
+        weights = (1.0 + np.log(counts)) * self.idf[terms] * self.boost[terms]  # sublinear tf
+        norms = np.bincount(docs, weights=weights ** 2, minlength=n_docs)
+        weights = weights ** 2 / norms[docs]  # share of the document's squared L2 mass
+        order = np.lexsort((-weights, docs))
+        docs, terms, weights = docs[order], terms[order], weights[order]
+        starts = np.searchsorted(docs, docs, side="left")
+        top = (np.arange(len(docs)) - starts) < self.max_tags
+        docs, terms, weights = docs[top], terms[top], weights[top]
+        mass = np.bincount(docs, weights=weights, minlength=n_docs)
+        found = np.bincount(docs, minlength=n_docs)
+        confidence = mass * np.minimum(1.0, found / max(1, self.min_tags))
+        bounds = np.searchsorted(docs, np.arange(n_docs + 1))
+        words = self.vocabulary[terms].tolist()
+        for i in range(n_docs):
+            if bounds[i] < bounds[i + 1]:
+                results[i] = (words[bounds[i]:bounds[i + 1]], round(float(confidence[i]), 4))
+        return results
+
+    def fit_extract(self, texts, headings=()):
+        texts = list(texts)
+        return self.fit(texts, headings).extract(texts)
+
+
+def format_tags(tags):
+    """Comma-separated, like the GPT tagger's replies."""
+    return ", ".join(tags)
@@ -0,0 +1,137 @@
+"""
+segment.py - Compact record type for culture segments.
+
+Segments used to travel through the pipeline as plain dicts with a dozen
+string keys each. `Segment` keeps the known fields in __slots__ and behaves
+as a MutableMapping, so existing callers keep using seg['title'], seg.get(),
+`in`, pd.DataFrame(segments) and csv.DictWriter unchanged.
+
+Content produced by the segmenter is not copied: a Segment built with
+`from_source()` keeps a reference to the shared source text plus start/end
+offsets and slices the content on access. Assigning seg['content'] stores an
+explicit string and drops the source reference.
+"""
+from collections.abc import MutableMapping
+
+FIELDS = (
+    'title', 'content', 'tags', 'summary', 'summary_quality_score', 'confidence_score',
+    'segment_id', 'run_id', 'source_file', 'title_lang', 'needs_attention', 'section_summary',
+)
+_SLOTTED = frozenset(f for f in FIELDS if f != 'content')
+
+
+class Segment(MutableMapping):
+    __slots__ = tuple(f for f in FIELDS if f != 'content') + (
+        '_content', '_source', '_start', '_end', '_extra',
+    )
+
+    def __init__(self, *args, **kwargs):
+        self._extra = None
+        if args or kwargs:
+            self.update(*args, **kwargs)
+
+    @classmethod
+    def from_source(cls, title, source, start, end):
+        """Segment whose content is source[start:end], materialized lazily."""
+        seg = cls()
+        seg.title = title
+        seg._source = source
+        seg._start = start
+        seg._end = end
+        return seg
+
+    def __getitem__(self, key):
+        if key == 'content':
+            try:
+                return self._content
+            except AttributeError:
+                pass
+            try:
+                source = self._source
+            except AttributeError:
+                raise KeyError(key) from None
+            return source[self._start:self._end]
+        if key in _SLOTTED:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key == 'content':
+            self._content = value
+            self._drop_source()
+        elif key in _SLOTTED:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key == 'content':
+            if not self._has_content():
+                raise KeyError(key)
+            try:
+                del self._content
+            except AttributeError:
+                pass
+            self._drop_source()
+        elif key in _SLOTTED:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key == 'content':
+            return self._has_content()
+        if key in _SLOTTED:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        for name in FIELDS:
+            if name in self:
+                yield name
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"Segment({dict(self)!r})"
+
+    def _has_content(self):
+        return hasattr(self, '_content') or hasattr(self, '_source')
+
+    def _drop_source(self):
+        for name in ('_source', '_start', '_end'):
+            try:
+                delattr(self, name)
+            except AttributeError:
+                pass
+
+    def copy(self):
+        """Shallow copy that keeps lazy content lazy."""
+        new = Segment()
+        for name in _SLOTTED:
+            if hasattr(self, name):
+                setattr(new, name, getattr(self, name))
+        for name in ('_content', '_source', '_start', '_end'):
+            if hasattr(self, name):
+                setattr(new, name, getattr(self, name))
+        if self._extra:
+            new._extra = dict(self._extra)
+        return new
+
+    def to_dict(self):
+        return dict(self)
@@ -3,9 +3,9 @@ segment_quality.py - Analyze segment coverage, content depth, token stats, etc.
 
 This module is intended to provide advanced analytics and QA for segments.
 """
-import pandas as pd
 
 def quality_report(segments):
+    import pandas as pd
     df = pd.DataFrame(segments)
     report = {
         'count': len(df),
@@ -15,4 +15,49 @@ def quality_report(segments):
         'low_quality_count': (df['content'].str.len() < 100).sum() if 'content' in df else 0,
         'unique_titles': df['title'].nunique() if 'title' in df else 0,
     }
-    return report
+    # numpy scalars -> plain Python so the report is JSON/YAML serializable
+    return {k: v.item() if hasattr(v, 'item') else v for k, v in report.items()}
+
+
+class QualityAggregator:
+    """
+    Running version of quality_report for streamed runs: feed segment batches
+    to update() and call report() at the end. Keeps only counters and the set
+    of titles, so memory does not grow with the number of segments.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._content_count = 0
+        self._content_total = 0
+        self._min = None
+        self._max = None
+        self._low = 0
+        self._titles = set()
+
+    def update(self, segments):
+        for seg in segments:
+            self.count += 1
+            title = seg.get('title')
+            if title is not None:
+                self._titles.add(title)
+            content = seg.get('content')
+            if content is None:
+                continue
+            n = len(content)
+            self._content_count += 1
+            self._content_total += n
+            self._min = n if self._min is None else min(self._min, n)
+            self._max = n if self._max is None else max(self._max, n)
+            if n < 100:
+                self._low += 1
+
+    def report(self):
+        return {
+            'count': self.count,
+            'mean_content_length': self._content_total / self._content_count if self._content_count else 0,
+            'min_content_length': self._min or 0,
+            'max_content_length': self._max or 0,
+            'low_quality_count': self._low,
+            'unique_titles': len(self._titles),
+        }
@@ -15,6 +15,7 @@ setup(
     install_requires=[
         "pandas",
         "openai",
+        "httpx",
         "tiktoken",
         "python-docx",
         "streamlit",
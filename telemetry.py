@@ -0,0 +1,98 @@
+"""
+telemetry.py - Per-stage timing and throughput telemetry for pipeline runs.
+
+Wrap each pipeline stage in `telemetry.stage(name, file=...)`; the yielded
+StageRecord can be updated with item and byte counts once they are known.
+Wall time (perf_counter) and CPU time (process_time) are recorded per call,
+and summary() aggregates them per stage and per file for session logs.
+
+Observers (e.g. profilers) can be attached to run code at stage boundaries:
+they implement stage_started(name, file) and stage_finished(name, file, record).
+"""
+import time
+from contextlib import contextmanager, nullcontext
+
+
+class StageRecord:
+    __slots__ = ('stage', 'file', 'items', 'nbytes', 'wall', 'cpu')
+
+    def __init__(self, stage, file=None, items=0, nbytes=0):
+        self.stage = stage
+        self.file = file
+        self.items = items
+        self.nbytes = nbytes
+        self.wall = 0.0
+        self.cpu = 0.0
+
+
+def _rates(wall, cpu, items, nbytes, calls):
+    return {
+        'calls': calls,
+        'wall_s': round(wall, 6),
+        'cpu_s': round(cpu, 6),
+        'items': items,
+        'bytes': nbytes,
+        'items_per_sec': round(items / wall, 2) if wall > 0 else None,
+        'bytes_per_sec': round(nbytes / wall, 2) if wall > 0 else None,
+    }
+
+
+class Telemetry:
+    def __init__(self):
+        self.records = []
+        self.observers = []
+
+    @contextmanager
+    def stage(self, name, file=None, items=0, nbytes=0):
+        record = StageRecord(name, file, items, nbytes)
+        for observer in self.observers:
+            observer.stage_started(name, file)
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            record.wall = time.perf_counter() - wall_start
+            record.cpu = time.process_time() - cpu_start
+            self.records.append(record)
+            for observer in reversed(self.observers):
+                observer.stage_finished(name, file, record)
+
+    def _aggregate(self, records):
+        totals = {}
+        for rec in records:
+            t = totals.setdefault(rec.stage, [0.0, 0.0, 0, 0, 0])
+            t[0] += rec.wall
+            t[1] += rec.cpu
+            t[2] += rec.items
+            t[3] += rec.nbytes
+            t[4] += 1
+        return {stage: _rates(*t) for stage, t in totals.items()}
+
+    def summary(self):
+        """JSON-ready totals per stage, plus a per-file breakdown."""
+        per_file = {}
+        for rec in self.records:
+            if rec.file is not None:
+                per_file.setdefault(rec.file, []).append(rec)
+        return {
+            'stages': self._aggregate(self.records),
+            'files': {file: self._aggregate(recs) for file, recs in per_file.items()},
+        }
+
+    def format_summary(self):
+        """Compact fixed-width table of per-stage totals for end-of-run output."""
+        stages = self._aggregate(self.records)
+        lines = [f"{'stage':<18}{'calls':>6}{'wall_s':>10}{'cpu_s':>10}{'items':>9}{'items/s':>11}{'MB/s':>9}"]
+        for name, s in stages.items():
+            ips = f"{s['items_per_sec']:.1f}" if s['items_per_sec'] is not None else "-"
+            mbps = f"{s['bytes_per_sec'] / 1e6:.2f}" if s['bytes_per_sec'] else "-"
+            lines.append(f"{name:<18}{s['calls']:>6}{s['wall_s']:>10.3f}{s['cpu_s']:>10.3f}{s['items']:>9}{ips:>11}{mbps:>9}")
+        return "\n".join(lines)
+
+
+def stage(telemetry, name, file=None, items=0, nbytes=0):
+    """telemetry.stage(...) if telemetry is set, else a no-op context yielding a throwaway record."""
+    if telemetry is None:
+        return nullcontext(StageRecord(name, file, items, nbytes))
+    return telemetry.stage(name, file=file, items=items, nbytes=nbytes)
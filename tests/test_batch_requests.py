@@ -0,0 +1,123 @@
+"""
+test_batch_requests.py - Round trips through scripts/batch_requests.py with the local stand-in.
+"""
+import json
+
+import pytest
+
+from scripts import batch_requests
+from scripts.llm_cache import LLMCache, configure_default_cache
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path):
+    yield configure_default_cache(str(tmp_path / "cache.sqlite"), "rw")
+    configure_default_cache(mode="off")
+
+
+def _read(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_fields_prepare_simulate_ingest(tmp_path, cache):
+    src = tmp_path / "parsed"
+    src.mkdir()
+    (src / "Ainu.v3.json").write_text(json.dumps({'culture_name': "Ainu", 'language_tag': "ain", 'kinship': "done"}))
+    (src / "Zulu.v3.json").write_text(json.dumps({'culture_name': "Zulu", 'language_tag': "zu",
+                                                  'kinship': "[ERROR: timeout]"}))
+    prompts = {'kinship': "Describe kinship among the {culture_name}.", 'religion': "Describe {culture_name} religion."}
+    requests = tmp_path / "batch" / "requests.jsonl"
+    batch_requests._write_jsonl(requests, batch_requests.field_requests(src, prompts))
+    ids = [r['custom_id'] for r in _read(requests)]
+    assert ids == ["field|Ainu.v3.json|religion", "field|Zulu.v3.json|kinship", "field|Zulu.v3.json|religion"]
+
+    results = tmp_path / "batch" / "results.jsonl"
+    assert batch_requests.simulate(requests, results) == 3
+    stats = batch_requests.ingest_fields(results, requests, src, tmp_path / "out")
+    assert stats == {'files': 2, 'fields': 3, 'failed': 0}
+    zulu = json.loads((tmp_path / "out" / "zu" / "Zulu.v3.json").read_text())
+    assert zulu['kinship'].startswith("Simulated response") and zulu['religion']
+    ainu = json.loads((tmp_path / "out" / "ain" / "Ainu.v3.json").read_text())
+    assert ainu['kinship'] == "done" and ainu['model_used'].endswith("-simulated")
+    assert cache.stats()['writes'] == 3
+
+    # Re-preparing after the ingest emits nothing: the fields are in the ingested copies and in the cache.
+    assert list(batch_requests.field_requests(src, prompts, output_dir=tmp_path / "out")) == []
+    assert list(batch_requests.field_requests(src, prompts)) == []
+
+
+def test_segments_round_trip_and_failed_results_stay_pending(tmp_path):
+    doc = tmp_path / "doc.txt"
+    doc.write_text("AINU\nIntro line\nEconomy\nFishing and hunting.\n\nZULU\nIntro\nKinship\nLarge families.\n")
+    reqs, pending = batch_requests.segment_requests([str(doc)])
+    assert len(reqs) == len(pending) >= 1
+    assert [r['custom_id'] for r in reqs] == [r['custom_id'] for r in batch_requests.segment_requests([str(doc)])[0]]
+    requests = tmp_path / "requests.jsonl"
+    batch_requests._write_jsonl(requests, reqs)
+    batch_requests._write_jsonl(batch_requests.sidecar_path(str(requests)), pending)
+
+    results = tmp_path / "results.jsonl"
+    batch_requests.simulate(requests, results)
+    rows = _read(results)
+    rows[0] = {'id': rows[0]['id'], 'custom_id': rows[0]['custom_id'], 'response': None,
+               'error': {'code': "server_error", 'message': "boom"}}
+    batch_requests._write_jsonl(results, rows)
+
+    segments, stats = batch_requests.ingest_segments(results, batch_requests.sidecar_path(str(requests)), requests)
+    assert stats['failed'] == 1 and stats['merged'] == len(segments) - 1 and stats['rejected'] == 0
+    assert 'summary' not in segments[0]
+    for seg in segments[1:]:
+        assert seg['summary'].startswith("Simulated summary") and "simulated" in seg['tags']
+        assert seg['section_summary']
+    assert LLMCache(str(tmp_path / "cache.sqlite"), "ro").stats()['entries'] == len(segments) - 1
+
+    # Re-preparing emits only the failed request; once that is ingested, nothing is left.
+    again, pending = batch_requests.segment_requests([str(doc)])
+    assert [r['custom_id'] for r in again] == [rows[0]['custom_id']] and len(pending) == len(segments)
+    batch_requests._write_jsonl(requests, again)
+    batch_requests._write_jsonl(batch_requests.sidecar_path(str(requests)), pending)
+    batch_requests.simulate(requests, results)
+    segments, stats = batch_requests.ingest_segments(results, batch_requests.sidecar_path(str(requests)))
+    assert stats['merged'] == len(segments) and stats['cached'] == len(segments) - 1
+    assert batch_requests.segment_requests([str(doc)])[0] == []
+
+
+def test_prepare_never_calls_the_api_and_condenses_through_batch_rounds(tmp_path):
+    httpx = pytest.importorskip("httpx")
+    from scripts import segment_by_culture as sbc
+    calls = []
+
+    def offline(request):
+        calls.append(request.url)
+        raise AssertionError("prepare must not send requests")
+
+    transport = httpx.MockTransport(offline)
+    long_text = " ".join(f"Fishing canoes, kinship and clan rituals of the river people {i}." for i in range(900))
+    doc = tmp_path / "doc.txt"
+    doc.write_text(f"AINU\nIntro\nEconomy\n{long_text}\n\nZULU\nIntro\nKinship\nLarge families.\n")
+    requests, results = tmp_path / "requests.jsonl", tmp_path / "results.jsonl"
+
+    def batch_round():
+        reqs, pending = batch_requests.segment_requests([str(doc)], transport=transport)
+        batch_requests._write_jsonl(requests, reqs)
+        batch_requests._write_jsonl(batch_requests.sidecar_path(str(requests)), pending)
+        batch_requests.simulate(requests, results)
+        return reqs, pending, batch_requests.ingest_segments(results, batch_requests.sidecar_path(str(requests)))
+
+    reqs, pending, (segments, stats) = batch_round()
+    chunks = [r for r in reqs if r['custom_id'].startswith("chunk|")]
+    assert len(chunks) > 1 and len(reqs) == len(chunks) + 1  # the short segment's request goes out already
+    assert [bool(e.get('chunks')) for e in pending] == [True, False]
+    assert stats['condensing'] == 1 and stats['merged'] == 1 and 'summary' not in segments[0]
+
+    reqs, pending, (segments, stats) = batch_round()
+    assert [r['custom_id'] for r in reqs] == [pending[0]['custom_id']]
+    assert stats['condensing'] == 0 and stats['merged'] == 2 and segments[0]['summary'].startswith("Simulated")
+    assert calls == []
+
+    # The condensed request is the one enrich_segments would send: condense() now runs from the cache alone.
+    engine = sbc.default_engine(transport=transport)
+    content = engine.run(lambda: sbc.condense(engine, segments[0]['content'], segments[0]['title']))
+    prompt = sbc.segment_combined_prompt(content, segments[0]['title'], pending[0]['sections'])
+    assert engine.build_payload(prompt) == pending[0]['body'] and calls == []
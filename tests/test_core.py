@@ -108,3 +108,149 @@ def test_postprocess():
     fake = [{'title': 'TESTLAND', 'content': 'Short.', 'summary': 'Brief summary...'}]
     flagged = postprocess_segments(fake)
     assert flagged[0]['needs_attention'] is True
+
+def test_export_segments_markdown_bulk_archives():
+    import tarfile
+    import zipfile
+    from core import export_segments_markdown_bulk
+    segs = postprocess_segments(make_dummy_segments())
+    with tempfile.TemporaryDirectory() as tmpdir:
+        zip_path = os.path.join(tmpdir, 'segments.zip')
+        stats = export_segments_markdown_bulk(segs, zip_path)
+        assert stats['files'] == len(segs)
+        with zipfile.ZipFile(zip_path) as zf:
+            names = zf.namelist()
+            assert len(names) == len(segs)
+            assert zf.read(names[0]).decode('utf-8').startswith('---\n')
+        tar_path = os.path.join(tmpdir, 'segments.tar.gz')
+        export_segments_markdown_bulk(segs, tar_path)
+        with tarfile.open(tar_path) as tf:
+            assert len(tf.getnames()) == len(segs)
+        md_dir = os.path.join(tmpdir, 'mds')
+        stats = export_segments_markdown_bulk(segs, md_dir, max_workers=2)
+        assert len(os.listdir(md_dir)) == stats['files'] == len(segs)
+
+def test_export_segments_jsonl_keeps_types():
+    import json
+    from core import export_segments_jsonl
+    segs = postprocess_segments(make_dummy_segments())
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'out.jsonl')
+        export_segments_jsonl(segs, path)
+        with open(path, encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f]
+        assert len(rows) == len(segs)
+        assert rows[0]['tags'] == ['tag1', 'tag2']
+        assert rows[1]['tags'] == []
+        assert isinstance(rows[0]['needs_attention'], bool)
+
+def test_export_segments_parquet_typed_schema():
+    pq = pytest.importorskip('pyarrow.parquet')
+    import pyarrow as pa
+    from core import export_segments_parquet
+    segs = postprocess_segments(make_dummy_segments())
+    segs[0]['extra_note'] = 42
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'out.parquet')
+        export_segments_parquet(segs, path, compression='zstd', row_group_size=2)
+        pf = pq.ParquetFile(path)
+        assert pf.metadata.num_rows == len(segs)
+        assert pf.metadata.num_row_groups == 2
+        table = pf.read()
+        assert table.schema.field('needs_attention').type == pa.bool_()
+        assert table.schema.field('tags').type == pa.list_(pa.string())
+        assert table.column('tags').to_pylist()[0] == ['tag1', 'tag2']
+        assert table.column('extra_note').to_pylist() == ['42', None, None]
+
+def test_stream_writer_and_repo_appender_match_batch_exports():
+    from core import SegmentStreamWriter, RepoCsvAppender
+    from segment_quality import QualityAggregator, quality_report
+    segs = postprocess_segments(make_dummy_segments())
+    with tempfile.TemporaryDirectory() as tmpdir:
+        out = os.path.join(tmpdir, 'out.csv')
+        with SegmentStreamWriter(out, 'csv') as writer:
+            writer.write(segs[:2])
+            writer.write(segs[2:])
+        df = pd.read_csv(out)
+        assert list(df['segment_id']) == [s['segment_id'] for s in segs]
+        repo_path = os.path.join(tmpdir, 'repo.csv')
+        RepoCsvAppender(repo_path).append(segs[:2])
+        appender = RepoCsvAppender(repo_path)
+        assert appender.append(segs) == 1
+        assert appender.total_rows == len(segs) == len(pd.read_csv(repo_path))
+    agg = QualityAggregator()
+    agg.update(segs[:1])
+    agg.update(segs[1:])
+    expected = quality_report(segs)
+    assert agg.report() == {k: pytest.approx(v) for k, v in expected.items()}
+
+def test_stream_and_batch_csv_exports_are_identical():
+    from core import SegmentStreamWriter, SEGMENT_FIELDS
+    segs = postprocess_segments(make_dummy_segments())
+    segs[0]['extra_note'] = 42
+    segs[1]['confidence_score'] = float('nan')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        batch, stream = os.path.join(tmpdir, 'batch.csv'), os.path.join(tmpdir, 'stream.csv')
+        export_segments_csv(segs, batch)
+        with SegmentStreamWriter(stream, 'csv') as writer:
+            writer.write(segs)
+        with open(batch, 'rb') as b, open(stream, 'rb') as s:
+            assert b.read() == s.read()
+        header = list(pd.read_csv(batch, nrows=0).columns)
+        assert header == SEGMENT_FIELDS + ['extra_note']
+        export_segments_csv([], batch)
+        SegmentStreamWriter(stream, 'csv').close()
+        with open(batch, 'rb') as b, open(stream, 'rb') as s:
+            assert b.read() == s.read()
+
+
+def test_postprocess_frame_matches_per_dict_semantics():
+    import random
+    from core import postprocess_frame
+    random.seed(7)
+    segs = []
+    for i in range(300):
+        seg = {'title': f'T{i}', 'content': 'x' * random.choice([0, 50, 199, 200, 500])}
+        if random.random() < 0.8:
+            seg['summary'] = random.choice(['', 'short', 's' * 120, 's' * 120 + '...'])
+        if random.random() < 0.3:
+            seg['summary_quality_score'] = random.choice(['low', 'medium', 'high'])
+        if random.random() < 0.7:
+            seg['tags'] = random.choice(['', 'a,b', 'culture'])
+        if random.random() < 0.5:
+            seg['segment_id'] = f'id-{i}'
+        segs.append(seg)
+    frame = pd.DataFrame([dict(s) for s in segs])
+    expected = postprocess_segments(segs)
+    result = postprocess_frame(frame)
+    assert list(result['confidence_score']) == [s['confidence_score'] for s in expected]
+    assert list(result['needs_attention']) == [s['needs_attention'] for s in expected]
+    assert result['needs_attention'].dtype == bool
+    kept = [s['segment_id'] for s in expected if s['segment_id'].startswith('id-')]
+    assert [i for i in result['segment_id'] if i.startswith('id-')] == kept
+    assert result['segment_id'].notna().all()
+
+def test_postprocess_segments_accepts_arrow_table():
+    pa = pytest.importorskip('pyarrow')
+    table = pa.table({
+        'title': ['A', 'B'],
+        'content': ['y' * 300, 'short'],
+        'summary': ['s' * 150, 'tiny'],
+        'tags': [['a', 'b'], []],
+    })
+    df = postprocess_segments(table)
+    assert list(df['confidence_score']) == ['high', 'medium']
+    assert list(df['needs_attention']) == [False, True]
+
+
+def test_entry_points_do_not_import_heavy_modules():
+    import subprocess
+    import sys
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = ("import sys, logging, cli, cli_minimal, run_pipeline, scripts.segment_by_culture\n"
+            "print(sorted(m for m in ('pandas', 'numpy', 'openai', 'httpx', 'tiktoken') if m in sys.modules))\n"
+            "print(len(logging.getLogger().handlers))")
+    out = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True).stdout
+    heavy, handlers = out.splitlines()
+    assert heavy == "[]"
+    assert handlers == "1"  # only core's basicConfig file handler
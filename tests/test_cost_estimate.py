@@ -0,0 +1,71 @@
+"""
+test_cost_estimate.py - Tests for the token-count cache and scripts/cost_estimate.py.
+"""
+import pytest
+
+from scripts import segment_by_culture as sbc
+
+
+class CountingEncoder:
+    """One token per word; counts encode calls."""
+
+    def __init__(self):
+        self.encodes = 0
+
+    def encode(self, text):
+        self.encodes += 1
+        return text.split(" ")
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+def test_truncate_skips_encoding_when_under_the_limit(monkeypatch):
+    enc = CountingEncoder()
+    monkeypatch.setattr(sbc, "token_encoder", lambda: enc)
+    monkeypatch.setattr(sbc, "_token_counts", type(sbc._token_counts)())
+    short = "word " * 10
+    assert sbc.truncate_for_gpt(short, max_tokens=100) == short
+    assert enc.encodes == 0  # byte bound alone proves it fits
+
+    medium = "longer-word " * 50  # 600 bytes, 51 tokens
+    assert sbc.truncate_for_gpt(medium, max_tokens=100) == medium
+    assert sbc.truncate_for_gpt(medium, max_tokens=100) == medium
+    assert sbc.count_tokens(medium) == 51
+    assert enc.encodes == 1  # counted once, then served from the cache
+
+    assert sbc.truncate_for_gpt(medium, max_tokens=10) == " ".join(["longer-word"] * 10)
+
+
+def test_fallback_count_and_truncation_share_one_ratio(monkeypatch):
+    monkeypatch.setattr(sbc, "token_encoder", lambda: None)
+    for max_tokens in (1, 10, 100, sbc.SUMMARY_TOKEN_CAP):
+        cut = sbc.truncate_for_gpt("x" * 100000, max_tokens=max_tokens)
+        assert sbc.count_tokens(cut) == max_tokens  # truncated text is never counted over its budget
+        assert sbc.count_tokens(cut + "x") == max_tokens + 1
+    assert all(sbc.count_tokens(chunk) <= sbc.CHUNK_TOKENS for chunk in sbc.chunk_text("y" * 20000))
+
+
+def test_estimate_counts_requests_tokens_cost_and_cache_hits(tmp_path):
+    pytest.importorskip("httpx")
+    from scripts.cost_estimate import estimate_segments, model_price
+    from scripts.enrichment_engine import EnrichmentEngine
+    from scripts.llm_cache import LLMCache, payload_key
+    from segment import Segment
+
+    cache = LLMCache(str(tmp_path / "cache.sqlite"))
+    engine = EnrichmentEngine(model="gpt-4o-mini", concurrency=2, rpm=2, tpm=10 ** 6, api_key="x",
+                              completion_tokens=100, cache=cache)
+    segments = [Segment(title=f"C{i}", content=f"Intro\nEconomy\nRice farming {i}.") for i in range(4)]
+    summary = estimate_segments(segments, section_summaries=False, combined=False, engine=engine).summary()
+    assert summary['requests'] == 8 and summary['cached_requests'] == 0
+    assert summary['output_tokens'] == 800
+    price_in, price_out = model_price("gpt-4o-mini-2024-07-18")
+    assert summary['cost_usd'] == pytest.approx(
+        (summary['input_tokens'] * price_in + 800 * price_out) / 1e6, abs=1e-4)
+    assert summary['limited_by'] == "rpm" and summary['wall_seconds'] == pytest.approx(180)
+
+    cache.put(payload_key(engine.build_payload(sbc.segment_combined_prompt(segments[0]['content'], "C0", []), None)), "x")
+    summary = estimate_segments(segments, section_summaries=False, engine=engine).summary()
+    assert summary['requests'] == 3 and summary['cached_requests'] == 1
+    assert cache.stats()['hits'] == 0  # estimates do not count as cache reads
@@ -0,0 +1,143 @@
+"""
+test_culture_fields.py - Tests for scripts/culture_fields.py (structured field enrichment).
+"""
+import json
+import threading
+
+import pytest
+
+from scripts import culture_fields
+from scripts.llm_cache import CacheMiss
+
+PROMPTS = {'kinship': "Describe kinship among the {culture_name}.", 'religion': "Describe {culture_name} religion.",
+           'economy': "Describe the {culture_name} economy."}
+
+
+def test_prompt_embeds_the_schema_and_field_instructions():
+    prompt = culture_fields.structured_prompt(PROMPTS, "Ainu", ["kinship", "religion"])
+    schema = json.loads(prompt.split("JSON schema:\n", 1)[1].split("\n", 1)[0])
+    assert schema == culture_fields.fields_schema(["kinship", "religion"])
+    assert schema['required'] == ["kinship", "religion"] and not schema['additionalProperties']
+    assert '- "kinship": Describe kinship among the Ainu.' in prompt and "economy" not in prompt
+
+
+def test_valid_replies_pass_and_fenced_json_is_accepted():
+    reply = '```json\n{"kinship": " Clans. ", "religion": "Animism."}\n```'
+    assert culture_fields.validate_structured(reply, ["kinship", "religion"]) == (
+        {'kinship': "Clans.", 'religion': "Animism."}, [])
+
+
+def test_wrong_types_missing_keys_and_bad_json_are_rejected():
+    reply = json.dumps({'kinship': ["not", "a", "string"], 'religion': "  ", 'economy': "Fishing.", 'extra': "x"})
+    valid, failed = culture_fields.validate_structured(reply, list(PROMPTS))
+    assert valid == {'economy': "Fishing."} and failed == ["kinship", "religion"]
+    assert culture_fields.validate_structured(json.dumps({'economy': 1}), ["kinship", "economy"]) == (
+        {}, ["kinship", "economy"])
+    assert culture_fields.validate_structured("not json", ["kinship"]) == ({}, ["kinship"])
+    assert culture_fields.validate_structured('["kinship"]', ["kinship"]) == ({}, ["kinship"])
+
+
+def test_only_the_failed_fields_are_requested_again():
+    requested = []
+    replies = iter([json.dumps({'kinship': "Clans.", 'religion': 3}), json.dumps({'religion': "Animism.",
+                                                                                  'economy': ""})])
+
+    def complete(prompt, system_prompt, max_tokens, response_format):
+        schema = json.loads(prompt.split("JSON schema:\n", 1)[1].split("\n", 1)[0])
+        requested.append((schema['required'], max_tokens))
+        assert response_format == {"type": "json_object"}
+        return next(replies), "gpt-test"
+
+    data = {'culture_name': "Ainu"}
+    todo = culture_fields.enrich_fields_structured(data, list(PROMPTS), "Ainu", "sys", PROMPTS, complete, 600)
+    assert requested == [(["kinship", "religion", "economy"], 1800), (["religion", "economy"], 1200)]
+    assert todo == ["economy"]  # left for the per-field fallback after STRUCTURED_ROUNDS
+    assert data == {'culture_name': "Ainu", 'kinship': "Clans.", 'religion': "Animism.", 'model_used': "gpt-test"}
+
+
+def test_request_errors_leave_every_field_for_the_fallback():
+    class Boom(Exception):
+        pass
+
+    def failing(error):
+        def complete(*args, **kwargs):
+            raise error
+        return complete
+
+    for error in (Boom("rate limited"), CacheMiss("replay")):
+        data = {}
+        todo = culture_fields.enrich_fields_structured(data, ["kinship"], "Ainu", "sys", PROMPTS, failing(error), 600,
+                                                       errors=(Boom,))
+        assert todo == ["kinship"] and data == {}
+
+
+def test_save_culture_data_keeps_the_original_when_the_dump_fails(tmp_path, monkeypatch):
+    path = tmp_path / "und" / "Ainu.v3.json"
+    culture_fields.save_culture_data(path, {'culture_name': "Ainu"})
+
+    def broken_dump(data, f, **kwargs):
+        f.write('{"culture_name": "Ai')  # half written, then the run dies
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(culture_fields.json, "dump", broken_dump)
+    with pytest.raises(KeyboardInterrupt):
+        culture_fields.save_culture_data(path, {'culture_name': "Ainu", 'kinship': "Clans."})
+    assert json.loads(path.read_text(encoding="utf-8")) == {'culture_name': "Ainu"}
+    assert [p.name for p in path.parent.iterdir()] == ["Ainu.v3.json"]  # no temp file left behind
+
+
+def test_workers_log_through_one_writer_and_count_in_memory():
+    main_thread = threading.get_ident()
+    writers = []
+
+    class Writer:
+        rows = []
+
+        def writerows(self, rows):
+            writers.append(threading.get_ident())
+            self.rows.extend(rows)
+
+    started = threading.Barrier(4)
+
+    def enrich_file(filename):
+        started.wait(timeout=5)  # all four files are in flight at once
+        if filename == "bad.v3.json":
+            raise ValueError("malformed")
+        if filename == "empty.v3.json":
+            return "skipped", [], None
+        return "processed", [f"{filename}:kinship", f"{filename}:religion"], f"out/{filename}"
+
+    files = ["a.v3.json", "b.v3.json", "bad.v3.json", "empty.v3.json"]
+    writer = Writer()
+    counts, fields = culture_fields.enrich_files(files, enrich_file, writer, workers=4)
+    assert counts == {'processed': 2, 'skipped': 1, 'failed': 1} and fields == 4
+    assert set(writers) == {main_thread} and len(writers) == 2
+    assert sorted(writer.rows) == [["a.v3.json", "a.v3.json:kinship"], ["a.v3.json", "a.v3.json:religion"],
+                                   ["b.v3.json", "b.v3.json:kinship"], ["b.v3.json", "b.v3.json:religion"]]
+
+
+def test_estimate_counts_the_fields_the_run_dispatches():
+    from scripts import field_provenance
+    dispatched = []
+
+    def complete(prompt, system_prompt, max_tokens, response_format):
+        fields = json.loads(prompt.split("JSON schema:\n", 1)[1].split("\n", 1)[0])['required']
+        dispatched.extend(fields)
+        return json.dumps({field: f"{field} text" for field in fields}), "gpt-test"
+
+    def run(existing, prompts):  # what enrich_culture_with_ai does with a culture file
+        data, todo = culture_fields.plan_enrichment(existing, "Ainu", prompts, "gpt-test", "sys", stale_only=True)
+        source = field_provenance.input_hash(data, prompts)
+        culture_fields.enrich_fields_structured(data, todo, "Ainu", "sys", prompts, complete, 600)
+        for field in todo:
+            field_provenance.record(data, field, prompts[field], "sys", "gpt-test", source)
+        return data
+
+    # A file without culture_name/language_tag, enriched once: its provenance hashes the defaults.
+    enriched = run({'notes': "hand-written"}, PROMPTS)
+    source_file = {k: v for k, v in enriched.items() if k not in ('culture_name', 'language_tag')}
+    edited = dict(PROMPTS, religion="Describe the beliefs of the {culture_name}.")
+    _, estimated = culture_fields.plan_enrichment(source_file, "Ainu", edited, "gpt-test", "sys", stale_only=True)
+    dispatched.clear()
+    run(source_file, edited)
+    assert estimated == dispatched == ["religion"]
@@ -0,0 +1,326 @@
+"""
+test_enrichment_engine.py - Tests for scripts/enrichment_engine.py and enrich_segments.
+"""
+import asyncio
+import json
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+from scripts.enrichment_engine import CircuitOpen, EnrichmentEngine, GPTError, TokenBucket  # noqa: E402
+from scripts.segment_by_culture import enrich_segments  # noqa: E402
+from segment import Segment  # noqa: E402
+
+
+def _reply(text):
+    return httpx.Response(200, json={'choices': [{'message': {'content': text}}]})
+
+
+def test_token_bucket_queues_reservations():
+    bucket = TokenBucket(60, capacity=2)  # one unit per second
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(1.0, abs=0.05)
+    assert bucket.reserve() == pytest.approx(2.0, abs=0.05)
+
+
+def test_enrich_segments_keeps_order_bounds_concurrency_and_retries():
+    state = {'in_flight': 0, 'peak': 0, 'calls': 0}
+
+    async def handler(request):
+        prompt = json.loads(request.content)['messages'][0]['content']
+        state['calls'] += 1
+        if state['calls'] % 5 == 0:
+            return httpx.Response(429, headers={'retry-after': '0'})
+        state['in_flight'] += 1
+        state['peak'] = max(state['peak'], state['in_flight'])
+        await asyncio.sleep(0.01)
+        state['in_flight'] -= 1
+        title = prompt.split(" the ")[-1].split(" group")[0] if "Summarize the cultural" in prompt else "tag"
+        return _reply(title)
+
+    engine = EnrichmentEngine(concurrency=3, rpm=10000, tpm=10 ** 7, backoff_base=0.001,
+                              api_key="test", transport=httpx.MockTransport(handler))
+    segments = [Segment(title=f"CULTURE{i}", content=f"Some text about culture {i}.") for i in range(12)]
+    out = enrich_segments(segments, section_summaries=False, combined=False, engine=engine)
+    assert [s['summary'] for s in out] == [f"CULTURE{i}" for i in range(12)]
+    assert all(s['tags'] == "tag" for s in out)
+    assert state['peak'] <= 3
+
+
+def test_non_retryable_errors_fail_fast():
+    calls = []
+
+    def handler(request):
+        calls.append(1)
+        return httpx.Response(400, text="bad request")
+
+    engine = EnrichmentEngine(rpm=10000, tpm=10 ** 7, api_key="test", transport=httpx.MockTransport(handler))
+    with pytest.raises(GPTError):
+        engine.complete_sync("hello")
+    assert len(calls) == 1
+    out = enrich_segments([Segment(title="X", content="y")], section_summaries=False, combined=False, engine=engine)
+    assert 'summary' not in out[0] and 'tags' not in out[0]  # failures never end up in the exports
+
+
+def test_runs_without_an_api_key(monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    seen = []
+
+    def handler(request):
+        seen.append(request.headers.get("authorization"))
+        return _reply("ok")
+
+    engine = EnrichmentEngine(rpm=10000, tpm=10 ** 7, base_url="http://local.test/v1",
+                              transport=httpx.MockTransport(handler))
+    assert engine.complete_sync("hello") == "ok"
+    out = enrich_segments([Segment(title="X", content="y")], section_summaries=False, combined=False, engine=engine)
+    assert out[0]['summary'] == "ok" and seen == [None] * 3
+
+
+def test_parse_combined_is_strict():
+    from scripts.segment_by_culture import parse_combined
+    reply = '```json\n{"summary": "S.", "tags": ["kinship", " rice "], "section_summary": {"Economy": "E."}}\n```'
+    assert parse_combined(reply, sections=["Economy"]) == {
+        'summary': "S.", 'tags': "kinship, rice", 'section_summary': "Economy: E."}
+    for bad in ('not json', '{"summary": "S.", "tags": []}', '{"summary": "", "tags": "a", "section_summary": "x"}',
+                '{"summary": "S.", "tags": "a", "section_summary": "x", "extra": 1}'):
+        with pytest.raises(ValueError):
+            parse_combined(bad)
+    with pytest.raises(ValueError):
+        parse_combined('{"summary": "S.", "tags": "a", "section_summary": {"Kinship": "K."}}', sections=["Economy"])
+
+
+def test_combined_mode_sends_one_request_and_falls_back_on_bad_json():
+    prompts = []
+
+    def handler(request):
+        prompt = json.loads(request.content)['messages'][0]['content']
+        prompts.append(prompt)
+        if "Return only a JSON object" not in prompt:
+            return _reply("fallback")
+        if "BROKEN" in prompt:
+            return _reply("Sure! Here is the summary you asked for.")
+        return _reply(json.dumps({'summary': "S.", 'tags': ["a", "b", "c"],
+                                  'section_summary': {"Uncategorized": "U.", "Economy": "E."}}))
+
+    engine = EnrichmentEngine(rpm=10000, tpm=10 ** 7, api_key="test", transport=httpx.MockTransport(handler))
+    good = Segment(title="GOOD", content="Intro line\nEconomy\nRice farming.")
+    out = enrich_segments([good], engine=engine)
+    assert len(prompts) == 1
+    assert out[0]['tags'] == "a, b, c"
+    assert out[0]['section_summary'] == "Uncategorized: U.\nEconomy: E."
+
+    prompts.clear()
+    out = enrich_segments([Segment(title="BROKEN", content="Intro line\nEconomy\nRice farming.")], engine=engine)
+    assert len(prompts) == 1 + 2 + 2  # combined, then summary, tags and one call per section
+    assert out[0]['summary'] == "fallback"
+
+
+def test_long_segments_are_condensed_by_bounded_map_reduce(monkeypatch):
+    from scripts import segment_by_culture as sbc
+    monkeypatch.setattr(sbc, "token_encoder", lambda: None)
+    monkeypatch.setattr(sbc, "SUMMARY_TOKEN_CAP", 100)
+    monkeypatch.setattr(sbc, "CHUNK_TOKENS", 80)
+    monkeypatch.setattr(sbc, "CHUNK_OVERLAP", 10)
+    state = {'in_flight': 0, 'peak': 0, 'final': None}
+
+    async def handler(request):
+        prompt = json.loads(request.content)['messages'][0]['content']
+        if "This is part" not in prompt:
+            state['final'] = prompt
+            return _reply(json.dumps({'summary': "S.", 'tags': ["a"], 'section_summary': ""}))
+        state['in_flight'] += 1
+        state['peak'] = max(state['peak'], state['in_flight'])
+        await asyncio.sleep(0.01)
+        state['in_flight'] -= 1
+        return _reply("Gist of " + prompt.split("This is part ")[1].split(" ")[0])
+
+    content = " ".join(f"fact{i}" for i in range(400)) + " TAILFACT"
+    engine = EnrichmentEngine(concurrency=8, rpm=10000, tpm=10 ** 7, api_key="test",
+                              transport=httpx.MockTransport(handler))
+    out = enrich_segments([Segment(title="LONG", content=content)], section_summaries=False, engine=engine)
+    assert out[0]['summary'] == "S."
+    assert "Gist of 1" in state['final'] and "fact1 " not in state['final']
+    assert 1 < state['peak'] <= 4  # fan-out capped at half the engine's concurrency
+    chunks = sbc.chunk_text(content)
+    assert "TAILFACT" in chunks[-1] and all(len(c) <= int(80 * sbc.CHARS_PER_TOKEN) for c in chunks)
+
+
+def test_concurrency_controller_is_aimd():
+    import time
+    from scripts.enrichment_engine import ConcurrencyController
+
+    c = ConcurrencyController(16, initial=8, log_interval=0)
+    tokens = [c.acquire() for _ in range(8)]
+    assert c._try_acquire()[0] is None
+    for t in tokens[:4]:
+        c.release(t, "throttled")
+    assert c.limit == 4  # one cut per window, not one per throttled call
+    for t in tokens[4:]:
+        c.release(t, "ok")
+    assert 4.5 < c.limit < 5.5
+    for _ in range(200):
+        c.release(c.acquire(), "ok")
+    assert c.limit == 16 and c.stats()['completed'] == 204
+
+    c.pause(0.05)
+    start = time.monotonic()
+    c.release(c.acquire(), "error")
+    assert time.monotonic() - start >= 0.05
+
+    fixed = ConcurrencyController(3, adaptive=False)
+    fixed.release(fixed.acquire(), "throttled")
+    assert fixed.limit == 3
+
+
+def test_engine_backs_off_to_the_sustainable_concurrency():
+    state = {'in_flight': 0, 'peak': 0}
+
+    async def handler(request):
+        if state['in_flight'] >= 4:  # the "quota": more than 4 at once is rate limited
+            return httpx.Response(429, headers={'retry-after': '0'})
+        state['in_flight'] += 1
+        state['peak'] = max(state['peak'], state['in_flight'])
+        await asyncio.sleep(0.005)
+        state['in_flight'] -= 1
+        return _reply("ok")
+
+    engine = EnrichmentEngine(concurrency=32, rpm=10 ** 6, tpm=10 ** 9, backoff_base=0.001, max_retries=20,
+                              api_key="test", transport=httpx.MockTransport(handler))
+    segments = [Segment(title=f"C{i}", content=f"text {i}") for i in range(80)]
+    out = enrich_segments(segments, section_summaries=False, combined=False, engine=engine)
+    assert all(s['summary'] == "ok" for s in out)
+    stats = engine.controller.stats()
+    assert stats['throttled'] > 0 and stats['limit'] < 12
+
+
+def test_circuit_breaker_opens_fails_fast_and_probes_after_cooldown():
+    import time
+    from scripts.enrichment_engine import CircuitBreaker
+
+    b = CircuitBreaker(failure_rate=0.5, window=10, min_calls=4, cooldown=0.05, name="m")
+    for ok in (True, False, True, False):
+        assert b.allow()
+        b.record(ok)
+    assert b.state == "open" and not b.allow() and b.retry_in() > 0
+    time.sleep(0.06)
+    assert b.allow() and not b.allow()  # a single half-open probe
+    b.record(False)
+    assert b.state == "open" and b.opened == 2
+    time.sleep(0.06)
+    assert b.allow()
+    b.record(True)
+    assert b.state == "closed" and b.retry_in() == 0
+
+    calls = []
+    engine = EnrichmentEngine(rpm=10000, tpm=10 ** 7, api_key="test",
+                              transport=httpx.MockTransport(lambda request: calls.append(1) or _reply("x")))
+    engine.breakers[engine.model] = CircuitBreaker(min_calls=1, cooldown=60)
+    engine.breakers[engine.model].record(False)
+    with pytest.raises(CircuitOpen):
+        engine.complete_sync("hello")
+    assert calls == []
+
+
+def test_probe_cancelled_before_sending_frees_the_half_open_slot():
+    import time
+    from scripts.enrichment_engine import CircuitBreaker
+
+    engine = EnrichmentEngine(concurrency=1, rpm=10000, tpm=10 ** 7, api_key="test",
+                              transport=httpx.MockTransport(lambda request: _reply("x")))
+    breaker = engine.breakers[engine.model] = CircuitBreaker(min_calls=1, cooldown=0.01)
+    breaker.record(False)
+    time.sleep(0.02)
+    held = engine.controller.acquire()  # the probe will wait for this slot
+
+    async def cancel_probe():
+        task = asyncio.ensure_future(engine.complete("hello"))
+        await asyncio.sleep(0.05)
+        assert breaker.state == "half_open" and not breaker.allow()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    engine.run(cancel_probe)
+    engine.controller.release(held, "ok")
+    assert engine.complete_sync("hello") == "x"  # a new probe is admitted and closes the breaker
+    assert breaker.state == "closed"
+
+
+def test_outage_routes_to_fallback_model_or_defers_and_retries():
+    import time
+    state = {'models': [], 'down_until': time.monotonic() + 0.15}
+
+    def handler(request):
+        model = json.loads(request.content)['model']
+        state['models'].append(model)
+        if model == "gpt-4" and time.monotonic() < state['down_until']:
+            return httpx.Response(503)
+        return _reply(f"from {model}")
+
+    segments = [Segment(title=f"C{i}", content=f"text {i}") for i in range(30)]
+    engine = EnrichmentEngine(rpm=10 ** 6, tpm=10 ** 9, backoff_base=0.001, max_retries=3, api_key="test",
+                              fallback_model="gpt-4o-mini", breaker_cooldown=10,
+                              transport=httpx.MockTransport(handler))
+    out = enrich_segments([Segment(s) for s in segments], section_summaries=False, combined=False, engine=engine)
+    assert all(s['summary'] == "from gpt-4o-mini" for s in out)
+    assert state['models'].count("gpt-4") < 20  # without the breaker every call would retry: 240 requests
+
+    state['models'].clear()
+    state['down_until'] = time.monotonic() + 0.15
+    engine = EnrichmentEngine(rpm=10 ** 6, tpm=10 ** 9, backoff_base=0.001, max_retries=3, api_key="test",
+                              breaker_cooldown=0.3, transport=httpx.MockTransport(handler))
+    out = enrich_segments([Segment(s) for s in segments], section_summaries=False, combined=False, engine=engine)
+    assert all(s['summary'] == "from gpt-4" for s in out)  # deferred, then retried after the cool-down
+    assert set(state['models']) == {"gpt-4"} and engine.breaker("gpt-4").opened == 1
+
+
+def test_identical_requests_in_flight_share_one_call():
+    import threading
+    import time
+    calls = []
+
+    def handler(request):
+        calls.append(json.loads(request.content)['messages'][0]['content'])
+        time.sleep(0.05)
+        return _reply("shared")
+
+    engine = EnrichmentEngine(concurrency=8, rpm=10 ** 6, tpm=10 ** 9, api_key="test",
+                              transport=httpx.MockTransport(handler))
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(engine.complete_sync("same"))) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == ["shared"] * 6 and calls == ["same"]
+
+    async def async_handler(request):
+        calls.append(json.loads(request.content)['messages'][0]['content'])
+        await asyncio.sleep(0.05)
+        return _reply("shared")
+
+    async def gather():
+        return await asyncio.gather(*(engine.complete(p) for p in ("a", "a", "b", "a")))
+    engine.transport = httpx.MockTransport(async_handler)
+    assert engine.run(gather) == ["shared"] * 4
+    assert sorted(calls[1:]) == ["a", "b"]
+
+
+def test_culture_fields_come_from_one_request_per_culture(monkeypatch):
+    from scripts import segment_by_culture as sbc
+    prompts = []
+
+    def handler(request):
+        prompts.append(json.loads(request.content)['messages'][0]['content'])
+        return _reply(json.dumps({'summary': "S.", 'tags': ["a", "b"],
+                                  'section_summary': {"Uncategorized": "U.", "Economy": "E."}}))
+
+    engine = EnrichmentEngine(rpm=10000, tpm=10 ** 7, api_key="test", transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(sbc, "default_engine", lambda **options: engine)
+    content = "Intro line\nEconomy\nRice farming.\nEconomy\nFishing."
+    sections = sbc.segment_sections(content)
+    fields = sbc.gpt_enrich_culture(content, "AINU", sections)
+    assert len(prompts) == 1
+    assert fields == {'summary': "S.", 'tags': "a, b", 'section_summary': ["U.", "E.", "E."]}
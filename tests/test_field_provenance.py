@@ -0,0 +1,44 @@
+"""
+test_field_provenance.py - Tests for scripts/field_provenance.py and batch prepare --stale-only.
+"""
+import json
+
+from scripts import batch_requests, field_provenance
+
+PROMPTS = {'kinship': "Describe kinship among the {culture_name}.", 'religion': "Describe {culture_name} religion."}
+SYSTEM = "You are an expert."
+
+
+def _enriched():
+    data = {'culture_name': "Ainu", 'language_tag': "ain", 'kinship': "K.", 'religion': "R.", 'notes': "hand-written"}
+    source = field_provenance.input_hash(data, PROMPTS)
+    for field, template in PROMPTS.items():
+        field_provenance.record(data, field, template, SYSTEM, "gpt-3.5-turbo", source)
+    data['model_used'] = "gpt-3.5-turbo-0125"
+    return data
+
+
+def test_only_fields_whose_prompt_model_or_source_changed_are_stale():
+    data = _enriched()
+    assert field_provenance.stale_fields(data, PROMPTS, SYSTEM, "gpt-3.5-turbo") == []
+
+    edited = dict(PROMPTS, religion="Describe the beliefs of the {culture_name}.")
+    assert field_provenance.stale_fields(data, edited, SYSTEM, "gpt-3.5-turbo") == ["religion"]
+    assert field_provenance.stale_fields(data, PROMPTS, SYSTEM, "gpt-4o-mini") == ["kinship", "religion"]
+    assert field_provenance.stale_fields(data, PROMPTS, "Be brief.", "gpt-3.5-turbo") == ["kinship", "religion"]
+
+    data['kinship'] = "Edited by hand."  # enriched fields are outputs, not inputs
+    assert field_provenance.stale_fields(data, PROMPTS, SYSTEM, "gpt-3.5-turbo") == []
+    data['notes'] = "New source notes."
+    assert field_provenance.stale_fields(data, PROMPTS, SYSTEM, "gpt-3.5-turbo") == ["kinship", "religion"]
+
+    untracked = {'culture_name': "Zulu", 'kinship': "K."}
+    assert field_provenance.stale_fields(untracked, edited, SYSTEM, "gpt-3.5-turbo") == []
+
+
+def test_prepare_stale_only_requests_changed_fields(tmp_path):
+    (tmp_path / "Ainu.v3.json").write_text(json.dumps(_enriched()))
+    edited = dict(PROMPTS, religion="Describe the beliefs of the {culture_name}.")
+    assert list(batch_requests.field_requests(tmp_path, edited, SYSTEM)) == []
+    ids = [r['custom_id'] for r in batch_requests.field_requests(tmp_path, edited, SYSTEM, stale_only=True)]
+    assert ids == ["field|Ainu.v3.json|religion"]
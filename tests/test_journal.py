@@ -0,0 +1,82 @@
+"""
+test_journal.py - Tests for the checkpoint/resume journal in journal.py.
+"""
+import os
+import signal
+
+import pytest
+
+from journal import RunJournal, RunInterrupted, drain_on_sigint, prune_runs
+from segment import Segment
+
+
+def _segments(n, source="a.txt"):
+    return [Segment(title=f"CULTURE {i}", content=f"text {i}", source_file=source, segment_id=str(i)) for i in range(n)]
+
+
+def test_completed_files_survive_reopen_and_detect_changes(tmp_path):
+    src = tmp_path / "a.txt"
+    src.write_text("JAPANESE\nIsland\n", encoding="utf-8")
+    journal = RunJournal("r1", root=str(tmp_path / "runs"))
+    journal.file_done(str(src), _segments(2))
+    journal.close()
+    with open(tmp_path / "runs" / "r1" / "files.jsonl", "a", encoding="utf-8") as f:
+        f.write('{"file": "torn')  # crash mid-write
+
+    resumed = RunJournal("r1", root=str(tmp_path / "runs"))
+    assert resumed.resumed
+    segs = resumed.completed_segments(str(src))
+    assert [s['title'] for s in segs] == ["CULTURE 0", "CULTURE 1"]
+    src.write_text("JAPANESE\nIsland nation\n", encoding="utf-8")
+    assert resumed.completed_segments(str(src)) is None
+    resumed.close()
+
+
+def test_enrich_checkpoints_each_segment_and_skips_them_on_resume(tmp_path):
+    calls = []
+
+    def enrich(todo, on_done):
+        calls.append(len(todo))
+        for seg in todo:
+            seg['summary'] = "paid " + seg['title']
+            on_done(seg)
+
+    def enrich_then_stop(todo, on_done):
+        journal.stop_requested = True  # Ctrl-C while the first segment is in flight
+        enrich(todo, on_done)
+
+    journal = RunJournal("r2", root=str(tmp_path))
+    journal.enrich(_segments(2), enrich)
+    with pytest.raises(RunInterrupted):
+        journal.enrich(_segments(5), enrich_then_stop)
+    journal.close("interrupted")
+    assert calls == [2, 3]  # one call per file; the stop lands after CULTURE 2 is journaled
+    assert all(isinstance(offset, int) for offset in journal._enriched.values())  # fields stay on disk
+
+    calls.clear()
+    resumed = RunJournal("r2", root=str(tmp_path))
+    out = resumed.enrich(_segments(5), enrich)
+    assert calls == [2]  # only CULTURE 3 and 4 are new
+    assert [s['summary'] for s in out] == [f"paid CULTURE {i}" for i in range(5)]
+    assert [s['segment_id'] for s in out] == [str(i) for i in range(5)]
+    resumed.close()
+
+
+def test_first_sigint_requests_a_drain(tmp_path):
+    journal = RunJournal(root=str(tmp_path))
+    with drain_on_sigint(journal):
+        os.kill(os.getpid(), signal.SIGINT)
+        assert journal.stop_requested
+        with pytest.raises(KeyboardInterrupt):
+            os.kill(os.getpid(), signal.SIGINT)
+    journal.close()
+
+
+def test_prune_keeps_the_newest_finished_runs_and_every_resumable_one(tmp_path):
+    root = str(tmp_path / "runs")
+    for run_id, status in (("old", "finished"), ("mid", "finished"), ("cut", "interrupted"), ("new", "finished")):
+        RunJournal(run_id, root=root).close(status)
+    RunJournal("live", root=root)  # still running: no status.json yet
+    assert prune_runs(root, keep=1) == ["mid", "old"]
+    assert sorted(os.listdir(root)) == ["cut", "live", "new"]
+    assert prune_runs(root, keep=1) == [] and prune_runs(str(tmp_path / "missing")) == []
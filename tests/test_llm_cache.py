@@ -0,0 +1,80 @@
+"""
+test_llm_cache.py - Tests for the persistent LLM response cache in scripts/llm_cache.py.
+"""
+import time
+
+import pytest
+
+from scripts.llm_cache import CacheMiss, LLMCache, cache_key
+
+
+def test_key_covers_model_prompts_and_parameters():
+    base = cache_key("gpt-4", "hello", system="sys", temperature=0.7)
+    assert base == cache_key("gpt-4", "hello", system="sys", temperature=0.7)
+    assert base != cache_key("gpt-3.5-turbo", "hello", system="sys", temperature=0.7)
+    assert base != cache_key("gpt-4", "hello", system="other", temperature=0.7)
+    assert base != cache_key("gpt-4", "hello", system="sys", temperature=0.2)
+    assert base != cache_key("gpt-4", "hello", system="sys", temperature=0.7, max_tokens=600)
+
+
+def test_modes_ttl_and_hit_rate(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = LLMCache(path, ttl=60)
+    cache.put("k", "answer", model="gpt-4")
+    assert cache.get("k") == "answer"
+    assert cache.get("missing") is None
+    assert cache.stats()['hit_rate'] == 0.5
+    cache.put("old", "stale")
+    cache._conn.execute("UPDATE responses SET created_at = ? WHERE key = 'old'", (time.time() - 120,))
+    assert cache.get("old") is None
+    cache.close()
+
+    ro = LLMCache(path, "ro")
+    assert ro.get("k") == "answer"
+    ro.put("new", "x")
+    assert ro.get("new") is None
+    ro.close()
+
+    replay = LLMCache(path, "replay")
+    with pytest.raises(CacheMiss):
+        replay.get("new")
+    replay.close()
+
+
+def test_size_eviction_drops_least_recently_used(tmp_path):
+    cache = LLMCache(str(tmp_path / "cache.sqlite"), max_bytes=1000)
+    for i in range(10):
+        cache.put(f"k{i}", "x" * 198)
+        cache._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (i, f"k{i}"))
+    cache._conn.execute("UPDATE responses SET accessed_at = 100 WHERE key = 'k0'")  # recently read
+    assert cache.evict() > 0
+    stats = cache.stats()
+    assert stats['bytes'] <= 1000
+    assert cache.get("k0") is not None and cache.get("k9") is not None
+    assert cache.get("k1") is None
+
+
+def test_rerun_on_cached_inputs_makes_no_requests(tmp_path):
+    httpx = pytest.importorskip("httpx")
+    from scripts.enrichment_engine import EnrichmentEngine
+    from scripts.segment_by_culture import enrich_segments
+    from segment import Segment
+
+    calls = []
+
+    def handler(request):
+        calls.append(1)
+        return httpx.Response(200, json={'choices': [{'message': {'content': f"reply {len(calls)}"}}]})
+
+    def run():
+        engine = EnrichmentEngine(api_key="test", transport=httpx.MockTransport(handler),
+                                  cache=LLMCache(str(tmp_path / "cache.sqlite")))
+        segments = [Segment(title=f"C{i}", content=f"text {i}") for i in range(4)]
+        return [(s['summary'], s['tags']) for s in enrich_segments(segments, section_summaries=False, combined=False, engine=engine)], engine
+
+    first, _ = run()
+    assert len(calls) == 8
+    second, engine = run()
+    assert len(calls) == 8
+    assert second == first
+    assert engine.cache.stats()['hit_rate'] == 1.0
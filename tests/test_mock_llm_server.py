@@ -0,0 +1,70 @@
+"""
+test_mock_llm_server.py - Tests for benchmarks/mock_llm_server.py and the throughput harness.
+"""
+import json
+import urllib.request
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+from benchmarks.mock_llm_server import MockLLMServer, parse_latency  # noqa: E402
+
+
+def test_replies_are_deterministic_and_errors_are_retried():
+    from scripts.enrichment_engine import EnrichmentEngine
+
+    with MockLLMServer(rate_429=0.5, seed=1) as server:
+        engine = EnrichmentEngine(api_key="mock", base_url=server.url, backoff_base=0.001, max_retries=10)
+        replies = [engine.complete_sync(f"prompt {i}") for i in range(10)]
+        engine.close()
+        stats = server.stats()
+        assert stats['ok'] == 10 and stats['429'] > 0
+        assert stats['requests'] == stats['ok'] + stats['429']
+        with urllib.request.urlopen(server.url.replace("/v1", "/stats")) as r:
+            assert json.load(r) == stats
+
+        server.reset()
+        engine = EnrichmentEngine(api_key="mock", base_url=server.url, backoff_base=0.001, max_retries=10)
+        assert [engine.complete_sync(f"prompt {i}") for i in range(10)] == replies
+        engine.close()
+        assert server.stats() == stats  # same injected errors after a reset
+
+
+def test_latency_specs():
+    import random
+    rng = random.Random(0)
+    assert parse_latency("fixed:0.25")(rng) == 0.25
+    assert 0.1 <= parse_latency("uniform:0.1,0.2")(rng) <= 0.2
+    assert parse_latency("lognormal:0.3,0.5")(rng) > 0
+    with pytest.raises(ValueError):
+        parse_latency("gamma:1")
+
+
+def test_throughput_harness_reports_each_level():
+    from benchmarks.llm_throughput import run_throughput
+    params = {'cultures': 4, 'sections': 2, 'lines': 2, 'seed': 0, 'latency': "fixed:0.001", 'rate_429': 0.2,
+              'rate_5xx': 0.1, 'retry_after': None, 'backoff_base': 0.001, 'gpt_mode': "combined"}
+    data = run_throughput(params, targets=["enrich_segments"], levels=(1, 4))
+    rows = data['results']['enrich_segments']
+    assert [r['concurrency'] for r in rows] == [1, 4]
+    for row in rows:
+        assert row['failed_calls'] == 0 and row['calls'] == data['meta']['segments']
+        assert row['requests'] == row['calls'] + row['retries']
+        assert row['p50_ms'] <= row['p99_ms'] and row['requests_per_sec'] > 0
+
+
+def test_malformed_replies_fail_the_segment_not_the_batch():
+    from scripts.enrichment_engine import EnrichmentEngine, GPTError
+    from scripts.segment_by_culture import enrich_segments
+    from segment import Segment
+
+    with MockLLMServer(rate_malformed=1.0) as server:
+        engine = EnrichmentEngine(api_key="mock", base_url=server.url, backoff_base=0.001)
+        with pytest.raises(GPTError, match="malformed"):
+            engine.complete_sync("prompt")
+        out = enrich_segments([Segment(title=f"C{i}", content=f"text {i}") for i in range(3)],
+                              section_summaries=False, engine=engine)
+        engine.close()
+        assert len(out) == 3 and not any('summary' in seg for seg in out)
+        assert server.stats()['malformed'] == server.stats()['requests']
@@ -0,0 +1,69 @@
+"""
+test_segment.py - Tests for the compact Segment record in segment.py.
+"""
+import tracemalloc
+import uuid
+import pandas as pd
+from segment import Segment
+from utils import segment_cultures
+
+
+def make_corpus(n_cultures=2000, lines_per_culture=12):
+    parts = []
+    for i in range(n_cultures):
+        parts.append(f"CULTURE {chr(65 + i % 26)}{chr(65 + (i // 26) % 26)}{chr(65 + (i // 676) % 26)}")
+        parts.extend(f"Line {j} of culture {i}: kinship, values, rituals and daily life." for j in range(lines_per_culture))
+    return "\n".join(parts)
+
+
+def add_metadata(segments):
+    for seg in segments:
+        seg['source_file'] = "batch.txt"
+        seg['run_id'] = "20250101_000000"
+        seg['segment_id'] = str(uuid.uuid4())
+        seg['confidence_score'] = 'medium'
+        seg['needs_attention'] = True
+    return segments
+
+
+def test_segment_behaves_like_a_dict():
+    seg = Segment(title="JAPANESE", content="Island nation")
+    seg['note'] = "extra"
+    assert seg['title'] == "JAPANESE"
+    assert seg.get('summary', '') == ''
+    assert 'segment_id' not in seg
+    assert 'note' in seg
+    assert dict(seg) == {'title': "JAPANESE", 'content': "Island nation", 'note': "extra"}
+    assert seg == {'title': "JAPANESE", 'content': "Island nation", 'note': "extra"}
+    del seg['note']
+    assert len(seg) == 2
+    df = pd.DataFrame([seg, Segment(title="FRENCH", content="Bonjour", tags="a,b")])
+    assert list(df['title']) == ["JAPANESE", "FRENCH"]
+
+
+def test_lazy_content_from_source_offsets():
+    text = "JAPANESE\nOrientation line\nmore\nFRENCH\nBonjour"
+    seg = Segment.from_source("JAPANESE", text, 9, 30)
+    assert seg['content'] == "Orientation line\nmore"
+    copy = seg.copy()
+    seg['content'] += "!"
+    assert seg['content'] == "Orientation line\nmore!"
+    assert copy['content'] == "Orientation line\nmore"
+
+
+def test_segment_memory_is_severalfold_smaller_than_dicts():
+    text = make_corpus()
+    known = set()
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    dict_segments = add_metadata([dict(s) for s in segment_cultures(text, known)])
+    dict_bytes = tracemalloc.get_traced_memory()[0] - base
+    del dict_segments
+    base = tracemalloc.get_traced_memory()[0]
+    compact_segments = add_metadata(segment_cultures(text, known))
+    compact_bytes = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+
+    assert len(compact_segments) == 2000
+    assert dict_bytes / compact_bytes >= 2.5
@@ -0,0 +1,63 @@
+"""
+test_tag_extractor.py - Tests for scripts/tag_extractor.py and local tags in enrich_segments.
+"""
+import json
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from scripts.tag_extractor import TagExtractor  # noqa: E402
+
+CORPUS = [
+    "Rice farming sustains the village. Rice harvest festivals honour the ancestors; rice is shared with elders.",
+    "Herding cattle is central. Cattle are bridewealth, and cattle raids shaped the history of the herders.",
+    "Fishing villages on the coast. Fishing canoes are blessed before fishing season by the village elders.",
+    "Marriage and Family\nMarriage is arranged by the lineage; the family of the groom pays bridewealth.",
+]
+
+
+def test_tags_are_distinctive_terms_ranked_by_tf_idf():
+    results = TagExtractor(max_tags=3).fit_extract(CORPUS)
+    assert [tags[0] for tags, _ in results[:3]] == ["rice", "cattle", "fishing"]
+    assert all(len(tags) <= 3 for tags, _ in results)
+    assert all(0.0 < confidence <= 1.0 for _, confidence in results)
+    # Unknown words contribute nothing; a text without known terms has no tags.
+    assert TagExtractor().fit(CORPUS).extract(["zzzz qqqq", ""]) == [([], 0.0), ([], 0.0)]
+
+
+def test_heading_terms_are_boosted_and_thin_texts_are_not_confident():
+    text = ["The lineage and the groom: lineage elders meet the groom's family."]
+    plain = TagExtractor(max_tags=2).fit(CORPUS + text)
+    boosted = TagExtractor(max_tags=2, heading_boost=5.0).fit(CORPUS + text, headings=["Marriage and Family"])
+    assert plain.extract(text)[0][0] == ["groom", "lineage"]
+    assert boosted.extract(text)[0][0][0] == "family"
+
+    extractor = TagExtractor(max_tags=3, min_tags=3).fit(CORPUS)
+    (_, rich), (_, thin) = extractor.extract([CORPUS[0], "rice"])
+    assert thin < rich  # one tag found where min_tags=3 were wanted
+    with pytest.raises(RuntimeError):
+        TagExtractor().extract(CORPUS)
+
+
+def test_separate_mode_only_asks_gpt_for_tags_the_tagger_is_unsure_of():
+    httpx = pytest.importorskip("httpx")
+    from scripts.enrichment_engine import EnrichmentEngine
+    from scripts.segment_by_culture import enrich_segments, fit_tagger
+    from segment import Segment
+
+    prompts = []
+
+    def handler(request):
+        prompt = json.loads(request.content)['messages'][0]['content']
+        prompts.append(prompt)
+        return httpx.Response(200, json={'choices': [{'message': {'content': "gpt"}}]})
+
+    engine = EnrichmentEngine(rpm=10000, tpm=10 ** 7, api_key="test", transport=httpx.MockTransport(handler))
+    segments = [Segment(title=f"C{i}", content=text) for i, text in enumerate(CORPUS[:3] + ["the of and"])]
+    out = enrich_segments(segments, section_summaries=False, combined=False, engine=engine,
+                          tagger=fit_tagger(segments))
+    assert [s['tags'].split(", ")[0] for s in out[:3]] == ["rice", "cattle", "fishing"]
+    assert out[3]['tags'] == "gpt"  # nothing to tag locally
+    assert sum("keywords or tags" in p for p in prompts) == 1
+    assert all(s['summary'] == "gpt" for s in out)
@@ -0,0 +1,73 @@
+"""
+test_telemetry.py - Tests for per-stage telemetry in telemetry.py.
+"""
+from telemetry import Telemetry, stage
+from core import process_file
+
+
+def test_stage_records_per_stage_and_per_file():
+    t = Telemetry()
+    with t.stage("load", file="a.txt", items=1, nbytes=100):
+        pass
+    with t.stage("load", file="b.txt", items=1, nbytes=50) as rec:
+        rec.items = 2
+    summary = t.summary()
+    assert summary['stages']['load']['calls'] == 2
+    assert summary['stages']['load']['items'] == 3
+    assert summary['stages']['load']['bytes'] == 150
+    assert summary['files']['b.txt']['load']['items'] == 2
+    assert "load" in t.format_summary()
+
+
+def test_stage_helper_is_noop_without_telemetry():
+    with stage(None, "segment") as rec:
+        rec.items = 5
+    assert rec.items == 5
+
+
+def test_process_file_reports_load_and_segment(tmp_path):
+    path = tmp_path / "profile.txt"
+    path.write_text("JAPANESE\nIsland nation\nFRENCH\nBonjour\n", encoding="utf-8")
+    t = Telemetry()
+    segs = process_file(str(path), use_gpt=False, telemetry=t)
+    stages = t.summary()['stages']
+    assert stages['load']['bytes'] == path.stat().st_size
+    assert stages['segment']['items'] == len(segs)
+
+
+def test_stage_profiler_writes_per_stage_outputs(tmp_path):
+    from profiling import StageProfiler
+    t = Telemetry()
+    profiler = StageProfiler(str(tmp_path / "prof"))
+    t.observers.append(profiler)
+    with t.stage("export:csv"):
+        sorted(str(i) for i in range(20000))
+    with t.stage("segment"):
+        sum(range(1000))
+    report = profiler.write()
+    assert "export:csv" in report
+    for suffix in (".pstats", ".collapsed", ".txt"):
+        assert (tmp_path / "prof" / f"export_csv{suffix}").exists()
+    lines = (tmp_path / "prof" / "export_csv.collapsed").read_text().splitlines()
+    assert lines and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+
+def test_memory_profiler_records_peaks_and_sites(tmp_path):
+    import json
+    from profiling import MemoryProfiler
+    t = Telemetry()
+    mem = MemoryProfiler(top=5)
+    t.observers.append(mem)
+    with t.stage("segment", file="a.txt"):
+        kept = [bytearray(1024) for _ in range(2000)]
+    with t.stage("export:csv", file="a.txt"):
+        del kept
+    data = mem.write(str(tmp_path / "diag.memprofile.json"))
+    seg = data['records'][0]
+    assert seg['traced_peak_over_start'] >= 2000 * 1024
+    assert seg['top_allocations'] and "test_telemetry.py" in seg['top_allocations'][0]['site']
+    if seg['rss_start'] is not None:  # sampled during the stage, not the process-lifetime peak
+        assert seg['rss_peak'] >= max(seg['rss_start'], seg['rss_end'])
+        assert seg['rss_peak_over_start'] == seg['rss_peak'] - seg['rss_start']
+    assert set(data['summary']['files']['a.txt']) == {"segment", "export:csv"}
+    assert json.loads((tmp_path / "diag.memprofile.json").read_text())['summary']['stages']['segment']['calls'] == 1
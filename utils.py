@@ -1,6 +1,6 @@
 import re
 import json
-import pandas as pd
+from segment import Segment
 
 def is_culture_title(line, known_cultures):
     """
@@ -11,57 +11,84 @@ def is_culture_title(line, known_cultures):
     known_match = clean in known_cultures
     return regex_match or known_match
 
+# Line separators str.splitlines() honours besides "\n"; if any appear, content
+# can't be expressed as a plain slice of the source text.
+_EXOTIC_LINE_BREAKS = re.compile('[\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]')
+
+def _line_starts(text, lines):
+    """
+    Returns the start offset of each line in text, or None if lines can't be
+    mapped back to exact "\n"-joined slices of text.
+    """
+    if _EXOTIC_LINE_BREAKS.search(text):
+        return None
+    starts = []
+    pos = 0
+    for line in lines:
+        starts.append(pos)
+        pos += len(line) + 1
+    return starts
+
 def segment_cultures(text, known_cultures):
     """
     Segments a text block into culture sections using is_culture_title.
-    Returns a list of dicts with 'title' and 'content'.
+    Returns a list of Segment records with 'title' and 'content'; content is a
+    lazy slice of `text` rather than a copy.
     """
     lines = text.splitlines()
+    starts = _line_starts(text, lines)
+
+    def make(title, first, last):
+        if starts is not None and last > first:
+            return Segment.from_source(title, text, starts[first], starts[last - 1] + len(lines[last - 1]))
+        return Segment(title=title, content='\n'.join(lines[first:last]))
+
     segments = []
     current_title = None
-    current_content = []
-    overview = []
+    content_start = 0
+    overview = None
     found_first_culture = False
     idx = 0
     while idx < len(lines):
         line = lines[idx]
         if is_culture_title(line, known_cultures):
+            title_start = idx
             title_lines = [line.strip()]
             while idx + 1 < len(lines) and is_culture_title(lines[idx + 1], known_cultures):
                 idx += 1
                 title_lines.append(lines[idx].strip())
             title = ' '.join(title_lines)
-            if not found_first_culture and current_content:
-                overview = current_content
-                current_content = []
-                found_first_culture = True
+            if not found_first_culture and title_start > content_start:
+                overview = (content_start, title_start)
             if current_title:
-                segments.append({'title': current_title, 'content': '\n'.join(current_content)})
+                segments.append(make(current_title, content_start, title_start))
             current_title = title
-            current_content = []
+            content_start = idx + 1
             found_first_culture = True
-        else:
-            current_content.append(line)
         idx += 1
     if current_title:
-        segments.append({'title': current_title, 'content': '\n'.join(current_content)})
-    elif current_content:
+        segments.append(make(current_title, content_start, len(lines)))
+    elif len(lines) > content_start:
         if segments:
-            segments[-1]['content'] += '\n' + '\n'.join(current_content)
+            segments[-1]['content'] += '\n' + '\n'.join(lines[content_start:])
         else:
-            overview = current_content
+            overview = (content_start, len(lines))
     if overview:
-        segments.insert(0, {'title': 'Overview', 'content': '\n'.join(overview)})
+        segments.insert(0, make('Overview', *overview))
     return segments
 
 def truncate_for_gpt(text, enc=None, max_tokens=1600):
     """
-    Truncates text to a max token count using encoder if provided, else by char length.
+    Truncates text to a max token count using encoder if provided, else to
+    3.75 characters per token. Text within max_tokens UTF-8 bytes is never
+    over the limit (a token covers at least one byte), so it skips the encoder.
     """
     if enc:
+        if len(text) <= max_tokens and len(text.encode('utf-8')) <= max_tokens:
+            return text
         tokens = enc.encode(text)
-        return enc.decode(tokens[:max_tokens])
-    return text[:6000]
+        return enc.decode(tokens[:max_tokens]) if len(tokens) > max_tokens else text
+    return text[:int(max_tokens * 3.75)]
 
 def load_known_cultures(filepath):
     """
@@ -86,6 +113,7 @@ def load_content(input_path):
         with open(input_path, encoding='utf-8') as f:
             return f.read()
     elif ext in ["xlsx", "xls"]:
+        import pandas as pd
         df = pd.read_excel(input_path)
         return "\n".join(str(row['Content']).strip() for _, row in df.iterrows() if pd.notnull(row['Content']))
     elif ext == "docx":